@@ -1,43 +1,88 @@
+import asyncio
+import os
 from collections import defaultdict
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, Form, HTTPException, Depends
+from fastapi import FastAPI, Request, Form, HTTPException, Depends, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from starlette.middleware.sessions import SessionMiddleware
 from datetime import datetime, timedelta, date, time
 import uuid
 import json
+from typing import List, Optional
 
 from pony.orm import db_session
-from utils.repair import ensure_employee_plan_periods
+from pydantic import ValidationError
 # Importiere Datenbankmodule
-from models import entities
-from config.database import create_test_data
+from models import entities, schemas
+# Registriert die Signal-Empfänger, die EmployeePlanPeriods für neue Perioden und Teammitglieder anlegen
+import utils.provisioning  # noqa: F401
 from utils.db_helpers import (
     get_plan_periods, get_time_of_day_options, get_selected_times,
-    get_user_notes, save_note, toggle_availability, validate_login, get_time_of_day, get_availability_user_date
+    get_user_notes, save_note, toggle_availability_for_day, get_calendar_version,
+    apply_availability_batch
 )
+from utils.async_db import run_db, get_pool_stats, shutdown_executors
+from utils.auth import authenticate, LoginRateLimited
+from utils.sessions import create_session_store, ServerSessionMiddleware
+from utils.tod_cache import get_time_of_days_slim
+from utils.calendar_layout import get_calendar_layout, get_calendar_window
+from utils.period_index import get_period_index, period_label
+from utils.fragment_cache import calendar_fragments, make_etag, etag_matches
+from utils.export import EXPORT_FORMATS, get_export_members, stream_export, is_period_dispatcher
+from utils.bitmaps import BITMAPS_ENABLED, get_period_bitmaps
+from utils.compaction import COMPACTION_INTERVAL_HOURS, run_periodically as run_compaction_periodically
+from utils.coverage import COVERAGE_MIN_PEOPLE, get_coverage
+from utils.scheduler import SCHEDULER_ENABLED, scheduler
+from utils.instrumentation import (
+    configure_logging, get_logger, install_sql_hook, render_prometheus, query_budget, batched_queries,
+    InstrumentationMiddleware, APP_ENV
+)
+
+configure_logging()
+install_sql_hook(entities.db)
+logger = get_logger("app")
 
 # Lifespan-Kontext-Manager für Anwendungsstart und -ende
 @asynccontextmanager
 async def lifespan(app):
     """Wird beim Start und Herunterfahren der Anwendung ausgeführt"""
-    # Beim Start: Erstelle Testdaten, wenn die Datenbank leer ist
-    create_test_data()
+    # Schema und Testdaten werden nicht beim Start angelegt, sondern mit
+    # python -m utils.migrations bzw. python -m utils.seed
+    # Deaktivierte Verfügbarkeiten regelmäßig archivieren (auch manuell: python -m utils.compaction)
+    compaction_task = (asyncio.create_task(run_compaction_periodically())
+                       if COMPACTION_INTERVAL_HOURS > 0 else None)
+    # Deadline-Erinnerungen und Periodenabschlüsse (APSchedulerJob); verpasste Läufe werden beim Start nachgeholt
+    scheduler_task = asyncio.create_task(scheduler.run()) if SCHEDULER_ENABLED else None
     yield
     # Beim Herunterfahren (optional): Aufräumarbeiten
-    print("Anwendung wird heruntergefahren...")
+    for task in (compaction_task, scheduler_task):
+        if task is not None:
+            task.cancel()
+    logger.info("shutdown")
+    shutdown_executors()
 
 # FastAPI-App mit Lifespan-Kontext initialisieren
 app = FastAPI(lifespan=lifespan)
-app.add_middleware(SessionMiddleware, secret_key="supersecretkey")
+# Sitzungen: standardmäßig signiertes Cookie, mit SESSION_BACKEND=memory|sqlite serverseitig (Cookie nur mit id)
+session_store = create_session_store()
+if session_store is None:
+    app.add_middleware(SessionMiddleware, secret_key="supersecretkey")
+else:
+    app.add_middleware(ServerSessionMiddleware, store=session_store)
+# Zuletzt hinzugefügt = äußerste Middleware, misst also den gesamten Request
+app.add_middleware(InstrumentationMiddleware)
+# Abfragebudgets (query_budget) sind für kalte Caches bemessen; batch-availability hat keins,
+# da die Anzahl der Anweisungen mit der Zahl der Änderungen wächst
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Templates
 templates = Jinja2Templates(directory="templates")
+# Ohne auto_reload prüft Jinja nicht bei jedem Rendern die Änderungszeit der Templates (Standard: nur in dev)
+templates.env.auto_reload = os.environ.get("JINJA_AUTO_RELOAD", "1" if APP_ENV == "dev" else "0") == "1"
 
 # Globale Kontext-Variablen für Templates
 templates.env.globals["datetime"] = datetime
@@ -58,8 +103,6 @@ month_names = {
     11: 'November',
     12: 'Dezember'
 }
-# Farben für Planungsperioden
-colors_for_periods = ['bg-blue-800/40', 'bg-emerald-800/40', 'bg-violet-800/40']
 # Farben für die Notifikation:
 notification_colors = {
     'background': {
@@ -82,6 +125,43 @@ def get_current_user(request: Request):
     user = request.session.get("user")
     return user
 
+# Betriebsdaten (Pools, Laufzeiten, SQL-Anweisungen) nur für angemeldete Admins; für einen Scraper ohne
+# Anmeldung explizit mit METRICS_PUBLIC=1 freigeben
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "0") == "1"
+
+def can_view_metrics(request: Request) -> bool:
+    """Prüft, ob der Request die Betriebsendpunkte abrufen darf"""
+    user = get_current_user(request)
+    return METRICS_PUBLIC or bool(user and user.get("is_admin"))
+
+# Kalender-Hilfe-Funktionen
+def parse_date_param(value):
+    """Wandelt einen Query-Parameter im Format YYYY-MM-DD in ein Datum um (ungültig oder leer: None)"""
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+# Cache-Hilfe-Funktionen
+async def cached_fragment_response(request: Request, key, version: str, render):
+    """
+    Liefert ein gerendertes Fragment mit ETag aus dem Fragment-Cache.
+
+    Stimmt If-None-Match mit dem ETag überein, wird 304 ohne Body zurückgegeben. Andernfalls wird das
+    Fragment aus dem Cache genommen oder über die Coroutine render() erzeugt und zwischengespeichert.
+    """
+    etag = make_etag(key, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = calendar_fragments.get(key, version)
+    if body is None:
+        response = await render()
+        body = response.body
+        calendar_fragments.put(key, version, body)
+    return HTMLResponse(content=body, headers=headers)
+
 @app.get("/", name="index", response_class=HTMLResponse)
 async def index(request: Request):
     """Zeigt die Hauptseite mit Login-Modal an"""
@@ -98,6 +178,7 @@ async def index(request: Request):
     )
 
 @app.get("/api/calendar-data", response_class=HTMLResponse)
+@query_budget(10)
 async def get_calendar_data(request: Request):
     """Gibt die Daten für den Kalender zurück"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -117,71 +198,47 @@ async def get_calendar_data(request: Request):
     compact_row_height = 5  # kompakte Höhe
     current_row_height = compact_row_height if compact_mode == "1" else base_row_height
 
-    # Lade Daten aus der Datenbank
-    plan_periods = get_plan_periods()
-    time_of_day_options = get_time_of_day_options(user["id"])
-    
-    selected_times = get_selected_times(user["id"])
-            
-    user_notes = get_user_notes(user["id"])
-
-    # Tage aller Planperioden, gruppieren nach Monat und plan_periods
-    period_colors = {}
-    grouped_dates = {} 
-    period_deadlines = {}
-    period_messages = {}  # Dictionary für die Mitteilungen
-    period_first_month = {}  # Speichert den ersten Monat jeder Periode
-    
-    for period in plan_periods:
-        text_plan_periods = f'{period["start"].strftime("%d.%m.%y")} - {period["end"].strftime("%d.%m.%y")}'
-        period_deadlines[text_plan_periods] = period["deadline"]
-        period_messages[text_plan_periods] = period["message"]
-        
-        # Ersten Monat für jede Periode speichern
-        period_first_month[text_plan_periods] = period["start"].month
+    # Datumsfenster um heute bzw. das angefragte Datum (weitere Perioden werden beim Scrollen nachgeladen)
+    team_id = user.get("team_id")
+    window = await run_db(get_calendar_window, parse_date_param(request.query_params.get("anchor")), None, None, team_id)
+    start, end = (window["start"], window["end"]) if window else (None, None)
+
+    # Unveränderte Daten: Fragment aus dem Cache bzw. 304 liefern
+    version = await run_db(get_calendar_version, user["id"], team_id)
+
+    async def render():
+        # Lade Daten aus der Datenbank
+        time_of_day_options = await run_db(get_time_of_day_options, user["id"])
         
-        for day in range((period['end'] - period['start']).days + 1):
-            day_date = period['start'] + timedelta(days=day)
-            if day_date.month not in grouped_dates:
-                grouped_dates[day_date.month] = {
-                    'year': day_date.year,
-                    'periods': {}
-                }
-            if text_plan_periods not in grouped_dates[day_date.month]['periods']:
-                grouped_dates[day_date.month]['periods'][text_plan_periods] = []
-            grouped_dates[day_date.month]['periods'][text_plan_periods].append(day_date)
-
-    # Sortierte Perioden basierend auf der Startdatum
-    sorted_periods = sorted(list({period for periods in grouped_dates.values() 
-                                for period in periods['periods'].keys()}), 
-                                key=lambda x: (x.split(' - ')[0].split('.')[2], 
-                                                x.split(' - ')[0].split('.')[1], 
-                                                x.split(' - ')[0].split('.')[0]))
-
-    # Generiere Farben für die Planungsperioden
-    for month, month_periods in grouped_dates.items():
-        for period in month_periods['periods'].keys():
-            if period not in period_colors:
-                period_colors.update({period: colors_for_periods[len(period_colors) % len(colors_for_periods)]})
-
-    return templates.TemplateResponse("calendar.html", {
-        "request": request,
-        "grouped_dates": grouped_dates,
-        "period_deadlines": period_deadlines,
-        "period_messages": period_messages,
-        "period_first_month": period_first_month,
-        "selected_times": selected_times,
-        "user_notes": user_notes,
-        "sorted_periods": sorted_periods,
-        "time_of_day_options": time_of_day_options,
-        "compact_mode": compact_mode,
-        "base_row_height": current_row_height,
-        "month_names": month_names,
-        "period_colors": period_colors,
-        "user": user
-    })
+        selected_times = await run_db(get_selected_times, user["id"], None, start, end)
+                
+        user_notes = await run_db(get_user_notes, user["id"])
+
+        # Benutzerunabhängiges Kalender-Layout (zwischengespeichert bis zur nächsten Änderung einer PlanPeriod)
+        layout = await run_db(get_calendar_layout, start, end, window["color_offset"] if window else 0, team_id)
+
+        return templates.TemplateResponse("calendar.html", {
+            "request": request,
+            "window": window,
+            "grouped_dates": layout["grouped_dates"],
+            "period_deadlines": layout["period_deadlines"],
+            "period_messages": layout["period_messages"],
+            "period_first_month": layout["period_first_month"],
+            "selected_times": selected_times,
+            "user_notes": user_notes,
+            "sorted_periods": layout["sorted_periods"],
+            "time_of_day_options": time_of_day_options,
+            "compact_mode": compact_mode,
+            "base_row_height": current_row_height,
+            "month_names": month_names,
+            "period_colors": layout["period_colors"],
+            "user": user
+        })
+
+    return await cached_fragment_response(request, ("calendar.html", str(request.base_url), user["id"], team_id, compact_mode, start, end), version, render)
 
 @app.get("/api/calendar-content", response_class=HTMLResponse)
+@query_budget(8)
 async def get_calendar_content(request: Request):
     """Gibt die Daten für den Kalenderinhalt zurück"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -214,79 +271,135 @@ async def get_calendar_content(request: Request):
     compact_row_height = 5  # kompakte Höhe
     current_row_height = compact_row_height if compact_mode == "1" else base_row_height
 
-    # Lade Daten aus der Datenbank
-    plan_periods = get_plan_periods()
-    time_of_day_options = get_time_of_day_options(user["id"])
-    
-    selected_times = get_selected_times(user["id"])
-
-    # Tage aller Planperioden, gruppieren nach Monat und plan_periods
-    period_colors = {}
-    grouped_dates = {} 
-    period_deadlines = {}
-    period_messages = {}  # Dictionary für die Mitteilungen
-    period_first_month = {}  # Speichert den ersten Monat jeder Periode
-    sorted_periods = []
-    
-    for period in plan_periods:
-        text_plan_periods = f'{period["start"].strftime("%d.%m.%y")} - {period["end"].strftime("%d.%m.%y")}'
-        period_deadlines[text_plan_periods] = period["deadline"]
-        period_messages[text_plan_periods] = period["message"]
-        
-        # Ersten Monat für jede Periode speichern
-        period_first_month[text_plan_periods] = period["start"].month
+    # Datumsfenster um heute bzw. das angefragte Datum (weitere Perioden werden beim Scrollen nachgeladen)
+    team_id = user.get("team_id")
+    window = await run_db(get_calendar_window, parse_date_param(request.query_params.get("anchor")), None, None, team_id)
+    start, end = (window["start"], window["end"]) if window else (None, None)
+
+    # Unveränderte Daten: Fragment aus dem Cache bzw. 304 liefern
+    version = await run_db(get_calendar_version, user["id"], team_id)
+
+    async def render():
+        # Lade Daten aus der Datenbank
+        time_of_day_options = await run_db(get_time_of_day_options, user["id"])
         
-        for day in range((period['end'] - period['start']).days + 1):
-            day_date = period['start'] + timedelta(days=day)
-            if day_date.month not in grouped_dates:
-                grouped_dates[day_date.month] = {
-                    'year': day_date.year,
-                    'periods': {}
-                }
-            if text_plan_periods not in grouped_dates[day_date.month]['periods']:
-                grouped_dates[day_date.month]['periods'][text_plan_periods] = []
-            grouped_dates[day_date.month]['periods'][text_plan_periods].append(day_date)
-
-    # Sortierte Perioden basierend auf der Startdatum
-    sorted_periods = sorted(list({period for periods in grouped_dates.values() 
-                                for period in periods['periods'].keys()}), 
-                                key=lambda x: (x.split(' - ')[0].split('.')[2], 
-                                                x.split(' - ')[0].split('.')[1], 
-                                                x.split(' - ')[0].split('.')[0]))
-
-    # Generiere Farben für die Planungsperioden
-    for month, month_periods in grouped_dates.items():
-        for period in month_periods['periods'].keys():
-            if period not in period_colors:
-                period_colors.update({period: colors_for_periods[len(period_colors) % len(colors_for_periods)]})
+        selected_times = await run_db(get_selected_times, user["id"], None, start, end)
 
-    return templates.TemplateResponse(
-        "calendar_container.html",
-        {
-            "request": request,
-            "grouped_dates": grouped_dates,
-            "period_first_month": period_first_month,
-            "period_deadlines": period_deadlines,
-            "sorted_periods": sorted_periods,
-            "time_of_day_options": time_of_day_options,
-            "selected_times": selected_times,
-            "compact_mode": compact_mode,
-            "base_row_height": current_row_height,
-            "month_names": month_names,
-            "period_colors": period_colors,
-            "user": user
-        }
-    )
+        # Benutzerunabhängiges Kalender-Layout (zwischengespeichert bis zur nächsten Änderung einer PlanPeriod)
+        layout = await run_db(get_calendar_layout, start, end, window["color_offset"] if window else 0, team_id)
+
+        return templates.TemplateResponse(
+            "calendar_container.html",
+            {
+                "request": request,
+                "window": window,
+                "grouped_dates": layout["grouped_dates"],
+                "period_first_month": layout["period_first_month"],
+                "period_deadlines": layout["period_deadlines"],
+                "sorted_periods": layout["sorted_periods"],
+                "time_of_day_options": time_of_day_options,
+                "selected_times": selected_times,
+                "compact_mode": compact_mode,
+                "base_row_height": current_row_height,
+                "month_names": month_names,
+                "period_colors": layout["period_colors"],
+                "user": user
+            }
+        )
+
+    return await cached_fragment_response(request, ("calendar_container.html", str(request.base_url), user["id"], team_id, compact_mode, start, end), version, render)
+
+@app.get("/api/calendar-chunk", name="get_calendar_chunk", response_class=HTMLResponse)
+@query_budget(8)
+async def get_calendar_chunk(request: Request):
+    """
+    Liefert den nächsten (after=YYYY-MM-DD) bzw. vorherigen (before=YYYY-MM-DD) Abschnitt des Kalenders
+    zum Nachladen beim Scrollen
+    """
+    # Prüfe, ob der Benutzer eingeloggt ist
+    user = get_current_user(request)
+    if not user:
+        return templates.TemplateResponse(
+            "notification_error.html",
+            {
+                "request": request,
+                "message": "Bitte melden Sie sich an"
+            }
+        )
+
+    after = parse_date_param(request.query_params.get("after"))
+    before = parse_date_param(request.query_params.get("before"))
+    if not after and not before:
+        return templates.TemplateResponse(
+            "notification_error.html",
+            {
+                "request": request,
+                "message": "Ungültiger Kalenderabschnitt"
+            }
+        )
+
+    # Lese compact_mode aus Query-Parametern
+    compact_mode = request.query_params.get("compact", "0")
+    current_row_height = 5 if compact_mode == "1" else 9
+
+    team_id = user.get("team_id")
+    window = await run_db(get_calendar_window, None, after, before, team_id)
+    if window is None:
+        return HTMLResponse("")
+
+    version = await run_db(get_calendar_version, user["id"], team_id)
+
+    async def render():
+        time_of_day_options = await run_db(get_time_of_day_options, user["id"])
+        selected_times = await run_db(get_selected_times, user["id"], None, window["start"], window["end"])
+        layout = await run_db(get_calendar_layout, window["start"], window["end"], window["color_offset"], team_id)
+        months = {(group["year"], month) for month, group in layout["grouped_dates"].items()}
+
+        return templates.TemplateResponse(
+            "calendar_months.html",
+            {
+                "request": request,
+                # Nach unten: Setzt der Abschnitt den letzten Monat fort, wird dessen Titel nicht wiederholt
+                "window": dict(window, has_earlier=False) if after else dict(window, has_later=False),
+                "continued_month": (after.year, after.month) if after else None,
+                # Nach oben: Der Titel des bisher ersten Monats wandert in diesen Abschnitt
+                "replaced_month_header": (before.year, before.month) if before and (before.year, before.month) in months else None,
+                "grouped_dates": layout["grouped_dates"],
+                "period_first_month": layout["period_first_month"],
+                "period_deadlines": layout["period_deadlines"],
+                "time_of_day_options": time_of_day_options,
+                "selected_times": selected_times,
+                "compact_mode": compact_mode,
+                "base_row_height": current_row_height,
+                "month_names": month_names,
+                "period_colors": layout["period_colors"]
+            }
+        )
+
+    key = ("calendar_months.html", str(request.base_url), user["id"], team_id, compact_mode, "after" if after else "before",
+           window["start"], window["end"])
+    return await cached_fragment_response(request, key, version, render)
 
 @app.post("/api/login", name="login")
+@query_budget(16)
 async def login(request: Request):
     """Authentifiziert den Benutzer"""
     form = await request.form()
     username = form.get("username")
     password = form.get("password")
     
-    # Überprüfe die Anmeldedaten gegen die Datenbank
-    user = validate_login(username, password)
+    # Überprüfe die Anmeldedaten gegen die Datenbank (Hash-Prüfung im eigenen Pool, begrenzte Versuche)
+    try:
+        user = await authenticate(username, password, request.client.host if request.client else "unknown")
+    except LoginRateLimited as e:
+        return JSONResponse(
+            content={
+                "error": True,
+                "error_message": "Zu viele Anmeldeversuche, bitte später erneut versuchen"
+            },
+            status_code=429,
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.5)))}
+        )
     
     if user:
         # Bei erfolgreicher Anmeldung den Benutzer in der Session speichern
@@ -338,6 +451,7 @@ async def reset_password_request(request: Request):
     )
 
 @app.post("/api/load-period-notes", name="load_period_notes")
+@query_budget(4)
 async def load_period_notes(request: Request):
     """Lädt die Notizen für eine bestimmte Planungsperiode"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -365,16 +479,11 @@ async def load_period_notes(request: Request):
         )
         
     # Lade Daten aus der Datenbank
-    plan_periods = get_plan_periods()
-    user_notes = get_user_notes(user["id"])
+    period_index = await run_db(get_period_index, user.get("team_id"))
+    user_notes = await run_db(get_user_notes, user["id"])
     
-    # Finde die entsprechende Periode
-    period_data = None
-    for p in plan_periods:
-        text_plan_periods = f'{p["start"].strftime("%d.%m.%y")} - {p["end"].strftime("%d.%m.%y")}'
-        if text_plan_periods == period:
-            period_data = p
-            break
+    # Finde die entsprechende Periode über den Intervall-Index
+    period_data = period_index.find_by_label(period)
     
     if not period_data:
         return templates.TemplateResponse(
@@ -398,6 +507,7 @@ async def load_period_notes(request: Request):
     )
 
 @app.post("/api/save-notes", name="save_notes")
+@query_budget(4)
 async def save_notes_handler(request: Request):
     """Speichert die Notizen für eine bestimmte Planungsperiode"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -427,7 +537,7 @@ async def save_notes_handler(request: Request):
             )
             
         # Speichere die Notiz in der Datenbank
-        success = save_note(user["id"], period, notes)
+        success = await run_db(save_note, user["id"], period, notes, user.get("team_id"))
         
         return templates.TemplateResponse("notification_notes.html", {
             "request": request,
@@ -444,6 +554,7 @@ async def save_notes_handler(request: Request):
         )
 
 @app.post("/api/get-time-of-day-options", name="get_time_of_day_options")
+@query_budget(3)
 async def get_time_of_day_options_handler(request: Request):
     """Gibt die verfügbaren Tageszeiten für einen bestimmten Tag zurück"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -484,9 +595,9 @@ async def get_time_of_day_options_handler(request: Request):
             )
         
         # Hole Daten aus der Datenbank
-        time_options = get_time_of_day_options(user["id"])
+        time_options = await run_db(get_time_of_day_options, user["id"])
         
-        selected_times = get_selected_times(user["id"])
+        selected_times = await run_db(get_selected_times, user["id"], None, date_obj, date_obj)
         
         # Hole ausgewählte Zeiten für dieses Datum
         selected_tod_ids = selected_times.get(date_str, [])
@@ -500,7 +611,7 @@ async def get_time_of_day_options_handler(request: Request):
             "selected_tod_ids": selected_tod_ids
         })
     except Exception as e:
-        print(f"Fehler in get_time_of_day_options_handler: {e}")
+        logger.exception("get_time_of_day_options_handler failed")
         return templates.TemplateResponse(
             "notification_error.html",
             {
@@ -510,6 +621,7 @@ async def get_time_of_day_options_handler(request: Request):
         )
 
 @app.post("/api/select-time-of-day", name="select_time_of_day")
+@query_budget(8)
 async def select_time_of_day(request: Request):
     """Wählt eine bestimmte Tageszeit für ein Datum aus oder entfernt sie"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -537,13 +649,14 @@ async def select_time_of_day(request: Request):
                 }
             )
         
-        # Verfügbarkeit in der Datenbank umschalten
+        # Verfügbarkeit in der Datenbank umschalten und aktive Tageszeiten des Tages für die Indikatoren holen
         try:
-            availability = toggle_availability(user["id"], date_str, tod_id)
+            availability, day_tod_ids = await run_db(toggle_availability_for_day, user["id"], date_str, tod_id,
+                                                     user.get("team_id"))
         except Exception as e:
             # Detaillierte Fehlermeldung an den Client zurückgeben
             error_message = str(e)
-            print(f"Fehler beim Umschalten der Verfügbarkeit: {error_message}")
+            logger.exception("toggle_availability failed", extra={'fields': {'date': date_str, 'tod_id': tod_id}})
             return templates.TemplateResponse(
                 "notification_error.html",
                 {
@@ -552,7 +665,16 @@ async def select_time_of_day(request: Request):
                 }
             )
 
-        tod = get_time_of_day(tod_id)
+        time_of_days = await run_db(get_time_of_days_slim, user["id"])
+        tod = time_of_days.get(tod_id)
+        if not tod:
+            return templates.TemplateResponse(
+                "notification_error.html",
+                {
+                    "request": request,
+                    "message": "Tageszeit nicht gefunden"
+                }
+            )
             
         curr_notification_colors = {
             'background': notification_colors['background']['checked' if availability.prep_delete is None else 'unchecked'],
@@ -570,10 +692,12 @@ async def select_time_of_day(request: Request):
                 "tod": tod,
                 "is_checked": availability.prep_delete is None,
                 "curr_notification_colors": curr_notification_colors,
+                # Out-of-Band: Indikatoren des Tages in derselben Antwort aktualisieren
+                "selected_tods": [time_of_days[t] for t in day_tod_ids if t in time_of_days],
             }
         )
     except Exception as e:
-        print(f"Allgemeiner Fehler in select_time_of_day: {e}")
+        logger.exception("select_time_of_day failed")
         return templates.TemplateResponse(
             "notification_error.html",
             {
@@ -582,7 +706,81 @@ async def select_time_of_day(request: Request):
             }
         )
 
+@app.post("/api/batch-availability", name="batch_availability")
+async def batch_availability(request: Request):
+    """
+    Wendet mehrere Änderungen an Verfügbarkeiten in einer Transaktion an (Tage/Tageszeiten setzen oder
+    entfernen, Woche kopieren, Periode leeren) und liefert die Indikatoren aller geänderten Tage als
+    Out-of-Band-Swaps zurück.
+
+    Erwartet JSON im Format von schemas.AvailabilityBatchRequest, alternativ als Formularfeld "operations".
+    """
+    # Prüfe, ob der Benutzer eingeloggt ist
+    user = get_current_user(request)
+    if not user:
+        return templates.TemplateResponse(
+            "notification_error.html",
+            {
+                "request": request,
+                "message": "Bitte melden Sie sich an"
+            }
+        )
+    
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            payload = await request.json()
+        else:
+            form = await request.form()
+            payload = {"operations": json.loads(form.get("operations") or "[]")}
+        batch = schemas.AvailabilityBatchRequest.model_validate(payload)
+    except (ValueError, ValidationError) as e:
+        return templates.TemplateResponse(
+            "notification_error.html",
+            {
+                "request": request,
+                "message": f"Ungültige Änderungen: {str(e)}"
+            }
+        )
+
+    try:
+        changed_days = await run_db(apply_availability_batch, user["id"], batch.operations, user.get("team_id"))
+    except ValueError as e:
+        # Unbekannte Tageszeiten oder Perioden, fehlende Angaben, zu viele Tage
+        return templates.TemplateResponse(
+            "notification_error.html",
+            {
+                "request": request,
+                "message": f"Ungültige Änderungen: {str(e)}"
+            }
+        )
+    except Exception as e:
+        logger.exception("batch_availability failed")
+        return templates.TemplateResponse(
+            "notification_error.html",
+            {
+                "request": request,
+                "message": f"Fehler beim Speichern der Änderungen: {str(e)}"
+            }
+        )
+
+    # Tageszeiten für die Indikatoren aus dem Cache
+    time_of_days = await run_db(get_time_of_days_slim, user["id"])
+    days = []
+    for date_str, tod_ids in changed_days.items():
+        selected_tods = sorted((time_of_days[tod_id] for tod_id in tod_ids if tod_id in time_of_days),
+                               key=lambda tod: tod.start)
+        days.append((date_str, selected_tods))
+
+    return templates.TemplateResponse(
+        "day_indicators_batch.html",
+        {
+            "request": request,
+            "days": days
+        }
+    )
+
 @app.post("/api/update-day-indicators", name="update_day_indicators")
+@query_budget(3)
 async def update_day_indicators(request: Request):
     """Aktualisiert die Indikatoren für einen bestimmten Tag nach Auswahl/Abwahl einer Tageszeit"""
     # Prüfe, ob der Benutzer eingeloggt ist
@@ -599,7 +797,6 @@ async def update_day_indicators(request: Request):
     try:
         form = await request.form()
         date_str = form.get("date")
-        print(f"Updating day indicators for {date_str}")
         
         if not date_str:
             return templates.TemplateResponse(
@@ -612,14 +809,14 @@ async def update_day_indicators(request: Request):
             
         date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
         
-        # Hole aktive Verfügbarkeiten für dieses Datum
-        availabilities_on_date = get_availability_user_date(user["id"], date_str)
+        # Hole die IDs der aktiven Tageszeiten für dieses Datum
+        selected_times = await run_db(get_selected_times, user["id"], None, date_obj, date_obj)
         
-        # Hole die vollständigen TimeOfDay-Daten für die aktiven Verfügbarkeiten
+        # Hole die Tageszeiten des Benutzers aus dem Cache
+        time_of_days = await run_db(get_time_of_days_slim, user["id"])
         selected_tods = []
-        for availability in availabilities_on_date:
-            print(f"{availability.time_of_day.name=}, {availability.prep_delete}")
-            tod = get_time_of_day(str(availability.time_of_day.id))
+        for tod_id in selected_times.get(date_str, []):
+            tod = time_of_days.get(tod_id)
             if tod:
                 selected_tods.append(tod)
         
@@ -633,7 +830,7 @@ async def update_day_indicators(request: Request):
             }
         )
     except Exception as e:
-        print(f"Fehler in update_day_indicators: {str(e)}")
+        logger.exception("update_day_indicators failed")
         return templates.TemplateResponse(
             "notification_error.html",
             {
@@ -643,27 +840,142 @@ async def update_day_indicators(request: Request):
         )
 
 @app.get("/get-calendar-menus", response_class=HTMLResponse)
+@query_budget(2)
 async def get_calendar_menus(request: Request):
     """Liefert die Menüs für den Kalender"""
     # Prüfe, ob der Benutzer eingeloggt ist
     user = get_current_user(request)
     
-    # Lade Planungsperioden aus der Datenbank
-    plan_periods = get_plan_periods()
-    
-    # Sortierte Perioden basierend auf dem Startdatum
-    sorted_periods = [f'{period["start"].strftime("%d.%m.%y")} - {period["end"].strftime("%d.%m.%y")}' for period in plan_periods]
+    # Alle Perioden des Teams aus dem Index, auch die außerhalb des geladenen Kalenderfensters
+    period_index = await run_db(get_period_index, user.get("team_id") if user else None)
     
     return templates.TemplateResponse("menus_calendar.html", {
         "request": request,
-        "sorted_periods": sorted_periods,
+        "sorted_periods": [(period_label(p["start"], p["end"]), p["start"]) for p in period_index.periods
+                           if p["end"] >= p["start"]],
         "user": user
     })
 
+@app.get("/api/export/availabilities", name="export_availabilities")
+@batched_queries
+async def export_availabilities(request: Request, period_id: str, format: str = "csv"):
+    """
+    Exportiert alle Verfügbarkeiten eines Teams in einer Planungsperiode als CSV, JSON oder NDJSON.
+
+    Nur für den Disponenten des Teams. Die Zeilen werden in Batches geladen und gestreamt; die Anzahl
+    der SQL-Anweisungen wächst mit der Teamgröße, daher gibt es kein Abfragebudget.
+    """
+    user = get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": True, "error_message": "Bitte melden Sie sich an"},
+                            status_code=401)
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(
+            content={"error": True, "error_message": f"Unbekanntes Format, erlaubt: {', '.join(EXPORT_FORMATS)}"},
+            status_code=400
+        )
+
+    export = await run_db(get_export_members, period_id, user["id"])
+    if export is None:
+        return JSONResponse(
+            content={"error": True, "error_message": "Planungsperiode nicht gefunden oder kein Zugriff"},
+            status_code=404
+        )
+    period, epp_ids = export
+    filename = f"verfuegbarkeiten_{period['start'].isoformat()}_{period['end'].isoformat()}.{format}"
+    return StreamingResponse(
+        stream_export(period, epp_ids, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/coverage", name="coverage", response_class=HTMLResponse)
+@query_budget(6)
+async def coverage(request: Request, period_id: str, min_people: int = COVERAGE_MIN_PEOPLE):
+    """Zeigt dem Disponenten die Abdeckung einer Planungsperiode als Heatmap (Datum × Tageszeit)"""
+    user = get_current_user(request)
+    if not user:
+        return RedirectResponse(url="/", status_code=303)
+
+    try:
+        report = await run_db(get_coverage, period_id, user["id"], min_people)
+    except ImportError as e:
+        # NumPy ist eine optionale Abhängigkeit
+        return templates.TemplateResponse("error.html", {"request": request, "message": str(e)}, status_code=503)
+    if report is None:
+        return templates.TemplateResponse(
+            "error.html",
+            {
+                "request": request,
+                "message": "Planungsperiode nicht gefunden oder kein Zugriff"
+            },
+            status_code=404
+        )
+    return templates.TemplateResponse("coverage.html", {"request": request, "report": report})
+
+@app.get("/api/team-availability", name="team_availability")
+@query_budget(6)
+async def team_availability(request: Request, period_id: str, date_str: Optional[str] = Query(None, alias="date"),
+                            slot: Optional[str] = None, person_id: Optional[List[str]] = Query(None)):
+    """
+    Beantwortet Teamabfragen einer Planungsperiode aus dem Bitmap-Speicher (AVAILABILITY_BITMAPS=1).
+
+    Mit date und slot: die an diesem Tag zu dieser Tageszeit verfügbaren Personen. Sonst alle Slots, in
+    denen alle bzw. keine der Personen (alle Mitglieder oder die per person_id angegebenen) verfügbar sind.
+    """
+    user = get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": True, "error_message": "Bitte melden Sie sich an"},
+                            status_code=401)
+    if not BITMAPS_ENABLED:
+        return JSONResponse(
+            content={"error": True, "error_message": "Der Bitmap-Speicher ist nicht aktiviert"},
+            status_code=503
+        )
+    day = parse_date_param(date_str)
+    if date_str and day is None:
+        return JSONResponse(content={"error": True, "error_message": "Ungültiges Datum"}, status_code=400)
+    if not await run_db(is_period_dispatcher, period_id, user["id"]):
+        return JSONResponse(
+            content={"error": True, "error_message": "Planungsperiode nicht gefunden oder kein Zugriff"},
+            status_code=404
+        )
+
+    bitmaps = await run_db(get_period_bitmaps, period_id)
+    if day and slot:
+        return JSONResponse(content={
+            "date": day.isoformat(),
+            "slot": slot,
+            "available": [{"person_id": p, "name": bitmaps.members[p]} for p in bitmaps.available_persons(day, slot)],
+        })
+    everyone = bitmaps.intersection(person_id)
+    nobody = bitmaps.full_mask() & ~bitmaps.union(person_id)
+    return JSONResponse(content={
+        "period_id": period_id,
+        "slots": bitmaps.slots,
+        "persons": len(person_id) if person_id else len(bitmaps.members),
+        "all_available": [{"date": d.isoformat(), "slot": s} for d, s in bitmaps.decode(everyone)],
+        "nobody_available": [{"date": d.isoformat(), "slot": s} for d, s in bitmaps.decode(nobody)],
+    })
+
+@app.get("/api/db-pool-stats", name="db_pool_stats")
+async def db_pool_stats(request: Request):
+    """Liefert die Auslastung und Warteschlangentiefe der Datenbank-Pools"""
+    if not can_view_metrics(request):
+        return JSONResponse(content={"error": True, "error_message": "Nicht berechtigt"}, status_code=403)
+    return JSONResponse(content={"pools": get_pool_stats()})
+
+@app.get("/metrics", name="metrics")
+async def metrics_endpoint(request: Request):
+    """Liefert Laufzeiten und SQL-Anweisungen pro Endpunkt und Hilfsfunktion im Prometheus-Format"""
+    if not can_view_metrics(request):
+        return Response(content="Nicht berechtigt\n", status_code=403, media_type="text/plain")
+    return Response(content=render_prometheus(get_pool_stats()), media_type="text/plain; version=0.0.4")
+
 @app.exception_handler(500)
 async def internal_server_error(request: Request, exc: Exception):
     """Handler für interne Serverfehler"""
-    print(f"Server Error: {exc}")  # Debug print
+    logger.error("server error", exc_info=exc)
     if "hx-request" in request.headers:
         # HTMX Request - zeige Notification
         return templates.TemplateResponse(
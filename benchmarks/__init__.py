@@ -0,0 +1 @@
+# Benchmarks für den Verfügbarkeitskalender (Aufruf z.B. mit python -m benchmarks.calendar_render)
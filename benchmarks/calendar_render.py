@@ -0,0 +1,104 @@
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader
+
+from utils.calendar_grid import build_calendar_layout
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+
+# Monatsnamen wie in app.py
+month_names = {
+    1: 'Januar', 2: 'Februar', 3: 'März', 4: 'April', 5: 'Mai', 6: 'Juni',
+    7: 'Juli', 8: 'August', 9: 'September', 10: 'Oktober', 11: 'November', 12: 'Dezember'
+}
+
+
+def make_environment() -> Environment:
+    """Jinja-Umgebung wie in app.py, url_for liefert ohne Request nur den Routennamen"""
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True)
+    env.globals["datetime"] = datetime
+    env.globals["url_for"] = lambda name, **path_params: f"/{name}"
+    return env
+
+
+def make_context(months: int, options: int, selections_per_day: int, seed: int = 1):
+    """Erzeugt Kalenderdaten für die angegebene Anzahl Monate mit 20-tägigen Planungsperioden"""
+    rng = random.Random(seed)
+    start = date(2025, 1, 1)
+    end = date(2025 + (months - 1) // 12, (months - 1) % 12 + 1, 1)
+    end = (end.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+    plan_periods = []
+    period_start = start
+    while period_start <= end:
+        period_end = min(period_start + timedelta(days=19), end)
+        plan_periods.append({
+            'id': str(uuid.uuid4()),
+            'start': period_start,
+            'end': period_end,
+            'deadline': period_end - timedelta(days=1),
+            'message': ''
+        })
+        period_start = period_end + timedelta(days=1)
+
+    time_of_day_options = [
+        {'id': str(uuid.uuid4()), 'name': f'Tageszeit {i}', 'color': 'amber-500'}
+        for i in range(options)
+    ]
+    selected_times = {}
+    for ordinal in range(start.toordinal(), end.toordinal() + 1):
+        day = date.fromordinal(ordinal)
+        selected_times[day.strftime('%Y-%m-%d')] = [
+            option['id'] for option in rng.sample(time_of_day_options, selections_per_day)
+        ]
+
+    layout = build_calendar_layout(plan_periods)
+    return {
+        "grouped_dates": layout["grouped_dates"],
+        "period_first_month": layout["period_first_month"],
+        "period_deadlines": layout["period_deadlines"],
+        "sorted_periods": layout["sorted_periods"],
+        "time_of_day_options": time_of_day_options,
+        "selected_times": selected_times,
+        "compact_mode": "0",
+        "base_row_height": 9,
+        "month_names": month_names,
+        "period_colors": layout["period_colors"],
+        "user": None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Misst die Renderzeit von calendar_container.html")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--options", type=int, default=6, help="Tageszeiten pro Benutzer")
+    parser.add_argument("--selections", type=int, default=2, help="Ausgewählte Tageszeiten pro Tag")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    env = make_environment()
+    template = env.get_template("calendar_container.html")
+    context = make_context(args.months, args.options, args.selections)
+
+    html = template.render(context)  # Aufwärmen
+    timings = []
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        template.render(context)
+        timings.append((time.perf_counter() - t) * 1000)
+
+    days = sum(len(dates) for month in context["grouped_dates"].values() for dates in month["periods"].values())
+    print(f"calendar_container.html: {args.months} Monate, {days} Tage, {args.options} Tageszeiten, "
+          f"{args.selections} Auswahlen pro Tag, {len(html) / 1024:.0f} KiB")
+    print(f"  min {min(timings):.1f} ms | median {statistics.median(timings):.1f} ms | max {max(timings):.1f} ms "
+          f"({args.repeat} Durchläufe)")
+
+
+if __name__ == "__main__":
+    main()
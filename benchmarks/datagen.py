@@ -0,0 +1,176 @@
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, time as day_time, timedelta
+from typing import Any, Dict
+
+# Tageszeiten der generierten Benutzer (Name, Beginn, Dauer in Stunden, Farbe)
+TIME_OF_DAY_TEMPLATES = [
+    ('Früher Morgen', 6, 3, 'yellow-400'),
+    ('Vormittag', 9, 3, 'amber-500'),
+    ('Mittag', 12, 2, 'orange-500'),
+    ('Nachmittag', 14, 3, 'orange-600'),
+    ('Abend', 17, 3, 'red-500'),
+    ('Spätabend', 20, 3, 'purple-500'),
+    ('Nacht', 23, 4, 'blue-500'),
+    ('Bereitschaft', 0, 24, 'green-500'),
+]
+
+BENCH_PASSWORD = "bench"
+
+
+def bench_username(team: int, user: int) -> str:
+    """Benutzername eines generierten Benutzers, z.B. bench_t0_u3"""
+    return f"bench_t{team}_u{user}"
+
+
+def generate(teams: int = 4, users: int = 25, periods: int = 24, period_days: int = 14, tods: int = 6,
+             density: float = 0.3, start: date = date(2025, 1, 6), seed: int = 1) -> Dict[str, Any]:
+    """
+    Legt das Schema an und füllt die (leere) Datenbank unter DB_PATH mit synthetischen Daten.
+
+    Args:
+        teams (int): Anzahl der Teams
+        users (int): Benutzer pro Team
+        periods (int): Planungsperioden pro Team, lückenlos ab start
+        period_days (int): Länge einer Planungsperiode in Tagen
+        tods (int): Tageszeiten pro Benutzer (höchstens len(TIME_OF_DAY_TEMPLATES))
+        density (float): Wahrscheinlichkeit, dass ein Benutzer eine Tageszeit an einem Tag auswählt
+        start (date): Beginn der ersten Planungsperiode
+        seed (int): Startwert des Zufallsgenerators, gleiche Parameter ergeben gleiche Verfügbarkeiten
+
+    Returns:
+        Dict[str, Any]: Parameter und Anzahl der angelegten Zeilen pro Tabelle
+    """
+    from pony.orm import db_session, select
+    from models.entities import db, Person, Project, Team, PlanPeriod, TimeOfDay, EmployeePlanPeriod, Availability
+    from utils.migrations import add_composite_indexes, create_schema
+    from utils.provisioning import provision_all_teams
+    from utils.passwords import hash_password
+    from config.database import DB_PATH
+
+    if tods > len(TIME_OF_DAY_TEMPLATES):
+        raise ValueError(f"Höchstens {len(TIME_OF_DAY_TEMPLATES)} Tageszeiten pro Benutzer möglich")
+    rng = random.Random(seed)
+    now = datetime.now()
+    create_schema()
+    # Ein Hash für alle Benutzer genügt für Benchmarks und spart die scrypt-Laufzeit pro Benutzer
+    password_hash = hash_password(BENCH_PASSWORD)
+
+    with db_session:
+        if Person.select().count() > 0:
+            raise RuntimeError(f"Datenbank {DB_PATH} enthält bereits Daten")
+
+        admin = Person(f_name="Bench", l_name="Admin", email="bench-admin@example.com", username="bench_admin",
+                       password=password_hash, created_at=now, latest_change=now)
+        project = Project(name="Benchmark-Projekt", active=True, created_at=now, latest_change=now, admin=admin)
+        admin.project_of_admin = project
+
+        for t in range(teams):
+            team = Team(name=f"Benchmark-Team {t}", created_at=now, latest_change=now, dispatcher=admin,
+                        project=project)
+            for p in range(periods):
+                period_start = start + timedelta(days=p * period_days)
+                period_end = period_start + timedelta(days=period_days - 1)
+                PlanPeriod(start=period_start, end=period_end, deadline=period_start - timedelta(days=7),
+                           created_at=now, latest_change=now, team=team)
+            for u in range(users):
+                person = Person(f_name=f"Benutzer {u}", l_name=f"Team {t}", email=f"{bench_username(t, u)}@example.com",
+                                username=bench_username(t, u), password=password_hash, created_at=now,
+                                latest_change=now, team=team)
+                for name, hour, hours, color in TIME_OF_DAY_TEMPLATES[:tods]:
+                    TimeOfDay(name=name, start=day_time(hour), delta=timedelta(hours=hours),
+                              color=color, created_at=now, latest_change=now, person=person)
+
+    # Die Signal-Empfänger legen die EmployeePlanPeriods bereits beim Speichern an; der Aufruf prüft nur nach
+    provision_all_teams()
+
+    # Verfügbarkeiten per executemany, ohne Entities im Cache aufzubauen
+    with db_session:
+        tods_by_person: Dict[uuid.UUID, list] = {}
+        for person_id, tod_id in select((t.person.id, t.id) for t in TimeOfDay).order_by(1, 2):
+            tods_by_person.setdefault(person_id, []).append(tod_id)
+        epps = select((e.id, e.person.id, e.plan_period.start, e.plan_period.end)
+                      for e in EmployeePlanPeriod).order_by(2, 3)[:]
+
+        timestamp = now.isoformat(' ', timespec='microseconds')
+        rows = []
+        for epp_id, person_id, period_start, period_end in epps:
+            for ordinal in range(period_start.toordinal(), period_end.toordinal() + 1):
+                day = date.fromordinal(ordinal).isoformat()
+                for tod_id in tods_by_person[person_id]:
+                    if rng.random() < density:
+                        rows.append((uuid.UUID(int=rng.getrandbits(128), version=4).bytes, '', timestamp, timestamp,
+                                     tod_id.bytes, epp_id.bytes, day))
+        db.get_connection().cursor().executemany(
+            'INSERT INTO "Availability" ("id", "notes", "created_at", "latest_change", "time_of_day", '
+            '"employee_plan_period", "date") VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+
+    # Indizes sicherstellen und Statistiken für den Abfrageplaner aktualisieren
+    add_composite_indexes(DB_PATH)
+
+    with db_session:
+        counts = {
+            'teams': Team.select().count(),
+            'persons': Person.select().count(),
+            'plan_periods': PlanPeriod.select().count(),
+            'time_of_days': TimeOfDay.select().count(),
+            'employee_plan_periods': EmployeePlanPeriod.select().count(),
+            'availabilities': Availability.select().count(),
+        }
+    return {
+        'params': {'teams': teams, 'users': users, 'periods': periods, 'period_days': period_days, 'tods': tods,
+                   'density': density, 'start': start.isoformat(), 'seed': seed},
+        'counts': counts,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Parameter des Datengenerators, auch für benchmarks.endpoints"""
+    parser.add_argument("--teams", type=int, default=4)
+    parser.add_argument("--users", type=int, default=25, help="Benutzer pro Team")
+    parser.add_argument("--periods", type=int, default=24, help="Planungsperioden pro Team")
+    parser.add_argument("--period-days", type=int, default=14)
+    parser.add_argument("--tods", type=int, default=6, help="Tageszeiten pro Benutzer")
+    parser.add_argument("--density", type=float, default=0.3,
+                        help="Anteil der (Tag, Tageszeit)-Paare mit Verfügbarkeit")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 6),
+                        help="Beginn der ersten Planungsperiode (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def generate_from_args(args: argparse.Namespace) -> Dict[str, Any]:
+    return generate(teams=args.teams, users=args.users, periods=args.periods, period_days=args.period_days,
+                    tods=args.tods, density=args.density, start=args.start, seed=args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Erzeugt eine Datenbank mit synthetischen Testdaten")
+    parser.add_argument("--db", required=True, help="Pfad der neuen SQLite-Datenbank")
+    parser.add_argument("--force", action="store_true", help="Eine vorhandene Datei überschreiben")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f"{args.db} existiert bereits (mit --force überschreiben)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    # Muss vor dem ersten Import von models gesetzt sein, dort wird die Datenbank gebunden
+    os.environ["DB_PATH"] = os.path.abspath(args.db)
+
+    started = time.perf_counter()
+    result = generate_from_args(args)
+    print(f"{args.db}: " + ", ".join(f"{n} {name}" for name, n in result['counts'].items())
+          + f" ({time.perf_counter() - started:.1f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+SCENARIOS = ["calendar-data", "calendar-content", "select-time-of-day", "save-notes"]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Perzentil p (0-100) einer sortierten Liste mit linearer Interpolation"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def _load_users(count: int) -> List[Dict[str, Any]]:
+    """Lädt Benutzername, Tageszeiten und Perioden der ersten count generierten Benutzer"""
+    from pony.orm import db_session, select
+    from models.entities import Person, TimeOfDay, EmployeePlanPeriod
+    from benchmarks.datagen import BENCH_PASSWORD
+
+    users = []
+    with db_session:
+        persons = select(p for p in Person if p.username.startswith("bench_t") and p.prep_delete is None)
+        for person in persons.order_by(Person.username)[:count]:
+            periods = select((e.plan_period.start, e.plan_period.end) for e in EmployeePlanPeriod
+                             if e.person == person and e.prep_delete is None).order_by(1)[:]
+            users.append({
+                'username': person.username,
+                'password': BENCH_PASSWORD,
+                'tod_ids': [str(tod_id) for tod_id in select(t.id for t in TimeOfDay
+                                                             if t.person == person and t.prep_delete is None)],
+                'periods': periods,
+            })
+    if not users:
+        raise RuntimeError("Keine generierten Benutzer gefunden (Datenbank mit benchmarks.datagen erzeugen)")
+    return users
+
+
+def _make_request(scenario: str, user: Dict[str, Any], rng: random.Random):
+    """Gibt (Methode, Pfad, Formulardaten) für einen Request des Szenarios zurück"""
+    if scenario == "calendar-data":
+        return "GET", "/api/calendar-data", None
+    if scenario == "calendar-content":
+        return "GET", "/api/calendar-content", None
+    period_start, period_end = rng.choice(user['periods'])
+    if scenario == "select-time-of-day":
+        day = period_start + timedelta(days=rng.randrange((period_end - period_start).days + 1))
+        return "POST", "/api/select-time-of-day", {"date": day.strftime("%Y-%m-%d"),
+                                                   "tod_id": rng.choice(user['tod_ids'])}
+    if scenario == "save-notes":
+        period_text = f"{period_start.strftime('%d.%m.%y')} - {period_end.strftime('%d.%m.%y')}"
+        return "POST", "/api/save-notes", {"period": period_text, "notes": f"Notiz {rng.random():.6f}"}
+    raise ValueError(f"Unbekanntes Szenario '{scenario}'")
+
+
+async def run_scenario(app, scenario: str, users: List[Dict[str, Any]], requests: int, concurrency: int,
+                       seed: int) -> Dict[str, Any]:
+    """Führt requests Requests des Szenarios mit concurrency gleichzeitig angemeldeten Benutzern aus"""
+    import httpx
+
+    latencies: List[float] = []
+    queries: List[int] = []
+    errors = 0
+    remaining = requests
+
+    async def login(client, user):
+        response = await client.post("/api/login", data={"username": user['username'],
+                                                         "password": user['password']})
+        if response.status_code != 200:
+            raise RuntimeError(f"Anmeldung von {user['username']} fehlgeschlagen ({response.status_code})")
+
+    async def client_loop(index: int, client):
+        nonlocal remaining, errors
+        user = users[index % len(users)]
+        rng = random.Random(seed * 1000 + index)
+        while remaining > 0:
+            remaining -= 1
+            method, path, data = _make_request(scenario, user, rng)
+            started = time.perf_counter()
+            response = await client.request(method, path, data=data)
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(int(response.headers.get("x-db-queries", 0)))
+            # Fehler liefert die App als Notification (notification_error.html) mit Status 200 aus
+            if response.status_code >= 400 or response.text.lstrip().startswith('<div class="bg-red-100'):
+                errors += 1
+
+    clients = [httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+               for _ in range(concurrency)]
+    try:
+        # Anmeldungen (Passwort-Hashing) gehören nicht zur Messung
+        await asyncio.gather(*(login(client, users[i % len(users)]) for i, client in enumerate(clients)))
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(i, client) for i, client in enumerate(clients)))
+        elapsed = time.perf_counter() - started
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    latencies.sort()
+    return {
+        'scenario': scenario,
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+        'queries_mean': statistics.fmean(queries) if queries else 0.0,
+        'queries_max': max(queries, default=0),
+    }
+
+
+async def run_benchmark(scenarios: List[str], requests: int, concurrency: int, warmup: int,
+                        seed: int) -> List[Dict[str, Any]]:
+    from app import app
+
+    users = _load_users(concurrency)
+    results = []
+    async with app.router.lifespan_context(app):
+        for scenario in scenarios:
+            if warmup:
+                await run_scenario(app, scenario, users, warmup, concurrency, seed + 1)
+            results.append(await run_scenario(app, scenario, users, requests, concurrency, seed))
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]):
+    """Gibt die Abweichungen gegenüber einer gespeicherten Baseline aus"""
+    previous = {r['scenario']: r for r in baseline['results']}
+    print(f"\nVergleich mit Baseline vom {baseline['created_at']}:")
+    for result in results:
+        old = previous.get(result['scenario'])
+        if old is None:
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'queries_mean'):
+            change = (result[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            deltas.append(f"{key} {old[key]:.1f} -> {result[key]:.1f} ({change:+.0f}%)")
+        print(f"  {result['scenario']:<20} " + " | ".join(deltas))
+
+
+def main(argv=None):
+    from benchmarks import datagen
+
+    parser = argparse.ArgumentParser(
+        description="Lasttest der Kalender-Endpunkte über einen In-Process-ASGI-Client"
+    )
+    parser.add_argument("--db", help="Mit benchmarks.datagen erzeugte Datenbank (Standard: neu generieren)")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="Requests pro Szenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Gleichzeitig angemeldete Benutzer")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests pro Szenario vor der Messung")
+    parser.add_argument("--save", help="Ergebnisse als JSON-Baseline in diese Datei schreiben")
+    parser.add_argument("--compare", help="Ergebnisse mit einer gespeicherten JSON-Baseline vergleichen")
+    datagen.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Auf einer Kopie messen, damit schreibende Szenarien die Ausgangsdaten nicht verändern
+        db_path = os.path.join(tmp, "database.sqlite")
+        if args.db:
+            shutil.copy(args.db, db_path)
+        os.environ["DB_PATH"] = db_path
+        # Header X-DB-Queries einschalten, Budgets und Request-Logs während der Messung abschalten
+        os.environ.setdefault("SERVER_TIMING", "1")
+        os.environ.setdefault("QUERY_BUDGET_MODE", "off")
+        os.environ.setdefault("INSTRUMENTATION_SAMPLE_RATE", "0")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        # Jeder simulierte Benutzer meldet sich pro Szenario neu an
+        os.environ.setdefault("LOGIN_USER_LIMIT", "1000000")
+        os.environ.setdefault("LOGIN_IP_LIMIT", "1000000")
+
+        dataset = None if args.db else datagen.generate_from_args(args)
+        results = asyncio.run(run_benchmark(args.scenarios, args.requests, args.concurrency, args.warmup, args.seed))
+
+    print(f"{'Szenario':<20} {'Requests':>8} {'Req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'SQL':>6} {'Fehler':>7}")
+    for r in results:
+        print(f"{r['scenario']:<20} {r['requests']:>8} {r['throughput']:>8.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['queries_mean']:>6.1f} {r['errors']:>7}")
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'db': args.db,
+        'dataset': dataset,
+        'options': {'requests': args.requests, 'concurrency': args.concurrency, 'warmup': args.warmup,
+                    'seed': args.seed},
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Baseline gespeichert: {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from config.database import BASE_DIR
+
+# Läuft in einem frischen Interpreter, damit Importe und Caches wirklich kalt sind
+PROBE = r"""
+import asyncio, json, time
+t0 = time.perf_counter()
+from app import app
+t_import = time.perf_counter()
+import httpx
+
+async def main():
+    result = {'import_ms': (t_import - t0) * 1000}
+    t_lifespan = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        result['startup_ms'] = (time.perf_counter() - t_lifespan) * 1000
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            t = time.perf_counter()
+            response = await client.get("/")
+            result['first_page_ms'] = (time.perf_counter() - t) * 1000
+            t = time.perf_counter()
+            response = await client.post("/api/login", data={"username": USERNAME, "password": PASSWORD})
+            result['first_login_ms'] = (time.perf_counter() - t) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f"Anmeldung fehlgeschlagen ({response.status_code})")
+            t = time.perf_counter()
+            await client.get("/api/calendar-content")
+            result['first_calendar_ms'] = (time.perf_counter() - t) * 1000
+        result['total_ms'] = (time.perf_counter() - t0) * 1000
+    print(json.dumps(result))
+
+asyncio.run(main())
+"""
+
+METRICS = ["import_ms", "startup_ms", "first_page_ms", "first_login_ms", "first_calendar_ms", "total_ms"]
+
+
+def run_probe(db_path: str, username: str, password: str) -> dict:
+    env = dict(os.environ, DB_PATH=db_path, LOG_LEVEL="WARNING", INSTRUMENTATION_SAMPLE_RATE="0")
+    code = f"USERNAME = {username!r}\nPASSWORD = {password!r}\n" + PROBE
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=BASE_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Misst Importzeit, Start und erste Requests der Anwendung in frischen Prozessen"
+    )
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "database.sqlite"),
+                        help="Datenbank, von der für jeden Lauf eine Kopie verwendet wird")
+    parser.add_argument("--username", default="test")
+    parser.add_argument("--password", default="test")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--save", help="Ergebnisse als JSON in diese Datei schreiben")
+    args = parser.parse_args(argv)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "database.sqlite")
+        for _ in range(args.runs):
+            shutil.copy(args.db, db_path)
+            runs.append(run_probe(db_path, args.username, args.password))
+
+    summary = {metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+    print(f"Median aus {args.runs} Läufen:")
+    for metric in METRICS:
+        values = [run[metric] for run in runs]
+        print(f"  {metric:<18} {summary[metric]:>8.1f} ms  (min {min(values):.1f}, max {max(values):.1f})")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({'median': summary, 'runs': runs}, f, indent=2)
+        print(f"Ergebnisse gespeichert: {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from config.database import BASE_DIR, DB_PROFILES
+
+
+def run_worker(worker: int, users: int, seconds: float, start_at: float):
+    """Ein simulierter Benutzer: schaltet Verfügbarkeiten um und liest danach seine Auswahl"""
+    from pony.orm import db_session
+    from models.entities import Person, TimeOfDay, PlanPeriod
+    from utils.db_helpers import toggle_availability, get_selected_times
+
+    with db_session:
+        person = Person.get(username="test")
+        user_id = str(person.id)
+        tod_ids = [str(t.id) for t in TimeOfDay.select(lambda t: t.person == person and t.prep_delete is None)]
+        periods = list(PlanPeriod.select(lambda p: p.prep_delete is None).order_by(PlanPeriod.start))
+        dates = [p.start.fromordinal(o).strftime("%Y-%m-%d")
+                 for p in periods for o in range(p.start.toordinal(), p.end.toordinal() + 1)]
+    # Jeder Worker erhält eigene Tage, damit sich nur die Sperren, nicht die Daten überschneiden
+    dates = dates[worker::users]
+
+    toggles = errors = locked = 0
+    error_types = {}
+    i = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        date_str = dates[i % len(dates)]
+        tod_id = tod_ids[(i // len(dates)) % len(tod_ids)]
+        try:
+            toggle_availability(user_id, date_str, tod_id)
+            get_selected_times(user_id)
+            toggles += 1
+        except Exception as e:
+            errors += 1
+            if "locked" in str(e):
+                locked += 1
+            error_types[type(e).__name__] = error_types.get(type(e).__name__, 0) + 1
+        i += 1
+    return {"toggles": toggles, "errors": errors, "locked": locked, "error_types": error_types}
+
+
+def run_profile(profile: str, users: int, seconds: float) -> dict:
+    """Startet users Prozesse gegen eine Kopie der Datenbank mit dem angegebenen Profil"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "database.sqlite")
+        shutil.copy(os.path.join(BASE_DIR, "database.sqlite"), db_path)
+        env = dict(os.environ, DB_PATH=db_path, DB_PROFILE=profile)
+
+        # Schema und Indizes einmal vorab anlegen (die App legt seit DB_CREATE_TABLES=0 nichts mehr an),
+        # damit die Worker nicht gleichzeitig migrieren; dabei wird auch das Profil angewendet
+        subprocess.run([sys.executable, "-m", "utils.migrations", "--db", db_path], env=env, cwd=BASE_DIR,
+                       check=True, stdout=subprocess.DEVNULL)
+
+        start_at = time.time() + 2.0
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.write_contention", "--worker", str(worker),
+                 "--users", str(users), "--seconds", str(seconds), "--start-at", str(start_at)],
+                env=env, cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+            )
+            for worker in range(users)
+        ]
+        results = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in processes]
+
+    toggles = sum(r["toggles"] for r in results)
+    error_types = {}
+    for r in results:
+        for name, n in r["error_types"].items():
+            error_types[name] = error_types.get(name, 0) + n
+    return {
+        "profile": profile,
+        "users": users,
+        "seconds": seconds,
+        "toggles": toggles,
+        "toggles_per_sec": toggles / seconds,
+        "errors": sum(r["errors"] for r in results),
+        "locked": sum(r["locked"] for r in results),
+        "error_types": error_types,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Misst umgeschaltete Verfügbarkeiten pro Sekunde bei N gleichzeitigen Benutzern (Prozessen)"
+    )
+    parser.add_argument("--profiles", nargs="+", default=["default", "wal"], choices=sorted(DB_PROFILES))
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(args.worker, args.users[0], args.seconds, args.start_at)))
+        return
+
+    print(f"{'Profil':<12} {'Benutzer':>8} {'Toggles/s':>10} {'Fehler':>7} {'locked':>7}")
+    for users in args.users:
+        for profile in args.profiles:
+            result = run_profile(profile, users, args.seconds)
+            print(f"{result['profile']:<12} {result['users']:>8} {result['toggles_per_sec']:>10.1f} "
+                  f"{result['errors']:>7} {result['locked']:>7}  {result['error_types'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
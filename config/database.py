@@ -5,16 +5,66 @@ from pathlib import Path
 # Projektbasis-Pfad
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# SQLite Datenbankpfad
-DB_PATH = os.path.join(BASE_DIR, "database.sqlite")
+# SQLite Datenbankpfad (über die Umgebungsvariable DB_PATH überschreibbar, z.B. für Benchmarks)
+DB_PATH = os.environ.get("DB_PATH", os.path.join(BASE_DIR, "database.sqlite"))
+
+# Verbindungsprofile: PRAGMAs, die auf jede neue SQLite-Verbindung angewendet werden
+DB_PROFILES = {
+    # SQLite-Standard: Rollback-Journal, synchronous=FULL, kein busy_timeout
+    'default': {},
+    # WAL: Leser blockieren Schreiber nicht mehr, Schreiber warten statt "database is locked"
+    'wal': {
+        # Wirkt nur bei neuen Datenbanken (vor dem Umschalten auf WAL); bestehende stellt
+        # python -m utils.compaction --convert um
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,        # ms
+        'cache_size': -20000,        # negativ = KiB, also ca. 20 MB pro Verbindung
+        'mmap_size': 268435456,      # 256 MB
+        'temp_store': 'MEMORY',
+    },
+    # Wie 'wal', aber jeder Commit wird vollständig auf die Platte geschrieben
+    'wal_durable': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Aktives Verbindungsprofil (Umgebungsvariable DB_PROFILE)
+DB_PROFILE = os.environ.get("DB_PROFILE", "wal")
+
+# Tabellen beim Import von models anlegen und prüfen. Standardmäßig aus: Das Schema legt
+# python -m utils.migrations an, damit der Start der Anwendung keine DDL-Abfragen ausführt.
+DB_CREATE_TABLES = os.environ.get("DB_CREATE_TABLES", "0") == "1"
+
+def apply_connection_profile(connection, profile_name=None):
+    """Wendet die PRAGMAs eines Verbindungsprofils auf eine SQLite-Verbindung an"""
+    profile = DB_PROFILES[profile_name or DB_PROFILE]
+    cursor = connection.cursor()
+    for pragma, value in profile.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
 
 def init_db(db):
     """Initialisiert die Datenbankverbindung"""
+    if DB_PROFILE not in DB_PROFILES:
+        raise ValueError(f"Unbekanntes Datenbankprofil '{DB_PROFILE}', erlaubt: {', '.join(DB_PROFILES)}")
+
+    # Profil auf jede neue Verbindung anwenden (Pony öffnet eine Verbindung pro Thread)
+    @db.on_connect(provider='sqlite')
+    def _apply_profile(db, connection):
+        apply_connection_profile(connection)
+
     db.bind(provider='sqlite', filename=DB_PATH, create_db=True)
-    db.generate_mapping(create_tables=True)
+    db.generate_mapping(create_tables=DB_CREATE_TABLES, check_tables=DB_CREATE_TABLES)
     
     # Debug-Informationen
-    print(f"Database initialized at: {DB_PATH}")
+    print(f"Database initialized at: {DB_PATH} (Profil: {DB_PROFILE})")
     return db
 
 def get_db():
@@ -22,11 +72,12 @@ def get_db():
     from models.entities import db
     return db
 
-# Funktion zum Erstellen von Beispieldaten, wenn die Datenbank leer ist
+# Funktion zum Erstellen von Beispieldaten, wenn die Datenbank leer ist (Aufruf über python -m utils.seed)
 @db_session
 def create_test_data():
     """Erstellt Beispieldaten in der Datenbank, wenn keine vorhanden sind"""
     from models.entities import Person, Team, Project, PlanPeriod, TimeOfDay, Availability, EmployeePlanPeriod
+    from utils.passwords import hash_password
     import datetime
     import uuid
     
@@ -47,7 +98,7 @@ def create_test_data():
             l_name="User",
             email="admin@example.com",
             username="admin",
-            password="p",  # In einer realen Anwendung sollte das Passwort gehasht werden
+            password=hash_password("p"),
             created_at=now,
             latest_change=now
         )
@@ -86,7 +137,7 @@ def create_test_data():
             l_name="User",
             email="test@example.com",
             username="test",
-            password="test",  # In einer realen Anwendung sollte das Passwort gehasht werden
+            password=hash_password("test"),
             created_at=now,
             latest_change=now,
             team=team
@@ -212,16 +263,11 @@ def create_test_data():
         # Noch ein Commit
         commit()
         
-        # EmployeePlanPeriod für Testuser erstellen
-        emp_plan_periods = []
-        for period in plan_periods:
-            emp_plan_period = EmployeePlanPeriod(
-                created_at=now,
-                latest_change=now,
-                plan_period=period,
-                person=test_user
-            )
-            emp_plan_periods.append(emp_plan_period)
+        # EmployeePlanPeriods aller Teammitglieder anlegen (idempotent, neue Perioden werden
+        # bereits über die Provisionierung beim Einfügen versorgt)
+        from utils.provisioning import provision_team
+        provision_team(str(team.id))
+        emp_plan_periods = [EmployeePlanPeriod.get(person=test_user, plan_period=period) for period in plan_periods]
         
         # Erneut ein Commit
         commit()
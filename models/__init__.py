@@ -1,5 +1,8 @@
+from models import signals
 from models.entities import db
 from config.database import init_db
 
 # Initialisiere Datenbank
 init_db(db)
+# signals.on_commit: Aktionen erst nach dem Commit der schreibenden db_session ausführen
+signals.install_transaction_hooks(db)
@@ -1,7 +1,9 @@
 import datetime
 from uuid import UUID
 
-from pony.orm import Database, PrimaryKey, Optional, Required, Set, composite_key
+from pony.orm import Database, PrimaryKey, Optional, Required, Set, Json, composite_key, composite_index
+
+from models import signals
 
 db = Database()
 
@@ -16,6 +18,17 @@ class Availability(db.Entity):
     employee_plan_period = Required('EmployeePlanPeriod')
     date = Required(datetime.date)  # Direktes Datum der Verfügbarkeit
 
+    composite_index(employee_plan_period, date, time_of_day, prep_delete)
+
+    def after_insert(self):
+        signals.send(self, 'insert')
+
+    def after_update(self):
+        signals.send(self, 'update')
+
+    def before_delete(self):
+        signals.send(self, 'delete')
+
 
 class TimeOfDay(db.Entity):
     id = PrimaryKey(UUID, auto=True)
@@ -32,6 +45,15 @@ class TimeOfDay(db.Entity):
 
     composite_key(person, name)
 
+    def after_insert(self):
+        signals.send(self, 'insert')
+
+    def after_update(self):
+        signals.send(self, 'update')
+
+    def before_delete(self):
+        signals.send(self, 'delete')
+
 
 class PlanPeriod(db.Entity):
     id = PrimaryKey(UUID, auto=True)
@@ -46,6 +68,17 @@ class PlanPeriod(db.Entity):
     team = Required('Team')
     apscheduler_job = Optional('APSchedulerJob')
 
+    composite_index(start, end, prep_delete)
+
+    def after_insert(self):
+        signals.send(self, 'insert')
+
+    def after_update(self):
+        signals.send(self, 'update')
+
+    def before_delete(self):
+        signals.send(self, 'delete')
+
 
 class Person(db.Entity):
     id = PrimaryKey(UUID, auto=True)
@@ -64,6 +97,21 @@ class Person(db.Entity):
     teams_of_dispatcher = Set('Team', reverse='dispatcher')
     project_of_admin = Optional('Project')
 
+    def after_insert(self):
+        signals.send(self, 'insert')
+
+    def before_update(self):
+        # Teamwechsel merken, solange _dbvals_ noch den gespeicherten Stand enthält
+        self._team_changed = self._dbvals_.get(Person.team) != self.team
+
+    def after_update(self):
+        signals.send(self, 'update')
+        if getattr(self, '_team_changed', False):
+            signals.send(self, 'team_change')
+
+    def before_delete(self):
+        signals.send(self, 'delete')
+
 
 class Project(db.Entity):
     id = PrimaryKey(UUID, auto=True)
@@ -98,6 +146,17 @@ class EmployeePlanPeriod(db.Entity):
     plan_period = Required(PlanPeriod)
     person = Required(Person)
 
+    composite_index(person, plan_period, prep_delete)
+
+    def after_insert(self):
+        signals.send(self, 'insert')
+
+    def after_update(self):
+        signals.send(self, 'update')
+
+    def before_delete(self):
+        signals.send(self, 'delete')
+
 
 class APSchedulerJob(db.Entity):
     id = PrimaryKey(UUID, auto=True)
@@ -111,4 +170,13 @@ class APSchedulerJob(db.Entity):
     next_runt_ime = Optional(datetime.datetime)
     active = Required(bool, default='true')
     created_at = Required(datetime.datetime)
-    plan_period = Required(PlanPeriod)
\ No newline at end of file
+    plan_period = Required(PlanPeriod)
+
+
+# Serverseitig gespeicherte Sitzung (SESSION_BACKEND=sqlite); das Cookie enthält nur die id
+class UserSession(db.Entity):
+    id = PrimaryKey(str, 64)
+    data = Required(Json)
+    user_id = Optional(UUID, index=True)
+    created_at = Required(datetime.datetime)
+    expires_at = Required(datetime.datetime, index=True)
@@ -1,11 +1,19 @@
 
 import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal
 from uuid import UUID
 from pydantic import BaseModel, Field, EmailStr, ConfigDict, field_validator
 
 
-class EntityBase(BaseModel):
+class SchemaBase(BaseModel):
+    """
+    Basisklasse aller Schemas. Pydantic baut Validatoren erst bei der ersten Verwendung eines Schemas
+    (defer_build), damit der Import z.B. email_validator nicht schon beim Start der Anwendung lädt.
+    """
+    model_config = ConfigDict(defer_build=True)
+
+
+class EntityBase(SchemaBase):
     """Basisklasse für alle Entities mit gemeinsamen Feldern"""
     model_config = ConfigDict(from_attributes=True)
 
@@ -20,7 +28,7 @@ class AvailabilityBase(EntityBase):
     notes: Optional[str] = None
     date: datetime.date
 
-class AvailabilityCreate(BaseModel):
+class AvailabilityCreate(SchemaBase):
     notes: Optional[str] = None
     time_of_day_id: UUID
     employee_plan_period_id: UUID
@@ -30,6 +38,28 @@ class AvailabilityResponse(AvailabilityBase):
     time_of_day: "TimeOfDayBase"
     employee_plan_period: "EmployeePlanPeriodBase"
 
+# Obergrenzen einer Sammelbearbeitung, damit ein Request nicht beliebig viele Zeilen in einer Transaktion schreibt
+BATCH_MAX_OPERATIONS = 50
+BATCH_MAX_DATES = 100
+BATCH_MAX_TOD_IDS = 20
+
+class AvailabilityBatchOperation(SchemaBase):
+    """
+    Eine Änderung innerhalb einer Sammelbearbeitung:
+    - set / unset: tod_ids an allen dates aktivieren bzw. deaktivieren
+    - copy_week: die Auswahl der Woche ab source_week auf die Woche ab target_week übertragen
+    - clear_period: alle Auswahlen der Planungsperiode period ("dd.mm.yy - dd.mm.yy") entfernen
+    """
+    op: Literal["set", "unset", "copy_week", "clear_period"]
+    dates: List[datetime.date] = Field([], max_length=BATCH_MAX_DATES)
+    tod_ids: List[UUID] = Field([], max_length=BATCH_MAX_TOD_IDS)
+    source_week: Optional[datetime.date] = None
+    target_week: Optional[datetime.date] = None
+    period: Optional[str] = None
+
+class AvailabilityBatchRequest(SchemaBase):
+    operations: List[AvailabilityBatchOperation] = Field(..., min_length=1, max_length=BATCH_MAX_OPERATIONS)
+
 
 # TimeOfDay Schemas
 class TimeOfDayBase(EntityBase):
@@ -39,7 +69,7 @@ class TimeOfDayBase(EntityBase):
     color: Optional[str] = Field(None, max_length=20)
     notes: Optional[str] = None
 
-class TimeOfDayCreate(BaseModel):
+class TimeOfDayCreate(SchemaBase):
     name: str = Field(..., max_length=40)
     start: datetime.time
     delta: datetime.timedelta
@@ -47,6 +77,16 @@ class TimeOfDayCreate(BaseModel):
     notes: Optional[str] = None
     person_id: UUID
 
+class TimeOfDaySlim(SchemaBase):
+    """Schlanke Projektion einer Tageszeit für die UI, ohne Verfügbarkeiten und Person"""
+    model_config = ConfigDict(from_attributes=True)
+
+    id: UUID
+    name: str
+    start: datetime.time
+    delta: datetime.timedelta
+    color: Optional[str] = None
+
 class TimeOfDayResponse(TimeOfDayBase):
     person: "PersonBase"
     availabilities: List[AvailabilityBase]
@@ -64,7 +104,7 @@ class PersonBase(EntityBase):
     email: EmailStr = Field(..., max_length=50)
     username: str = Field(..., max_length=50)
 
-class PersonCreate(BaseModel):
+class PersonCreate(SchemaBase):
     f_name: str = Field(..., max_length=50)
     l_name: Optional[str] = Field(None, max_length=50)
     artist_name: Optional[str] = Field(None, max_length=50)
@@ -88,7 +128,7 @@ class ProjectBase(EntityBase):
     name: str = Field(..., max_length=50)
     active: bool = True
 
-class ProjectCreate(BaseModel):
+class ProjectCreate(SchemaBase):
     name: str = Field(..., max_length=50)
     active: bool = True
     admin_id: UUID
@@ -106,7 +146,7 @@ class ProjectResponse(ProjectBase):
 class TeamBase(EntityBase):
     name: str = Field(..., max_length=50)
 
-class TeamCreate(BaseModel):
+class TeamCreate(SchemaBase):
     name: str = Field(..., max_length=50)
     dispatcher_id: UUID
     project_id: UUID
@@ -129,7 +169,7 @@ class PlanPeriodBase(EntityBase):
     end: datetime.date
     deadline: datetime.date
 
-class PlanPeriodCreate(BaseModel):
+class PlanPeriodCreate(SchemaBase):
     notes: Optional[str] = None
     start: datetime.date
     end: datetime.date
@@ -150,7 +190,7 @@ class PlanPeriodResponse(PlanPeriodBase):
 class EmployeePlanPeriodBase(EntityBase):
     notes: Optional[str] = None
 
-class EmployeePlanPeriodCreate(BaseModel):
+class EmployeePlanPeriodCreate(SchemaBase):
     notes: Optional[str] = None
     plan_period_id: UUID
     person_id: UUID
@@ -177,7 +217,7 @@ class APSchedulerJobBase(EntityBase):
     next_runt_ime: Optional[datetime.datetime] = None
     active: bool = True
 
-class APSchedulerJobCreate(BaseModel):
+class APSchedulerJobCreate(SchemaBase):
     job_id: str = Field(..., max_length=50)
     name: str = "APScheduler Job"
     func_name: str
@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+# Registrierte Empfänger pro Entity-Name, z.B. {'TimeOfDay': [callback, ...]}
+_receivers: Dict[str, List[Callable]] = defaultdict(list)
+# Aktionen, die nach dem Commit der laufenden Transaktion ausgeführt werden (pro Thread, wie Ponys db_session)
+_pending = threading.local()
+
+logger = logging.getLogger("availability.signals")
+
+
+def connect(entity_name: str, receiver: Callable):
+    """
+    Registriert einen Empfänger für Änderungen an einer Entity.
+
+    Der Empfänger wird mit (obj, event) aufgerufen, wobei event einer der Werte
+    'insert', 'update' oder 'delete' ist (bei Person zusätzlich 'team_change' nach einem
+    Teamwechsel). Er läuft innerhalb der db_session, die die Änderung schreibt, und sollte
+    daher schnell sein. Da das vor dem Commit geschieht, sollten Caches über on_commit invalidiert werden.
+    """
+    if receiver not in _receivers[entity_name]:
+        _receivers[entity_name].append(receiver)
+
+
+def disconnect(entity_name: str, receiver: Callable):
+    """Entfernt einen zuvor registrierten Empfänger"""
+    if receiver in _receivers[entity_name]:
+        _receivers[entity_name].remove(receiver)
+
+
+def send(obj, event: str):
+    """Benachrichtigt alle Empfänger über eine Änderung an obj"""
+    for receiver in list(_receivers.get(obj.__class__.__name__, ())):
+        receiver(obj, event)
+
+
+def on_commit(callback: Callable[[], None]):
+    """
+    Führt callback nach dem erfolgreichen Commit der laufenden Transaktion aus; bei einem Rollback
+    wird er verworfen.
+
+    Die Empfänger laufen während des Flushs, also vor dem Commit. Ein Cache, der schon dort invalidiert
+    wird, kann von einem anderen Thread noch mit dem alten Stand neu befüllt werden und behält ihn dann.
+    """
+    callbacks = getattr(_pending, 'callbacks', None)
+    if callbacks is None:
+        callbacks = _pending.callbacks = []
+    callbacks.append(callback)
+
+
+def _take_pending() -> List[Callable[[], None]]:
+    callbacks = getattr(_pending, 'callbacks', None) or []
+    _pending.callbacks = []
+    return callbacks
+
+
+def install_transaction_hooks(db):
+    """Verbindet on_commit mit Commit und Rollback der Datenbank (nach db.bind aufrufen)"""
+    provider = db.provider
+    commit, rollback, release = provider.commit, provider.rollback, provider.release
+
+    def commit_and_run(connection, cache=None):
+        commit(connection, cache)
+        for callback in _take_pending():
+            try:
+                callback()
+            except Exception:
+                # Die Transaktion ist bereits festgeschrieben; ein Fehler hier darf sie nicht zurückrollen
+                logger.exception("on_commit callback failed")
+
+    def rollback_and_discard(connection, cache=None):
+        _take_pending()
+        rollback(connection, cache)
+
+    def release_and_discard(connection, cache=None):
+        # Am Ende jeder db_session: nichts in die nächste Transaktion des Threads übernehmen
+        _take_pending()
+        release(connection, cache)
+
+    provider.commit = commit_and_run
+    provider.rollback = rollback_and_discard
+    provider.release = release_and_discard
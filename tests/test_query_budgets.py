@@ -0,0 +1,134 @@
+"""
+Prüft die Abfragebudgets (@query_budget) aller Endpunkte gegen eine Kopie der Demo-Datenbank.
+
+Die App läuft mit APP_ENV=test und QUERY_BUDGET_MODE=raise: überschreitet ein Request sein Budget,
+wirft die InstrumentationMiddleware QueryBudgetExceeded und der TestClient gibt den Fehler weiter.
+Vor jedem Request werden die prozessinternen Caches geleert, da die Budgets für kalte Caches gelten.
+
+Ausführen mit: python -m pytest tests
+"""
+import re
+import shutil
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("httpx")
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Demo-Daten aus database.sqlite: Perioden des Demo-Teams, Disponent ist admin
+PERIOD_ID = "3bf6b294-d721-4218-970f-624bcbf0f321"
+PERIOD_LABEL = "01.11.24 - 11.11.24"
+DAY = "2024-11-02"
+
+USERS = {
+    "test": {"username": "test", "password": "test"},
+    "admin": {"username": "admin", "password": "p"},
+}
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """Importiert die App gegen eine temporäre Kopie von database.sqlite"""
+    db_path = tmp_path_factory.mktemp("db") / "database.sqlite"
+    shutil.copy(REPO_DIR / "database.sqlite", db_path)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(REPO_DIR)
+        mp.setenv("APP_ENV", "test")
+        mp.setenv("DB_PATH", str(db_path))
+        mp.setenv("QUERY_BUDGET_MODE", "raise")
+        mp.setenv("SCHEDULER_ENABLED", "0")
+        mp.setenv("AVAILABILITY_BITMAPS", "1")
+        mp.setenv("INSTRUMENTATION_SAMPLE_RATE", "0")
+        mp.setenv("LOG_LEVEL", "WARNING")
+        import app
+        yield app
+
+
+@pytest.fixture(scope="module")
+def clients(app_module):
+    """Ein angemeldeter TestClient pro Benutzer (eigene Cookies)"""
+    from fastapi.testclient import TestClient
+
+    opened = {}
+    try:
+        for name, credentials in USERS.items():
+            client = TestClient(app_module.app)
+            client.__enter__()
+            opened[name] = client
+            response = client.post("/api/login", data=credentials)
+            assert response.status_code == 200, f"Anmeldung von {name} fehlgeschlagen"
+        yield opened
+    finally:
+        for client in opened.values():
+            client.__exit__(None, None, None)
+
+
+def clear_caches():
+    """Leert alle prozessinternen Caches, damit der nächste Request mit kalten Caches läuft"""
+    from utils import bitmaps, calendar_layout, period_index, tod_cache
+    from utils.fragment_cache import calendar_fragments
+
+    for cache in (bitmaps, calendar_layout, period_index, tod_cache):
+        cache.invalidate()
+    calendar_fragments.invalidate()
+
+
+def _tod_id(clients) -> str:
+    response = clients["test"].post("/api/get-time-of-day-options", data={"date": DAY})
+    return re.search(r'tod-option-([0-9a-f-]{36})', response.text).group(1)
+
+
+# (Benutzer, Methode, Pfad, Formulardaten); "{tod_id}" wird durch eine Tageszeit des Benutzers ersetzt
+BUDGETED_REQUESTS = [
+    ("test", "GET", "/api/calendar-data", None),
+    ("test", "GET", "/api/calendar-content", None),
+    ("test", "GET", "/api/calendar-chunk?after=2024-11-11", None),
+    ("test", "POST", "/api/load-period-notes", {"period": PERIOD_LABEL, "color": "bg-blue-800/40"}),
+    ("test", "POST", "/api/save-notes", {"period": PERIOD_LABEL, "notes": "Budgettest"}),
+    ("test", "POST", "/api/get-time-of-day-options", {"date": DAY}),
+    ("test", "POST", "/api/select-time-of-day", {"date": DAY, "tod_id": "{tod_id}"}),
+    ("test", "POST", "/api/update-day-indicators", {"date": DAY}),
+    ("test", "GET", "/get-calendar-menus", None),
+    ("admin", "GET", f"/coverage?period_id={PERIOD_ID}", None),
+    ("admin", "GET", f"/api/team-availability?period_id={PERIOD_ID}", None),
+]
+
+
+def _budget(app_module, method: str, path: str) -> int:
+    for route in app_module.app.routes:
+        if getattr(route, "path", None) == path.split("?")[0] and method in getattr(route, "methods", ()):
+            return route.endpoint.__query_budget__
+    raise AssertionError(f"Keine Route für {method} {path}")
+
+
+@pytest.mark.parametrize("user, method, path, data", BUDGETED_REQUESTS,
+                         ids=[f"{method} {path.split('?')[0]}" for _, method, path, _ in BUDGETED_REQUESTS])
+def test_route_stays_within_budget(app_module, clients, user, method, path, data):
+    if data and data.get("tod_id") == "{tod_id}":
+        data = dict(data, tod_id=_tod_id(clients))
+    clear_caches()
+    response = clients[user].request(method, path, data=data)
+    assert response.status_code == 200, response.text[:200]
+    queries = int(response.headers["X-DB-Queries"])
+    assert queries <= _budget(app_module, method, path)
+
+
+def test_login_stays_within_budget(app_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as client:
+        clear_caches()
+        response = client.post("/api/login", data=USERS["test"])
+    assert response.status_code == 200
+    assert int(response.headers["X-DB-Queries"]) <= _budget(app_module, "POST", "/api/login")
+
+
+def test_every_budgeted_route_is_covered(app_module):
+    covered = {(method, path.split("?")[0]) for _, method, path, _ in BUDGETED_REQUESTS}
+    covered.add(("POST", "/api/login"))
+    budgeted = {(method, route.path) for route in app_module.app.routes
+                if hasattr(getattr(route, "endpoint", None), "__query_budget__")
+                for method in route.methods if method != "HEAD"}
+    assert budgeted <= covered, f"Ohne Budgettest: {sorted(budgeted - covered)}"
@@ -0,0 +1,122 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from utils.instrumentation import measure_helper
+
+# Maximale Anzahl gleichzeitiger Datenbank-Threads pro Datenbankverbindung
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+
+
+class DatabaseExecutor:
+    """
+    Begrenzter Thread-Pool, in dem die synchronen db_session-Funktionen einer Datenbank laufen
+    (oder, über get_named_executor, andere blockierende Aufgaben wie das Prüfen von Passwort-Hashes)
+    """
+
+    def __init__(self, name: str, max_workers: int = DB_POOL_SIZE):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"db-{name}")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Führt func im Pool aus, ohne den Event-Loop zu blockieren"""
+        # Kontextvariablen (z.B. Request-Statistiken) in den Worker-Thread übernehmen
+        ctx = contextvars.copy_context()
+
+        def call():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return ctx.run(measure_helper, func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(call)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, future):
+        # Abgebrochene Aufträge wurden nie gestartet und hängen sonst in der Warteschlange
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    @property
+    def queue_depth(self) -> int:
+        """Anzahl der Aufträge, die auf einen freien Worker warten"""
+        return self._queued
+
+    def stats(self) -> Dict[str, Any]:
+        """Gibt den aktuellen Zustand des Pools zurück"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'active': self._active,
+                'queued': self._queued,
+                'completed': self._completed
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# Ein Pool pro Datenbankverbindung (Schlüssel id(db)) bzw. pro Name
+_executors: Dict[Any, DatabaseExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(db=None) -> DatabaseExecutor:
+    """Gibt den Pool für die angegebene (oder die Standard-)Datenbank zurück"""
+    if db is None:
+        from models.entities import db
+    with _executors_lock:
+        executor = _executors.get(id(db))
+        if executor is None:
+            executor = DatabaseExecutor(db.provider_name or "db")
+            _executors[id(db)] = executor
+        return executor
+
+
+def get_named_executor(name: str, max_workers: int = DB_POOL_SIZE) -> DatabaseExecutor:
+    """Gibt einen eigenen Pool für Aufgaben zurück, die die Datenbank-Pools nicht belegen sollen"""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = DatabaseExecutor(name, max_workers)
+            _executors[name] = executor
+        return executor
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Führt eine synchrone Datenbankfunktion im Pool der Standard-Datenbank aus"""
+    return await get_executor().run(func, *args, **kwargs)
+
+
+def get_pool_stats() -> List[Dict[str, Any]]:
+    """Gibt die Statistiken aller Datenbank-Pools zurück"""
+    with _executors_lock:
+        executors = list(_executors.values())
+    return [executor.stats() for executor in executors]
+
+
+def shutdown_executors(wait: bool = True):
+    """Beendet alle Datenbank-Pools, z.B. beim Herunterfahren der Anwendung"""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from utils.async_db import run_db, get_named_executor
+from utils.db_helpers import get_login_user, update_password_hash
+from utils.instrumentation import get_logger
+from utils.passwords import hash_password, verify_password, dummy_hash
+
+# Anmeldeversuche pro Benutzername bzw. Client-IP innerhalb von LOGIN_WINDOW_SECONDS.
+# Hinter einem Reverse-Proxy ist die Client-IP nur korrekt, wenn uvicorn mit --proxy-headers läuft.
+LOGIN_USER_LIMIT = int(os.environ.get("LOGIN_USER_LIMIT", "5"))
+LOGIN_IP_LIMIT = int(os.environ.get("LOGIN_IP_LIMIT", "20"))
+LOGIN_WINDOW_SECONDS = float(os.environ.get("LOGIN_WINDOW_SECONDS", "60"))
+# Threads für das Prüfen und Erzeugen von Passwort-Hashes, getrennt von den Datenbank-Pools
+PASSWORD_POOL_SIZE = int(os.environ.get("PASSWORD_POOL_SIZE", "2"))
+
+logger = get_logger("auth")
+
+
+class LoginRateLimited(Exception):
+    """Zu viele Anmeldeversuche; retry_after gibt die Wartezeit in Sekunden an"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Zu viele Anmeldeversuche, erneut möglich in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Gleitendes Fenster: höchstens limit Versuche pro Schlüssel innerhalb von window Sekunden"""
+
+    def __init__(self, limit: int, window: float, max_keys: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        # Schlüssel ohne Versuche im Fenster entfernen; reicht das nicht, die ältesten verwerfen
+        for key in [key for key, attempts in self._attempts.items() if attempts[-1] <= now - self.window]:
+            del self._attempts[key]
+        while len(self._attempts) >= self.max_keys:
+            del self._attempts[next(iter(self._attempts))]
+
+    def retry_after(self, key: str) -> float:
+        """Gibt 0 zurück, wenn ein weiterer Versuch erlaubt ist, sonst die Wartezeit in Sekunden"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if not attempts:
+                return 0.0
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) < self.limit:
+                return 0.0
+            return attempts[0] + self.window - now
+
+    def hit(self, key: str):
+        """Zählt einen Versuch für key"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                if len(self._attempts) >= self.max_keys:
+                    self._prune(now)
+                attempts = self._attempts[key] = deque()
+            attempts.append(now)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+user_limiter = RateLimiter(LOGIN_USER_LIMIT, LOGIN_WINDOW_SECONDS)
+ip_limiter = RateLimiter(LOGIN_IP_LIMIT, LOGIN_WINDOW_SECONDS)
+
+
+def _check_password(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """Prüft das Passwort (ohne Benutzer gegen einen Dummy-Hash) und erzeugt bei Bedarf den neuen Hash"""
+    ok, needs_rehash = verify_password(password, stored if stored is not None else dummy_hash())
+    if stored is None or not ok:
+        return False, None
+    return True, hash_password(password) if needs_rehash else None
+
+
+async def authenticate(username: str, password: str, client_ip: str) -> Optional[Dict[str, Any]]:
+    """
+    Meldet einen Benutzer an, ohne den Event-Loop mit dem Hashing zu blockieren.
+
+    Vor jeder Arbeit werden die Anmeldeversuche pro Benutzername und Client-IP begrenzt. Der
+    Hash wird im Pool "password" geprüft; Klartext aus Altdaten und Hashes mit veralteten
+    Parametern werden dabei ersetzt.
+
+    Returns:
+        Optional[Dict[str, Any]]: Die Sitzungsdaten des Benutzers oder None bei falschen Anmeldedaten
+
+    Raises:
+        LoginRateLimited: Wenn für Benutzername oder IP zu viele Versuche vorliegen
+    """
+    if not username or not password:
+        return None
+    user_key = username.lower()
+    retry_after = max(user_limiter.retry_after(user_key), ip_limiter.retry_after(client_ip))
+    if retry_after > 0:
+        logger.warning("login rate limited", extra={'fields': {'username': username, 'client_ip': client_ip}})
+        raise LoginRateLimited(retry_after)
+    user_limiter.hit(user_key)
+    ip_limiter.hit(client_ip)
+
+    user = await run_db(get_login_user, username)
+    stored = user.pop('password') if user else None
+    ok, new_hash = await get_named_executor("password", PASSWORD_POOL_SIZE).run(_check_password, password, stored)
+    if not ok:
+        logger.info("login failed", extra={'fields': {'username': username, 'client_ip': client_ip}})
+        return None
+
+    if new_hash is not None:
+        await run_db(update_password_hash, user['id'], stored, new_hash)
+    user_limiter.reset(user_key)
+    return user
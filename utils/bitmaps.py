@@ -0,0 +1,244 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pony.orm import db_session, select
+
+from models import signals
+from models.entities import PlanPeriod, EmployeePlanPeriod, Availability, TimeOfDay
+
+# Abgeleiteter Bitmap-Speicher der Verfügbarkeiten (optional, AVAILABILITY_BITMAPS=1)
+BITMAPS_ENABLED = os.environ.get("AVAILABILITY_BITMAPS", "0") == "1"
+# Höchstzahl gleichzeitig geladener Planungsperioden (LRU)
+BITMAP_MAX_PERIODS = int(os.environ.get("BITMAP_MAX_PERIODS", "64"))
+
+
+class PeriodBitmaps:
+    """
+    Verfügbarkeiten einer Planungsperiode als gepackte Bitmaps: pro Person ein int mit einem Bit je
+    (Tageszeit, Tag). Tageszeiten werden wie in der Abdeckungsanalyse über ihren Namen zusammengefasst.
+
+    Bit slot * num_days + day, sodass neu auftauchende Tageszeiten nur höhere Bits belegen und
+    vorhandene Bitmaps gültig bleiben. Abfragen über das Team sind Bitoperationen auf diesen ints.
+    Änderungen kommen aus den Worker-Threads der Datenbank, daher sind alle Methoden gesperrt.
+    """
+
+    def __init__(self, period_id: str, start: date, end: date, members: Dict[str, str]):
+        self.period_id = period_id
+        self.start = start
+        self.num_days = (end - start).days + 1
+        # person_id -> Name; Personen ohne Auswahl haben die Bitmap 0
+        self.members = dict(members)
+        self.bitmaps: Dict[str, int] = {person_id: 0 for person_id in members}
+        self.slots: List[str] = []
+        self._slot_index: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def add_slot(self, slot: str):
+        """Nimmt eine Tageszeit in das Raster auf, auch wenn sie noch niemand ausgewählt hat"""
+        with self._lock:
+            if slot not in self._slot_index:
+                self._slot_index[slot] = len(self.slots)
+                self.slots.append(slot)
+
+    def _bit(self, day: date, slot: str, create: bool = False) -> Optional[int]:
+        offset = (day - self.start).days
+        if not 0 <= offset < self.num_days:
+            return None
+        index = self._slot_index.get(slot)
+        if index is None:
+            if not create:
+                return None
+            index = self._slot_index[slot] = len(self.slots)
+            self.slots.append(slot)
+        return 1 << (index * self.num_days + offset)
+
+    def set(self, person_id: str, day: date, slot: str, available: bool, name: Optional[str] = None):
+        """Setzt oder löscht das Bit einer Person für (Tag, Tageszeit)"""
+        with self._lock:
+            bit = self._bit(day, slot, create=available)
+            if person_id not in self.bitmaps:
+                self.bitmaps[person_id] = 0
+                self.members[person_id] = name or person_id
+            if bit is not None:
+                bitmap = self.bitmaps[person_id]
+                self.bitmaps[person_id] = bitmap | bit if available else bitmap & ~bit
+
+    def is_available(self, person_id: str, day: date, slot: str) -> bool:
+        with self._lock:
+            bit = self._bit(day, slot)
+            return bit is not None and bool(self.bitmaps.get(person_id, 0) & bit)
+
+    def available_persons(self, day: date, slot: str) -> List[str]:
+        """Gibt die ids der Personen zurück, die am Tag zur Tageszeit verfügbar sind"""
+        with self._lock:
+            bit = self._bit(day, slot)
+            if bit is None:
+                return []
+            return [person_id for person_id, bitmap in self.bitmaps.items() if bitmap & bit]
+
+    def full_mask(self) -> int:
+        """Alle (Tageszeit, Tag)-Bits der Tageszeiten des Teams und später ausgewählter Tageszeiten"""
+        with self._lock:
+            return (1 << (len(self.slots) * self.num_days)) - 1
+
+    def intersection(self, person_ids: Optional[Iterable[str]] = None) -> int:
+        """Slots, in denen alle (bzw. die angegebenen) Personen verfügbar sind"""
+        with self._lock:
+            mask = self.full_mask()
+            for person_id in list(self.bitmaps) if person_ids is None else person_ids:
+                mask &= self.bitmaps.get(person_id, 0)
+            return mask
+
+    def union(self, person_ids: Optional[Iterable[str]] = None) -> int:
+        """Slots, in denen mindestens eine der (bzw. der angegebenen) Personen verfügbar ist"""
+        with self._lock:
+            mask = 0
+            for person_id in list(self.bitmaps) if person_ids is None else person_ids:
+                mask |= self.bitmaps.get(person_id, 0)
+            return mask
+
+    def decode(self, mask: int) -> List[Tuple[date, str]]:
+        """Wandelt eine Bitmaske in eine nach Datum sortierte Liste von (Tag, Tageszeit) um"""
+        with self._lock:
+            slots = list(self.slots)
+        result = []
+        while mask:
+            low = mask & -mask
+            slot, offset = divmod(low.bit_length() - 1, self.num_days)
+            result.append((self.start + timedelta(days=offset), slot, slots[slot]))
+            mask ^= low
+        return [(day, name) for day, _, name in sorted(result)]
+
+
+# Geladene Perioden (LRU) und Generation pro Periode, damit ein Ladevorgang, den eine Änderung
+# überholt, nichts Veraltetes speichert
+_periods: "OrderedDict[str, PeriodBitmaps]" = OrderedDict()
+_generations: Dict[str, int] = {}
+_epoch = 0
+_lock = threading.Lock()
+
+
+@db_session
+def _load_period_bitmaps(period_id: str) -> Optional[PeriodBitmaps]:
+    """Baut die Bitmaps einer Periode aus Mitgliedern, Tageszeiten des Teams und aktiven Verfügbarkeiten auf (drei Abfragen)"""
+    period_uuid = uuid.UUID(period_id)
+    period = PlanPeriod.get(id=period_uuid)
+    if period is None or period.prep_delete is not None:
+        return None
+    members = select((e.person.id, e.person.f_name, e.person.l_name) for e in EmployeePlanPeriod
+                     if e.plan_period == period and e.prep_delete is None)
+    bitmaps = PeriodBitmaps(period_id, period.start, period.end,
+                            {str(person_id): f"{f_name} {l_name or ''}".strip()
+                             for person_id, f_name, l_name in members})
+    # Alle aktiven Tageszeiten des Teams vorab aufnehmen, damit full_mask() auch Slots abdeckt, die noch
+    # niemand ausgewählt hat; nach Startzeit sortiert, damit sie in der üblichen Reihenfolge ihre Indizes erhalten
+    slots = select((t.name, t.start) for t in TimeOfDay
+                   if t.person.team == period.team and t.person.prep_delete is None and t.prep_delete is None)
+    for slot, _ in sorted(slots, key=lambda row: (row[1], row[0])):
+        bitmaps.add_slot(slot)
+    rows = select((a.employee_plan_period.person.id, a.date, a.time_of_day.name, a.time_of_day.start)
+                  for a in Availability
+                  if a.employee_plan_period.plan_period == period and a.employee_plan_period.prep_delete is None
+                  and a.prep_delete is None).order_by(4, 3)
+    for person_id, day, slot, _ in rows:
+        bitmaps.set(str(person_id), day, slot, True)
+    return bitmaps
+
+
+def get_period_bitmaps(period_id: str) -> Optional[PeriodBitmaps]:
+    """
+    Gibt die (bei Bedarf geladenen) Bitmaps einer Planungsperiode zurück, None für unbekannte Perioden.
+
+    Das Ergebnis wird nach jedem Commit, der Verfügbarkeiten ändert, fortlaufend aktualisiert.
+    """
+    if not BITMAPS_ENABLED:
+        raise RuntimeError("Der Bitmap-Speicher ist nicht aktiviert (AVAILABILITY_BITMAPS=1)")
+    with _lock:
+        bitmaps = _periods.get(period_id)
+        if bitmaps is not None:
+            _periods.move_to_end(period_id)
+            return bitmaps
+        generation = (_epoch, _generations.get(period_id, 0))
+
+    bitmaps = _load_period_bitmaps(period_id)
+    with _lock:
+        if bitmaps is not None and (_epoch, _generations.get(period_id, 0)) == generation:
+            _periods[period_id] = bitmaps
+            while len(_periods) > BITMAP_MAX_PERIODS:
+                _periods.popitem(last=False)
+    return bitmaps
+
+
+def invalidate(period_id: Optional[str] = None):
+    """Verwirft die Bitmaps einer Periode oder, ohne Angabe, alle; sie werden beim nächsten Zugriff neu geladen"""
+    global _epoch
+    with _lock:
+        if period_id is None:
+            _epoch += 1
+            _periods.clear()
+            return
+        _generations[period_id] = _generations.get(period_id, 0) + 1
+        _periods.pop(period_id, None)
+
+
+def _apply_availability_change(period_id: str, person_id: str, day: date, slot: str, available: bool):
+    with _lock:
+        bitmaps = _periods.get(period_id)
+        if bitmaps is not None and person_id not in bitmaps.members:
+            # Neues Mitglied: Name und Mitgliedschaft beim nächsten Zugriff aus der Datenbank laden
+            _periods.pop(period_id)
+            bitmaps = None
+        if bitmaps is None:
+            # Ein laufender Ladevorgang hat evtl. noch den alten Stand gelesen und darf ihn nicht speichern
+            _generations[period_id] = _generations.get(period_id, 0) + 1
+            return
+    bitmaps.set(person_id, day, slot, available)
+
+
+# Die Empfänger laufen beim Flush der schreibenden db_session, also vor dem Commit. Sie halten nur die
+# Werte fest; geändert bzw. invalidiert wird über signals.on_commit erst nach dem Commit, sodass ein
+# Rollback (z.B. ein fehlgeschlagener Batch) die Bitmaps nicht verfälscht.
+def _on_availability_changed(availability, event):
+    if event == 'delete' and availability.prep_delete is not None:
+        # Endgültiges Löschen bereits deaktivierter Zeilen (Archivierung) ändert nichts
+        return
+    employee_plan_period = availability.employee_plan_period
+    available = event != 'delete' and availability.prep_delete is None and employee_plan_period.prep_delete is None
+    change = (str(employee_plan_period.plan_period.id), str(employee_plan_period.person.id), availability.date,
+              availability.time_of_day.name, available)
+    signals.on_commit(lambda: _apply_availability_change(*change))
+
+
+def _on_employee_plan_period_changed(employee_plan_period, event):
+    # Gelöschte oder wiederhergestellte Mitarbeiter: Periode beim nächsten Zugriff neu laden
+    if event in ('update', 'delete'):
+        period_id = str(employee_plan_period.plan_period.id)
+        signals.on_commit(lambda: invalidate(period_id))
+
+
+def _on_plan_period_changed(plan_period, event):
+    period_id = str(plan_period.id)
+    signals.on_commit(lambda: invalidate(period_id))
+
+
+def _on_time_of_day_changed(tod, event):
+    # Eine neue oder umbenannte Tageszeit kann in allen geladenen Perioden vorkommen
+    if event in ('insert', 'update'):
+        signals.on_commit(invalidate)
+
+
+def _on_person_changed(person, event):
+    if event == 'team_change':
+        signals.on_commit(invalidate)
+
+
+if BITMAPS_ENABLED:
+    signals.connect('Availability', _on_availability_changed)
+    signals.connect('EmployeePlanPeriod', _on_employee_plan_period_changed)
+    signals.connect('PlanPeriod', _on_plan_period_changed)
+    signals.connect('TimeOfDay', _on_time_of_day_changed)
+    signals.connect('Person', _on_person_changed)
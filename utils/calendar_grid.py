@@ -0,0 +1,70 @@
+from datetime import date
+from typing import Any, Dict, List
+
+# Farben für Planungsperioden
+colors_for_periods = ['bg-blue-800/40', 'bg-emerald-800/40', 'bg-violet-800/40']
+
+
+def period_label(start: date, end: date) -> str:
+    """Erzeugt die Anzeigebezeichnung einer Planungsperiode, z.B. '01.11.24 - 11.11.24'"""
+    return f'{start.strftime("%d.%m.%y")} - {end.strftime("%d.%m.%y")}'
+
+
+def build_calendar_layout(plan_periods: List[Dict[str, Any]], color_offset: int = 0) -> Dict[str, Any]:
+    """
+    Berechnet die benutzerunabhängige Struktur des Kalenders aus den Planungsperioden.
+
+    Args:
+        plan_periods: Planungsperioden wie von get_plan_periods() geliefert, nach Start sortiert
+        color_offset: Anzahl der Perioden vor dem Fenster, damit Farben beim Nachladen fortlaufend bleiben
+
+    Returns:
+        Dict mit grouped_dates, period_deadlines, period_messages, period_first_month,
+        sorted_periods, period_colors und periods_by_label
+    """
+    # Tage aller Planperioden, gruppieren nach Monat und plan_periods
+    grouped_dates = {}
+    period_deadlines = {}
+    period_messages = {}  # Dictionary für die Mitteilungen
+    period_first_month = {}  # Speichert den ersten Monat jeder Periode
+    periods_by_label = {}
+
+    for period in plan_periods:
+        text_plan_periods = period_label(period["start"], period["end"])
+        period_deadlines[text_plan_periods] = period["deadline"]
+        period_messages[text_plan_periods] = period["message"]
+        periods_by_label[text_plan_periods] = period
+
+        # Ersten Monat für jede Periode speichern
+        period_first_month[text_plan_periods] = period["start"].month
+
+        for ordinal in range(period["start"].toordinal(), period["end"].toordinal() + 1):
+            day_date = date.fromordinal(ordinal)
+            month_group = grouped_dates.get(day_date.month)
+            if month_group is None:
+                month_group = grouped_dates[day_date.month] = {
+                    'year': day_date.year,
+                    'periods': {}
+                }
+            month_group['periods'].setdefault(text_plan_periods, []).append(day_date)
+
+    # Sortierte Perioden basierend auf dem Startdatum
+    sorted_periods = [label for label, period in sorted(periods_by_label.items(), key=lambda item: item[1]["start"])
+                      if period["end"] >= period["start"]]
+
+    # Generiere Farben für die Planungsperioden
+    period_colors = {}
+    for month_periods in grouped_dates.values():
+        for period in month_periods['periods'].keys():
+            if period not in period_colors:
+                period_colors[period] = colors_for_periods[(color_offset + len(period_colors)) % len(colors_for_periods)]
+
+    return {
+        'grouped_dates': grouped_dates,
+        'period_deadlines': period_deadlines,
+        'period_messages': period_messages,
+        'period_first_month': period_first_month,
+        'sorted_periods': sorted_periods,
+        'period_colors': period_colors,
+        'periods_by_label': periods_by_label
+    }
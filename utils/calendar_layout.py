@@ -0,0 +1,103 @@
+import os
+import threading
+from datetime import date
+from typing import Any, Dict, Optional
+
+from models import signals
+from utils.calendar_grid import build_calendar_layout
+from utils.db_helpers import get_plan_periods
+from utils.period_index import get_period_index
+
+# Kalenderfenster in Planungsperioden: vor und nach der aktuellen Periode sowie pro nachgeladenem Abschnitt
+CALENDAR_PERIODS_BEFORE = int(os.environ.get("CALENDAR_PERIODS_BEFORE", "1"))
+CALENDAR_PERIODS_AHEAD = int(os.environ.get("CALENDAR_PERIODS_AHEAD", "3"))
+CALENDAR_CHUNK_PERIODS = int(os.environ.get("CALENDAR_CHUNK_PERIODS", "3"))
+
+# Prozessinterner Cache der berechneten Layouts (Schlüssel beginnt mit der Team-ID) und Generation pro Team
+_cache: Dict[Any, Dict[str, Any]] = {}
+_generations: Dict[Optional[str], int] = {}
+# Wird bei jeder vollständigen Invalidierung erhöht, auch für Teams ohne eigenen Eintrag
+_epoch = 0
+_lock = threading.Lock()
+
+
+def get_calendar_window(anchor: Optional[date] = None, after: Optional[date] = None,
+                        before: Optional[date] = None, team_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Bestimmt das Datumsfenster des Kalenders über den Periodenindex des Teams.
+
+    Ohne after/before umfasst das Fenster die Periode zu anchor (Standard: heute) mit
+    CALENDAR_PERIODS_BEFORE Perioden davor und CALENDAR_PERIODS_AHEAD danach. Mit after bzw. before
+    werden die nächsten bzw. vorherigen CALENDAR_CHUNK_PERIODS Perioden zum Nachladen gewählt.
+
+    Returns:
+        Dict mit start, end, has_earlier, has_later und color_offset oder None, wenn keine Perioden im Fenster liegen
+    """
+    index = get_period_index(team_id)
+    if after:
+        periods = index.periods_after(after, CALENDAR_CHUNK_PERIODS)
+    elif before:
+        periods = index.periods_before(before, CALENDAR_CHUNK_PERIODS)
+    else:
+        periods = index.window(anchor or date.today(), CALENDAR_PERIODS_BEFORE, CALENDAR_PERIODS_AHEAD)
+    if not periods:
+        return None
+
+    start = periods[0]['start']
+    end = max(p['end'] for p in periods)
+    return {
+        'start': start,
+        'end': end,
+        'has_earlier': bool(index.periods_before(start, 1)),
+        'has_later': bool(index.periods_after(end, 1)),
+        'color_offset': len(index.periods_before(start, len(index)))
+    }
+
+
+def get_calendar_layout(start: Optional[date] = None, end: Optional[date] = None,
+                        color_offset: int = 0, team_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Gibt das Kalender-Layout der aktiven Planungsperioden eines Teams (None: aller Teams) zurück,
+    die im Fenster (start, end) beginnen (ohne Fenster: aller Perioden).
+
+    Das Layout wird pro Team und Fenster einmal berechnet und bis zur nächsten Änderung einer PlanPeriod
+    zwischengespeichert. Das Ergebnis wird von allen Requests geteilt und darf nicht verändert werden.
+    """
+    key = (team_id, start, end, color_offset)
+    with _lock:
+        layout = _cache.get(key)
+        generation = (_epoch, _generations.get(team_id, 0))
+    if layout is not None:
+        return layout
+
+    layout = build_calendar_layout(get_plan_periods(start, end, team_id), color_offset)
+    with _lock:
+        if (_epoch, _generations.get(team_id, 0)) == generation:
+            # Fenster wandern mit dem aktuellen Datum, alte Einträge nicht unbegrenzt behalten
+            if len(_cache) >= 64:
+                _cache.clear()
+            _cache[key] = layout
+    return layout
+
+
+def invalidate(team_id: Optional[str] = None):
+    """Verwirft die Layouts eines Teams (und die teamübergreifenden) oder, ohne Angabe, alle Layouts"""
+    global _epoch
+    with _lock:
+        if team_id is None:
+            _epoch += 1
+            _cache.clear()
+            return
+        for team in (team_id, None):
+            _generations[team] = _generations.get(team, 0) + 1
+        for key in [key for key in _cache if key[0] in (team_id, None)]:
+            del _cache[key]
+
+
+def _on_plan_period_changed(plan_period, event):
+    # Bei Änderungen kann auch das Team gewechselt haben, dann sind zwei Teams betroffen
+    team_id = None if event == 'update' else str(plan_period.team.id)
+    signals.on_commit(lambda: invalidate(team_id))
+
+
+signals.connect('PlanPeriod', _on_plan_period_changed)
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from config import database as database_config
+from config.database import apply_connection_profile
+from utils.instrumentation import get_logger
+
+# Deaktivierte Verfügbarkeiten werden nach so vielen Tagen archiviert
+COMPACTION_RETENTION_DAYS = int(os.environ.get("COMPACTION_RETENTION_DAYS", "30"))
+# Zeilen pro Transaktion; kurze Transaktionen halten die Schreibsperre für die Anwendung nur kurz
+COMPACTION_BATCH_SIZE = int(os.environ.get("COMPACTION_BATCH_SIZE", "5000"))
+# Pause zwischen zwei Batches, damit wartende Schreiber der Anwendung zum Zug kommen
+COMPACTION_PAUSE_MS = int(os.environ.get("COMPACTION_PAUSE_MS", "50"))
+# Abstand der geplanten Läufe in der Anwendung (0 = keine geplanten Läufe)
+COMPACTION_INTERVAL_HOURS = float(os.environ.get("COMPACTION_INTERVAL_HOURS", "24"))
+# Verzögerung des ersten geplanten Laufs nach dem Start
+COMPACTION_INITIAL_DELAY_SECONDS = float(os.environ.get("COMPACTION_INITIAL_DELAY_SECONDS", "300"))
+
+ARCHIVE_TABLE = "Availability"
+# Nächster Batch archivierbarer Zeilen (Parameter: Stichtag, Batchgröße); nutzt den partiellen Index auf prep_delete
+BATCH_SELECT_SQL = ('SELECT "id" FROM main."Availability" '
+                    'WHERE "prep_delete" IS NOT NULL AND "prep_delete" < ? ORDER BY "prep_delete" LIMIT ?')
+
+logger = get_logger("compaction")
+
+
+def default_archive_path(db_path: str) -> str:
+    """Archivdatei neben der Datenbank, z.B. database.sqlite -> database.archive.sqlite"""
+    root, ext = os.path.splitext(db_path)
+    return os.environ.get("ARCHIVE_DB_PATH") or f"{root}.archive{ext or '.sqlite'}"
+
+
+def _columns(connection: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row[1] for row in connection.execute(f'PRAGMA {schema}.table_info("{table}")')]
+
+
+def _prepare_archive(connection: sqlite3.Connection) -> List[str]:
+    """Legt die Archivtabelle an bzw. ergänzt neue Spalten und gibt die zu kopierenden Spalten zurück"""
+    columns = _columns(connection, "main", "Availability")
+    archived = _columns(connection, "archive", ARCHIVE_TABLE)
+    if not archived:
+        # Ohne Fremdschlüssel: Personen und Tageszeiten können später endgültig gelöscht werden
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        connection.execute(f'CREATE TABLE archive."{ARCHIVE_TABLE}" ({column_list}, "archived_at" TEXT)')
+        connection.execute(f'CREATE UNIQUE INDEX archive."idx_{ARCHIVE_TABLE.lower()}__id" '
+                           f'ON "{ARCHIVE_TABLE}" ("id")')
+    else:
+        for column in columns:
+            if column not in archived:
+                connection.execute(f'ALTER TABLE archive."{ARCHIVE_TABLE}" ADD COLUMN "{column}"')
+    return columns
+
+
+def compact(db_path: Optional[str] = None, archive_path: Optional[str] = None,
+            retention_days: int = COMPACTION_RETENTION_DAYS, batch_size: int = COMPACTION_BATCH_SIZE,
+            pause_ms: int = COMPACTION_PAUSE_MS, vacuum: bool = True) -> Dict[str, Any]:
+    """
+    Verschiebt Verfügbarkeiten, die vor mehr als retention_days Tagen deaktiviert wurden, in eine
+    separate SQLite-Datei und gibt den frei gewordenen Platz per incremental_vacuum zurück.
+
+    Jeder Batch wird zuerst ins Archiv geschrieben (INSERT OR IGNORE, wiederholbar) und erst danach in
+    einer eigenen Transaktion aus der Datenbank gelöscht. Zeilen, die inzwischen reaktiviert wurden,
+    bleiben dabei erhalten. incremental_vacuum wirkt nur bei auto_vacuum=INCREMENTAL (siehe --convert).
+
+    Returns:
+        Dict[str, Any]: Anzahl archivierter Zeilen, Batches, freigegebener Seiten und Laufzeit
+    """
+    db_path = db_path or database_config.DB_PATH
+    archive_path = archive_path or default_archive_path(db_path)
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat(sep=" ")
+    started = time.perf_counter()
+    archived = batches = 0
+
+    # Autocommit: Jede Anweisung ist eine eigene, kurze Transaktion
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        apply_connection_profile(connection)
+        connection.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        columns = _prepare_archive(connection)
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        connection.execute("CREATE TEMP TABLE compaction_batch (id PRIMARY KEY)")
+
+        while True:
+            connection.execute("DELETE FROM temp.compaction_batch")
+            connection.execute(f"INSERT INTO temp.compaction_batch {BATCH_SELECT_SQL}", (cutoff, batch_size))
+            if connection.execute("SELECT count(*) FROM temp.compaction_batch").fetchone()[0] == 0:
+                break
+            connection.execute(
+                f'INSERT OR IGNORE INTO archive."{ARCHIVE_TABLE}" ({column_list}, "archived_at") '
+                f'SELECT {column_list}, ? FROM main."Availability" '
+                f'WHERE "id" IN (SELECT id FROM temp.compaction_batch)',
+                (datetime.now().isoformat(sep=" "),)
+            )
+            deleted = connection.execute(
+                'DELETE FROM main."Availability" WHERE "id" IN (SELECT id FROM temp.compaction_batch) '
+                'AND "prep_delete" IS NOT NULL AND "prep_delete" < ?',
+                (cutoff,)
+            ).rowcount
+            archived += deleted
+            batches += 1
+            if pause_ms:
+                time.sleep(pause_ms / 1000)
+
+        freed_pages = 0
+        if vacuum:
+            auto_vacuum = connection.execute("PRAGMA main.auto_vacuum").fetchone()[0]
+            if auto_vacuum == 2:
+                freed_pages = connection.execute("PRAGMA main.freelist_count").fetchone()[0]
+                # executescript führt das PRAGMA bis zum Ende aus; execute() gäbe nur eine Seite frei
+                connection.executescript("PRAGMA main.incremental_vacuum;")
+                connection.execute("PRAGMA main.wal_checkpoint(PASSIVE)").fetchall()
+            elif archived:
+                logger.info("incremental vacuum skipped", extra={'fields': {
+                    'auto_vacuum': auto_vacuum, 'hint': 'python -m utils.compaction --convert'}})
+    finally:
+        connection.close()
+
+    result = {
+        'archived': archived,
+        'batches': batches,
+        'freed_pages': freed_pages,
+        'archive': archive_path,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info("compaction finished", extra={'fields': result})
+    return result
+
+
+def enable_incremental_vacuum(db_path: Optional[str] = None):
+    """
+    Stellt die Datenbank auf auto_vacuum=INCREMENTAL um. Das erfordert ein vollständiges VACUUM, das die
+    Datenbank für seine Dauer sperrt, und ist daher ein einmaliger, manueller Schritt.
+    """
+    connection = sqlite3.connect(db_path or database_config.DB_PATH, isolation_level=None)
+    try:
+        apply_connection_profile(connection)
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+
+
+async def run_periodically(interval_hours: float = COMPACTION_INTERVAL_HOURS,
+                           initial_delay: float = COMPACTION_INITIAL_DELAY_SECONDS):
+    """Führt compact() in der Anwendung regelmäßig im Pool "maintenance" aus, bis der Task abgebrochen wird"""
+    from utils.async_db import get_named_executor
+
+    await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            await get_named_executor("maintenance", 1).run(compact)
+        except Exception:
+            logger.exception("compaction failed")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Archiviert deaktivierte Verfügbarkeiten in eine separate Datei und verkleinert die Datenbank"
+    )
+    parser.add_argument("--db", default=database_config.DB_PATH, help="Pfad zur SQLite-Datenbank")
+    parser.add_argument("--archive", help="Archivdatei (Standard: <db>.archive.sqlite bzw. ARCHIVE_DB_PATH)")
+    parser.add_argument("--retention-days", type=int, default=COMPACTION_RETENTION_DAYS)
+    parser.add_argument("--batch-size", type=int, default=COMPACTION_BATCH_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=COMPACTION_PAUSE_MS)
+    parser.add_argument("--no-vacuum", action="store_true", help="Kein incremental_vacuum nach dem Archivieren")
+    parser.add_argument("--convert", action="store_true",
+                        help="Einmalig auf auto_vacuum=INCREMENTAL umstellen (vollständiges VACUUM, sperrt die Datenbank)")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.abspath(args.db)
+    result = compact(db_path, args.archive, args.retention_days, args.batch_size, args.pause_ms,
+                     vacuum=not args.no_vacuum)
+    print(f"Archiviert: {result['archived']} Zeilen in {result['batches']} Batches nach {result['archive']}, "
+          f"freigegebene Seiten: {result['freed_pages']} ({result['duration_ms']:.0f} ms)")
+    if args.convert:
+        enable_incremental_vacuum(db_path)
+        print("auto_vacuum=INCREMENTAL aktiviert")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from pony.orm import db_session, select
+
+from models.entities import EmployeePlanPeriod, Availability
+from utils.export import get_dispatcher_period
+
+# Ein Slot (Datum, Tageszeit) mit weniger verfügbaren Personen gilt als unterbesetzt
+COVERAGE_MIN_PEOPLE = int(os.environ.get("COVERAGE_MIN_PEOPLE", "2"))
+# Anzahl Farbstufen der Heatmap (0 = niemand verfügbar, HEATMAP_LEVELS - 1 = das ganze Team)
+HEATMAP_LEVELS = 5
+
+
+def _numpy():
+    """Importiert NumPy erst bei Bedarf; die Abdeckungsanalyse ist optional (pip install .[analytics])"""
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("Die Abdeckungsanalyse benötigt NumPy (pip install .[analytics])") from e
+    return numpy
+
+
+@db_session
+def load_coverage_data(period_id: str, dispatcher_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Lädt Mitarbeiter und aktive Verfügbarkeiten einer Planungsperiode für den Disponenten ihres Teams.
+
+    Returns:
+        Optional[Dict[str, Any]]: Periode, Mitarbeiter (EmployeePlanPeriod-id, Name) und die
+        Verfügbarkeiten als Tupel (EmployeePlanPeriod-id, Datum, Tageszeit, Startzeit), oder None
+        ohne Zugriff
+    """
+    period = get_dispatcher_period(period_id, dispatcher_id)
+    if period is None:
+        return None
+
+    members = select((e.id, e.person.f_name, e.person.l_name) for e in EmployeePlanPeriod
+                     if e.plan_period == period and e.prep_delete is None
+                     and e.person.prep_delete is None).order_by(3, 2, 1)[:]
+    # Alle Verfügbarkeiten der Periode mit einer Abfrage, ohne Entities im Identity-Map
+    rows = select((a.employee_plan_period.id, a.date, a.time_of_day.name, a.time_of_day.start)
+                  for a in Availability
+                  if a.employee_plan_period.plan_period == period and a.employee_plan_period.prep_delete is None
+                  and a.employee_plan_period.person.prep_delete is None and a.prep_delete is None
+                  and a.date >= period.start and a.date <= period.end)[:]
+    return {
+        'period': {
+            'id': str(period.id),
+            'team': period.team.name,
+            'start': period.start,
+            'end': period.end,
+            'deadline': period.deadline,
+        },
+        'members': [(epp_id, f"{f_name} {l_name or ''}".strip()) for epp_id, f_name, l_name in members],
+        'rows': rows,
+    }
+
+
+def build_coverage(data: Dict[str, Any], min_people: int = COVERAGE_MIN_PEOPLE) -> Dict[str, Any]:
+    """
+    Berechnet die Abdeckung einer Planungsperiode aus den Daten von load_coverage_data.
+
+    Die Verfügbarkeiten werden in ein boolesches Array Personen × Tage × Tageszeiten übertragen;
+    Abdeckung pro Slot, Füllgrad pro Person und unterbesetzte Slots sind Reduktionen darüber.
+    Tageszeiten werden über ihren Namen zusammengefasst, da jede Person eigene TimeOfDays hat.
+    """
+    np = _numpy()
+    period, members, rows = data['period'], data['members'], data['rows']
+    start: date = period['start']
+    num_days = (period['end'] - start).days + 1
+
+    # Tageszeiten nach ihrer frühesten Startzeit sortieren (Altdaten speichern sie als Text)
+    slot_starts: Dict[str, str] = {}
+    for _, _, name, slot_start in rows:
+        slot_starts[name] = min(slot_starts.get(name, str(slot_start)), str(slot_start))
+    slots = sorted(slot_starts, key=lambda name: (slot_starts[name], name))
+
+    person_index = {epp_id: i for i, (epp_id, _) in enumerate(members)}
+    slot_index = {name: i for i, name in enumerate(slots)}
+    matrix = np.zeros((len(members), num_days, len(slots)), dtype=bool)
+    if rows:
+        count = len(rows)
+        persons = np.fromiter((person_index[row[0]] for row in rows), dtype=np.intp, count=count)
+        days = np.fromiter((row[1].toordinal() for row in rows), dtype=np.intp, count=count) - start.toordinal()
+        slot_ids = np.fromiter((slot_index[row[2]] for row in rows), dtype=np.intp, count=count)
+        matrix[persons, days, slot_ids] = True
+
+    coverage = matrix.sum(axis=0)                       # Tage × Tageszeiten: verfügbare Personen
+    days_filled = matrix.any(axis=2).sum(axis=1)        # pro Person: Tage mit mindestens einer Auswahl
+    entries = matrix.sum(axis=(1, 2))                   # pro Person: ausgewählte Slots
+    fill_rates = days_filled / num_days if num_days else np.zeros(len(members))
+    team_size = len(members)
+    levels = (np.ceil(coverage * (HEATMAP_LEVELS - 1) / team_size).astype(int) if team_size
+              else np.zeros_like(coverage))
+    under_days, under_slots = np.nonzero(coverage < min_people)
+    order = np.argsort(fill_rates, kind="stable")
+
+    dates = [start + timedelta(days=i) for i in range(num_days)]
+    return {
+        'period': period,
+        'team_size': team_size,
+        'min_people': min_people,
+        'dates': dates,
+        'slots': slots,
+        'coverage': coverage.tolist(),
+        'levels': levels.tolist(),
+        'persons': [{'name': members[i][1], 'fill_rate': float(fill_rates[i]), 'entries': int(entries[i])}
+                    for i in order],
+        'missing': [members[i][1] for i in np.flatnonzero(entries == 0)],
+        'under_covered': [{'date': dates[d], 'slot': slots[s], 'count': int(coverage[d, s])}
+                          for d, s in zip(under_days.tolist(), under_slots.tolist())],
+    }
+
+
+def get_coverage(period_id: str, dispatcher_id: str, min_people: int = COVERAGE_MIN_PEOPLE) -> Optional[Dict[str, Any]]:
+    """Lädt und berechnet die Abdeckung einer Planungsperiode (None ohne Zugriff)"""
+    _numpy()  # ohne NumPy gar nicht erst abfragen
+    data = load_coverage_data(period_id, dispatcher_id)
+    if data is None:
+        return None
+    return build_coverage(data, min_people)
@@ -1,15 +1,32 @@
-from pony.orm import db_session, flush
+from pony.orm import db_session, flush, select, max, count, coalesce
 
 from models import schemas
 from models.entities import PlanPeriod, EmployeePlanPeriod, Person, TimeOfDay, Availability
+from utils.period_index import get_period_index
+from utils.instrumentation import get_logger
+from utils.passwords import hash_password, verify_password, dummy_hash
 from datetime import datetime, date, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import os
 import uuid
 
+logger = get_logger("db_helpers")
+
+# Höchstzahl der Tage, die eine Sammelbearbeitung insgesamt berühren darf (inkl. copy_week und clear_period)
+BATCH_MAX_DAYS = int(os.environ.get("BATCH_MAX_DAYS", "366"))
+
 @db_session
-def get_plan_periods() -> List[Dict[str, Any]]:
-    """Holt alle Planungsperioden aus der Datenbank und formatiert sie"""
-    periods = PlanPeriod.select(lambda p: p.prep_delete is None).order_by(PlanPeriod.start)
+def get_plan_periods(start: date = None, end: date = None, team_id=None) -> List[Dict[str, Any]]:
+    """Holt alle bzw. die im Fenster (start, end) beginnenden Planungsperioden (optional eines Teams) und formatiert sie"""
+    periods = PlanPeriod.select(lambda p: p.prep_delete is None)
+    if team_id:
+        team_uuid = uuid.UUID(team_id)
+        periods = periods.filter(lambda p: p.team.id == team_uuid)
+    if start:
+        periods = periods.filter(lambda p: p.start >= start)
+    if end:
+        periods = periods.filter(lambda p: p.start <= end)
+    periods = periods.order_by(PlanPeriod.start)
     result = []
     
     for period in periods:
@@ -55,7 +72,8 @@ def get_time_of_day_options(user_id=None) -> List[Dict[str, Any]]:
                     start_time = datetime.strptime(start_time, "%H:%M").time()
                 except ValueError as e:
                     # Im Fehlerfall, gib ein Standardzeit-Objekt zurück und protokolliere den Fehler
-                    print(f"Fehler beim Konvertieren der Zeit: {start_time} - {e}")
+                    logger.warning("invalid time_of_day start", extra={'fields': {'tod_id': str(tod.id),
+                                                                                   'start': start_time}})
                     start_time = datetime.strptime("00:00", "%H:%M").time()
         
         # Hol die Farbinformation und setze eine Standardfarbe, wenn keine vorhanden ist
@@ -79,76 +97,74 @@ def get_time_of_day_options(user_id=None) -> List[Dict[str, Any]]:
     return result
 
 @db_session
-def get_selected_times(user_id, period_id=None) -> Dict[str, List[str]]:
-    """Holt die ausgewählten Zeiten eines Benutzers für alle oder eine bestimmte Periode"""
+def get_selected_times(user_id, period_id=None, start: date = None, end: date = None) -> Dict[str, List[str]]:
+    """Holt die ausgewählten Zeiten eines Benutzers für alle oder eine bestimmte Periode
+
+    Alle aktiven (Datum, Tageszeit)-Paare werden mit einer einzigen verknüpften Abfrage
+    geladen, unabhängig davon, wie viele Planungsperioden der Benutzer hat. Optional kann
+    auf eine Periode (period_id) und/oder ein Datumsfenster (start, end) eingeschränkt werden.
+    """
     
     result = {}
     
     try:
-        
-        # Überprüfe, ob der angegebene Benutzer existiert
         user_uuid = uuid.UUID(user_id)
 
-        
+        availabilities = Availability.select(
+            lambda a: a.employee_plan_period.person.id == user_uuid and
+                      a.employee_plan_period.prep_delete is None and
+                      a.prep_delete is None
+        )
         if period_id:
             period_uuid = uuid.UUID(period_id)
-            emp_periods = EmployeePlanPeriod.select(
-                lambda epp: epp.person.id == user_uuid and 
-                            epp.plan_period.id == period_uuid and
-                            epp.prep_delete is None
-            )
-        else:
-            emp_periods = EmployeePlanPeriod.select(
-                lambda epp: epp.person.id == user_uuid and
-                             epp.prep_delete is None
-            )
-        
-        all_emp_periods = list(emp_periods)  # Konvertieren zu Liste für Zählung
-
-        for i, emp_period in enumerate(all_emp_periods):
-            
-            # Verfügbarkeiten für diese Periode abrufen
-            availabilities = Availability.select(
-                lambda a: a.employee_plan_period == emp_period and
-                          a.prep_delete is None
-            )
-            
-            all_availabilities = list(availabilities)  # Konvertieren zu Liste für Zählung
-            
-            # Verarbeite alle Verfügbarkeiten
-            for j, avail in enumerate(all_availabilities):
-                try:
-                    tod_id = str(avail.time_of_day.id)
-                    
-                    # Verwende direkt das Datum aus dem Verfügbarkeitseintrag
-                    if hasattr(avail, 'date') and avail.date is not None:
-                        date_str = avail.date.strftime("%Y-%m-%d")
-                        
-                        # Füge die Verfügbarkeit zum Ergebnis hinzu
-                        if date_str not in result:
-                            result[date_str] = []
-                        if tod_id not in result[date_str]:
-                            result[date_str].append(tod_id)
-                    else:
-                        print(f"    - Verfügbarkeit {j+1}/{len(all_availabilities)}: ID={avail.id} hat kein Datum")
-                        
-                except Exception as e:
-                    print(f"    - Fehler bei Verarbeitung von Verfügbarkeit {avail.id}: {str(e)}")
-                
-        # Stelle sicher, dass alle Schlüssel Strings sind (nicht datetime.date)
-        string_result = {}
-        for key, value in result.items():
-            if not isinstance(key, str):
-                string_key = key.strftime('%Y-%m-%d') if hasattr(key, 'strftime') else str(key)
-                string_result[string_key] = value
-            else:
-                string_result[key] = value
-        
-        return string_result
-    except Exception as e:
+            availabilities = availabilities.filter(lambda a: a.employee_plan_period.plan_period.id == period_uuid)
+        if start:
+            availabilities = availabilities.filter(lambda a: a.date >= start)
+        if end:
+            availabilities = availabilities.filter(lambda a: a.date <= end)
+
+        # Nur die benötigten Spalten laden, ohne Entities im Identity-Map aufzubauen
+        query = select((a.date, a.time_of_day.id) for a in availabilities)
+
+        for avail_date, tod_id in query.order_by(1):
+            date_str = avail_date.strftime("%Y-%m-%d")
+            tod_ids = result.setdefault(date_str, [])
+            tod_id = str(tod_id)
+            if tod_id not in tod_ids:
+                tod_ids.append(tod_id)
+
+        return result
+    except Exception:
+        logger.exception("get_selected_times failed", extra={'fields': {'user_id': user_id}})
         return {}
-    finally:
-        print("--- END get_selected_times ---\n")
+
+@db_session
+def get_calendar_version(user_id, team_id=None) -> str:
+    """
+    Ermittelt die Datenversion des Kalenders eines Benutzers.
+
+    Die Version ändert sich, sobald sich eine Verfügbarkeit oder Tageszeit des Benutzers oder eine
+    Planungsperiode (mit team_id nur eine des Teams) ändert (latest_change bzw. prep_delete), und dient
+    als Schlüssel für gerenderte Fragmente.
+    """
+    user_uuid = uuid.UUID(user_id)
+    availability_version = select(
+        (max(coalesce(a.prep_delete, a.latest_change)), count(a)) for a in Availability
+        if a.employee_plan_period.person.id == user_uuid
+    ).first()
+    time_of_day_version = select(
+        max(coalesce(t.prep_delete, t.latest_change)) for t in TimeOfDay
+        if t.person.id == user_uuid
+    ).first()
+    plan_periods = PlanPeriod.select()
+    if team_id:
+        team_uuid = uuid.UUID(team_id)
+        plan_periods = plan_periods.filter(lambda p: p.team.id == team_uuid)
+    plan_period_version = select(
+        (max(coalesce(p.prep_delete, p.latest_change)), count(p)) for p in plan_periods
+    ).first()
+    return f"{availability_version}|{time_of_day_version}|{plan_period_version}"
+
 
 @db_session
 def get_user_notes(user_id=None) -> Dict[str, str]:
@@ -176,33 +192,20 @@ def get_user_notes(user_id=None) -> Dict[str, str]:
     return result
 
 @db_session
-def save_note(user_id, period_text, notes):
+def save_note(user_id, period_text, notes, team_id=None):
     """Speichert eine Notiz für eine Planungsperiode"""
-    # Parse period_text to get start and end dates
-    start_str, end_str = period_text.split(' - ')
-    start_date = datetime.strptime(start_str, "%d.%m.%y").date()
-    end_date = datetime.strptime(end_str, "%d.%m.%y").date()
-    
-    # Find the corresponding plan_period
-    plan_periods = PlanPeriod.select(
-        lambda p: p.start == start_date and 
-                  p.end == end_date and 
-                  p.prep_delete is None
-    )
-    plan_period = None
-    for p in plan_periods:
-        plan_period = p
-        break
-    
-    if not plan_period:
+    # Find the corresponding plan_period via the interval index of the user's team
+    period = get_period_index(team_id).find_by_label(period_text)
+    if not period:
         return False
+    plan_period_uuid = uuid.UUID(period['id'])
     
     # Find or create employee_plan_period
     person = Person[uuid.UUID(user_id)]
     
     emp_plan_periods = EmployeePlanPeriod.select(
         lambda epp: epp.person.id == uuid.UUID(user_id) and 
-                     epp.plan_period.id == plan_period.id and 
+                     epp.plan_period.id == plan_period_uuid and 
                      epp.prep_delete is None
     )
     
@@ -216,7 +219,7 @@ def save_note(user_id, period_text, notes):
             id=uuid.uuid4(),
             created_at=datetime.now(),
             latest_change=datetime.now(),
-            plan_period=plan_period,
+            plan_period=PlanPeriod[plan_period_uuid],
             person=person,
             notes=notes
         )
@@ -241,43 +244,59 @@ def get_availability_user_date(user_id: str, date_str: str) -> List[schemas.Avai
 
 
 @db_session
-def toggle_availability(user_id: str, date_str: str, tod_id: str) -> schemas.AvailabilityResponse:
+def toggle_availability(user_id: str, date_str: str, tod_id: str, team_id: str = None) -> schemas.AvailabilityResponse:
     """
     Schaltet die Verfügbarkeit eines Benutzers für eine bestimmte Tageszeit an einem bestimmten Datum um.
     
     Wenn für die angegebene Kombination aus Benutzer, Datum und Tageszeit bereits eine aktive 
-    Verfügbarkeit existiert, wird diese deaktiviert. Andernfalls wird eine neue Verfügbarkeit erstellt.
+    Verfügbarkeit existiert, wird diese deaktiviert. Andernfalls wird eine früher deaktivierte Zeile
+    reaktiviert oder, falls keine existiert, eine neue Verfügbarkeit erstellt.
+    Fehlt das EmployeePlanPeriod des Benutzers für die Periode, wird es angelegt.
 
     Args:
         user_id (str): Die UUID des Benutzers als String
         date_str (str): Das Datum im Format "YYYY-MM-DD"
         tod_id (str): Die UUID der Tageszeit (TimeOfDay) als String
+        team_id (str): Die UUID des Teams des Benutzers, in dessen Perioden gesucht wird (None: alle Teams)
 
     Returns:
         schemas.AvailabilityResponse]
     """
     date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-    plan_period_db = (PlanPeriod.select()
-                      .filter(lambda p: p.prep_delete is None)
-                      .filter(lambda p: p.start <= date_obj)
-                      .filter(lambda p: p.end >= date_obj)
-                      .filter(lambda p: p.prep_delete is None)
-                      .first())
+    plan_period = get_period_index(team_id).find_by_date(date_obj)
+    if plan_period is None:
+        raise ValueError(f"Keine Planungsperiode für den {date_obj.strftime('%d.%m.%Y')} gefunden")
+    plan_period_uuid = uuid.UUID(plan_period['id'])
 
     employee_plan_period_db = (EmployeePlanPeriod.select()
                                .filter(lambda epp: epp.person.id == uuid.UUID(user_id))
                                .filter(lambda epp: epp.prep_delete is None)
-                               .filter(lambda epp: epp.plan_period.id == plan_period_db.id)
+                               .filter(lambda epp: epp.plan_period.id == plan_period_uuid)
                                .first())
+    if employee_plan_period_db is None:
+        # Noch nicht provisioniert (z.B. Person nach Anlage der Periode hinzugekommen): jetzt anlegen
+        employee_plan_period_db = EmployeePlanPeriod(
+            created_at=datetime.now(),
+            latest_change=datetime.now(),
+            plan_period=PlanPeriod[plan_period_uuid],
+            person=Person[uuid.UUID(user_id)]
+        )
     time_of_day_db = TimeOfDay.get(id=uuid.UUID(tod_id))
-    availability_db = Availability.get(
+    # Aktive und deaktivierte Zeilen dieser Kombination mit einer Abfrage laden
+    rows = Availability.select(
         lambda a: a.employee_plan_period.id == employee_plan_period_db.id and
                   a.time_of_day == time_of_day_db and
-                  a.date == date_obj and
-                  a.prep_delete is None
-    )
+                  a.date == date_obj
+    )[:]
+    availability_db = next((a for a in rows if a.prep_delete is None), None)
+    inactive = [a for a in rows if a.prep_delete is not None]
     if availability_db:
         availability_db.prep_delete = datetime.now()
+    elif inactive:
+        # Zuletzt deaktivierte Zeile wiederverwenden statt eine weitere anzulegen
+        availability_db = max(inactive, key=lambda a: a.prep_delete)
+        availability_db.prep_delete = None
+        availability_db.latest_change = datetime.now()
     else:
         availability_db = Availability(
             created_at=datetime.now(),
@@ -288,35 +307,225 @@ def toggle_availability(user_id: str, date_str: str, tod_id: str) -> schemas.Ava
         )
     return schemas.AvailabilityResponse.model_validate(availability_db)
 
+
+@db_session
+def toggle_availability_for_day(user_id: str, date_str: str, tod_id: str,
+                                team_id: str = None) -> Tuple[schemas.AvailabilityResponse, List[str]]:
+    """
+    Schaltet eine Verfügbarkeit um (siehe toggle_availability) und ermittelt in derselben Transaktion
+    die danach aktiven Tageszeiten des Tages, damit die Tagesanzeige ohne weiteren Request aktualisiert werden kann.
+
+    Returns:
+        Tuple[schemas.AvailabilityResponse, List[str]]: Die umgeschaltete Verfügbarkeit und die IDs der aktiven Tageszeiten
+    """
+    availability = toggle_availability(user_id, date_str, tod_id, team_id)
+    flush()
+    date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+    selected_times = get_selected_times(user_id, None, date_obj, date_obj)
+    return availability, selected_times.get(date_str, [])
+
+
+
+@db_session
+def apply_availability_batch(user_id: str, operations: List[schemas.AvailabilityBatchOperation],
+                             team_id: str = None) -> Dict[str, List[str]]:
+    """
+    Wendet mehrere Änderungen an den Verfügbarkeiten eines Benutzers in einer Transaktion an.
+
+    Der aktuelle Stand aller betroffenen Tage wird mit einer Abfrage geladen, die Operationen werden
+    nacheinander auf diesen Stand angewendet und nur die Differenz wird geschrieben: neue Verfügbarkeiten
+    werden angelegt bzw. aus deaktivierten Zeilen reaktiviert, entfallene mit prep_delete markiert.
+    Tage außerhalb einer Planungsperiode werden nicht verändert.
+
+    Args:
+        user_id (str): Die UUID des Benutzers als String
+        operations (List[schemas.AvailabilityBatchOperation]): Die Änderungen in der gewünschten Reihenfolge
+        team_id (str): Die UUID des Teams des Benutzers, in dessen Perioden gesucht wird (None: alle Teams)
+
+    Returns:
+        Dict[str, List[str]]: Für jeden geänderten Tag ("YYYY-MM-DD") die IDs der danach aktiven Tageszeiten
+
+    Raises:
+        ValueError: Bei unbekannten Tageszeiten oder Perioden, fehlenden Angaben oder mehr als
+        BATCH_MAX_DAYS betroffenen Tagen
+    """
+    user_uuid = uuid.UUID(user_id)
+    person = Person[user_uuid]
+    period_index = get_period_index(team_id)
+    time_of_days = {tod.id: tod for tod in TimeOfDay.select(lambda t: t.person.id == user_uuid and t.prep_delete is None)}
+
+    # Betroffene Tage bestimmen, damit der aktuelle Stand mit einer einzigen Abfrage geladen werden kann
+    touched = set()
+    for operation in operations:
+        if operation.op in ("set", "unset"):
+            unknown = set(operation.tod_ids) - time_of_days.keys()
+            if unknown:
+                raise ValueError(f"Unbekannte Tageszeit: {', '.join(str(tod_id) for tod_id in unknown)}")
+            touched.update(operation.dates)
+        elif operation.op == "copy_week":
+            if not operation.source_week or not operation.target_week:
+                raise ValueError("Für copy_week werden source_week und target_week benötigt")
+            for offset in range(7):
+                touched.add(operation.source_week + timedelta(days=offset))
+                touched.add(operation.target_week + timedelta(days=offset))
+        elif operation.op == "clear_period":
+            if not operation.period:
+                raise ValueError("Für clear_period wird die Periode benötigt")
+            plan_period = period_index.find_by_label(operation.period)
+            if plan_period is None:
+                raise ValueError(f"Unbekannte Planungsperiode: {operation.period}")
+            touched.update(date.fromordinal(o) for o in range(plan_period['start'].toordinal(),
+                                                                plan_period['end'].toordinal() + 1))
+        if len(touched) > BATCH_MAX_DAYS:
+            raise ValueError(f"Zu viele Tage in einer Sammelbearbeitung (höchstens {BATCH_MAX_DAYS})")
+    if not touched:
+        return {}
+    window_start, window_end = min(touched), max(touched)
+
+    # Aktive und deaktivierte Zeilen des Fensters; deaktivierte werden beim Setzen wiederverwendet.
+    # Zeilen gelöschter Mitarbeiter-Planperioden zählen wie in get_selected_times nicht mit.
+    rows = Availability.select(
+        lambda a: a.employee_plan_period.person.id == user_uuid and
+                  a.employee_plan_period.prep_delete is None and
+                  a.date >= window_start and
+                  a.date <= window_end
+    )
+    active_by_key = {}
+    inactive_by_key = {}
+    for a in rows:
+        key = (a.date, a.time_of_day.id, a.employee_plan_period.id)
+        if a.prep_delete is None:
+            active_by_key[key[:2]] = a
+        elif key not in inactive_by_key or a.prep_delete > inactive_by_key[key].prep_delete:
+            inactive_by_key[key] = a
+    original = {}
+    for avail_date, tod_uuid in active_by_key:
+        original.setdefault(avail_date, set()).add(tod_uuid)
+    state = {avail_date: set(tod_uuids) for avail_date, tod_uuids in original.items()}
+
+    # Operationen nacheinander auf den Stand im Speicher anwenden
+    for operation in operations:
+        if operation.op == "set":
+            for day in operation.dates:
+                state.setdefault(day, set()).update(operation.tod_ids)
+        elif operation.op == "unset":
+            for day in operation.dates:
+                state.setdefault(day, set()).difference_update(operation.tod_ids)
+        elif operation.op == "copy_week":
+            for offset in range(7):
+                source_day = operation.source_week + timedelta(days=offset)
+                state[operation.target_week + timedelta(days=offset)] = set(state.get(source_day, ()))
+        elif operation.op == "clear_period":
+            plan_period = period_index.find_by_label(operation.period)
+            for day in touched:
+                if plan_period['start'] <= day <= plan_period['end']:
+                    state[day] = set()
+
+    employee_plan_periods = {
+        epp.plan_period.id: epp for epp in EmployeePlanPeriod.select(
+            lambda epp: epp.person.id == user_uuid and
+                        epp.prep_delete is None and
+                        epp.plan_period.start <= window_end and
+                        epp.plan_period.end >= window_start
+        )
+    }
+
+    # Nur die Differenz schreiben
+    now = datetime.now()
+    changed = {}
+    for day in sorted(touched):
+        before = original.get(day, set())
+        after = state.get(day, set())
+        if before == after:
+            continue
+        plan_period = period_index.find_by_date(day)
+        if plan_period is None:
+            continue
+        plan_period_uuid = uuid.UUID(plan_period['id'])
+        for tod_uuid in before - after:
+            active_by_key[(day, tod_uuid)].prep_delete = now
+        added = after - before
+        if added:
+            employee_plan_period = employee_plan_periods.get(plan_period_uuid)
+            if employee_plan_period is None:
+                employee_plan_period = employee_plan_periods[plan_period_uuid] = EmployeePlanPeriod(
+                    created_at=now,
+                    latest_change=now,
+                    plan_period=PlanPeriod[plan_period_uuid],
+                    person=person
+                )
+            for tod_uuid in added:
+                inactive = inactive_by_key.get((day, tod_uuid, employee_plan_period.id))
+                if inactive is not None:
+                    inactive.prep_delete = None
+                    inactive.latest_change = now
+                    continue
+                Availability(
+                    created_at=now,
+                    latest_change=now,
+                    time_of_day=time_of_days.get(tod_uuid) or TimeOfDay[tod_uuid],
+                    employee_plan_period=employee_plan_period,
+                    date=day
+                )
+        changed[day.strftime("%Y-%m-%d")] = [str(tod_uuid) for tod_uuid in after]
+
+    return changed
+
         
 @db_session
-def validate_login(username, password):
-    """Überprüft die Anmeldedaten des Benutzers"""
+def get_login_user(username) -> Optional[Dict[str, Any]]:
+    """
+    Lädt einen aktiven Benutzer für die Anmeldung.
+
+    Returns:
+        Optional[Dict[str, Any]]: Die Sitzungsdaten des Benutzers und unter 'password' der gespeicherte
+        Passwort-Hash (bei Altdaten Klartext), oder None, wenn der Benutzername unbekannt ist
+    """
+    # Umgehe den Generator-Ausdruck, der in Python 3.12 zu Problemen führt
+    users = Person.select(lambda p: p.username == username and p.prep_delete is None)
     
-    try:
-        # Umgehe den Generator-Ausdruck, der in Python 3.12 zu Problemen führt
-        users = Person.select(lambda p: p.username == username and 
-                              p.password == password and 
-                              p.prep_delete is None)
-        
-        # Manuelles Abrufen des ersten Ergebnisses
-        user = None
-        for p in users:
-            user = p
-            break
-        
-        if user:
-            return {
-                'id': str(user.id),
-                'username': user.username,
-                'first_name': user.f_name,
-                'last_name': user.l_name,
-                'email': user.email,
-                'is_admin': user.project_of_admin is not None
-            }
-        else:
-            print(f"Kein Benutzer mit dem Benutzernamen '{username}' und dem angegebenen Passwort gefunden.")
-        
+    # Manuelles Abrufen des ersten Ergebnisses
+    user = None
+    for p in users:
+        user = p
+        break
+    
+    if user is None:
         return None
-    finally:
-        print("--- END validate_login ---\n")
\ No newline at end of file
+    return {
+        'id': str(user.id),
+        'username': user.username,
+        'first_name': user.f_name,
+        'last_name': user.l_name,
+        'email': user.email,
+        'is_admin': user.project_of_admin is not None,
+        'team_id': str(user.team.id) if user.team else None,
+        'password': user.password
+    }
+
+@db_session
+def update_password_hash(user_id, old_password, new_password) -> bool:
+    """Ersetzt den gespeicherten Passwort-Hash, sofern er sich seit dem Laden nicht geändert hat"""
+    user = Person.get(id=uuid.UUID(user_id))
+    if user is None or user.password != old_password:
+        return False
+    user.password = new_password
+    return True
+
+@db_session
+def validate_login(username, password):
+    """
+    Überprüft die Anmeldedaten des Benutzers synchron und ersetzt Klartext bzw. veraltete Hashes.
+
+    Die Anwendung verwendet utils.auth.authenticate, das den Hash in einem eigenen Pool prüft.
+    """
+    user = get_login_user(username)
+    ok, needs_rehash = verify_password(password, user['password'] if user else dummy_hash())
+    if not user or not ok:
+        logger.info("login failed", extra={'fields': {'username': username}})
+        return None
+
+    stored = user.pop('password')
+    if needs_rehash:
+        update_password_hash(user['id'], stored, hash_password(password))
+    return user
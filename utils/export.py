@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+import os
+import uuid
+from datetime import datetime, time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pony.orm import db_session, select
+
+from models.entities import PlanPeriod, EmployeePlanPeriod, Availability
+from utils.async_db import run_db
+
+# Anzahl Mitarbeiter (EmployeePlanPeriods), deren Verfügbarkeiten mit einer Abfrage geladen werden
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "100"))
+
+EXPORT_FORMATS = {
+    'csv': "text/csv; charset=utf-8",
+    'json': "application/json",
+    'ndjson': "application/x-ndjson",
+}
+
+EXPORT_COLUMNS = ["person_id", "last_name", "first_name", "email", "date", "time_of_day", "start", "end", "notes"]
+
+
+def get_dispatcher_period(period_id: str, dispatcher_id: str) -> Optional[PlanPeriod]:
+    """Gibt die aktive Planungsperiode zurück, wenn dispatcher_id Disponent ihres Teams ist (innerhalb einer db_session)"""
+    try:
+        period_uuid = uuid.UUID(period_id)
+        dispatcher_uuid = uuid.UUID(dispatcher_id)
+    except (TypeError, ValueError):
+        return None
+    period = PlanPeriod.get(id=period_uuid)
+    if period is None or period.prep_delete is not None or period.team.dispatcher.id != dispatcher_uuid:
+        return None
+    return period
+
+
+@db_session
+def is_period_dispatcher(period_id: str, dispatcher_id: str) -> bool:
+    """Prüft, ob dispatcher_id Disponent des Teams der aktiven Planungsperiode period_id ist"""
+    return get_dispatcher_period(period_id, dispatcher_id) is not None
+
+
+@db_session
+def get_export_members(period_id: str, dispatcher_id: str) -> Optional[Tuple[Dict[str, Any], List[uuid.UUID]]]:
+    """
+    Lädt eine Planungsperiode für den Export durch den Disponenten ihres Teams.
+
+    Returns:
+        Optional[Tuple[Dict[str, Any], List[uuid.UUID]]]: Die Periode und die ids ihrer aktiven
+        EmployeePlanPeriods in Exportreihenfolge, oder None, wenn die Periode nicht existiert oder
+        der Benutzer nicht Disponent des Teams ist
+    """
+    period = get_dispatcher_period(period_id, dispatcher_id)
+    if period is None:
+        return None
+
+    members = select((e.id, e.person.l_name, e.person.f_name) for e in EmployeePlanPeriod
+                     if e.plan_period == period and e.prep_delete is None
+                     and e.person.prep_delete is None).order_by(2, 3, 1)
+    return {
+        'id': str(period.id),
+        'team': period.team.name,
+        'start': period.start,
+        'end': period.end,
+        'deadline': period.deadline,
+    }, [epp_id for epp_id, _, _ in members]
+
+
+@db_session
+def get_export_batch(epp_ids: List[uuid.UUID]) -> List[Tuple]:
+    """Lädt die aktiven Verfügbarkeiten der angegebenen EmployeePlanPeriods als Tupel (eine verknüpfte Abfrage)"""
+    query = select((a.employee_plan_period.person.id, a.employee_plan_period.person.l_name,
+                    a.employee_plan_period.person.f_name, a.employee_plan_period.person.email,
+                    a.date, a.time_of_day.name, a.time_of_day.start, a.time_of_day.delta, a.notes,
+                    a.employee_plan_period.id)
+                   for a in Availability
+                   if a.employee_plan_period.id in epp_ids and a.prep_delete is None)
+    # Gleiche Reihenfolge wie get_export_members, innerhalb eines Mitarbeiters nach Datum und Uhrzeit
+    return query.order_by(2, 3, 10, 5, 7)[:]
+
+
+def _export_row(row: Tuple) -> Dict[str, Any]:
+    person_id, l_name, f_name, email, avail_date, tod_name, start, delta, notes, _ = row
+    if isinstance(start, str):
+        # Altdaten speichern die Startzeit als Text (siehe get_time_of_day_options)
+        start = time.fromisoformat(start)
+    end = datetime.combine(avail_date, start) + delta
+    return {
+        'person_id': str(person_id),
+        'last_name': l_name or "",
+        'first_name': f_name,
+        'email': email,
+        'date': avail_date.isoformat(),
+        'time_of_day': tod_name,
+        'start': start.strftime("%H:%M"),
+        'end': end.strftime("%H:%M"),
+        'notes': notes or "",
+    }
+
+
+def _format_batch(fmt: str, rows: List[Dict[str, Any]], first: bool) -> str:
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS).writerows(rows)
+        return buffer.getvalue()
+    if fmt == 'ndjson':
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    return ("" if first else ",") + ",".join(json.dumps(row, ensure_ascii=False) for row in rows)
+
+
+async def stream_export(period: Dict[str, Any], epp_ids: List[uuid.UUID], fmt: str,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """
+    Erzeugt den Export einer Planungsperiode stückweise im Format fmt (csv, json oder ndjson).
+
+    Jeder Batch von batch_size Mitarbeitern wird in einer eigenen db_session geladen, formatiert und
+    sofort ausgegeben, sodass der Speicherbedarf nicht mit der Größe des Teams wächst.
+    """
+    if fmt == 'csv':
+        yield (",".join(EXPORT_COLUMNS) + "\r\n").encode()
+    elif fmt == 'json':
+        yield ('{"plan_period": ' + json.dumps(period, ensure_ascii=False, default=str)
+               + ', "availabilities": [').encode()
+    first = True
+    for offset in range(0, len(epp_ids), batch_size):
+        rows = [_export_row(row) for row in await run_db(get_export_batch, epp_ids[offset:offset + batch_size])]
+        if not rows:
+            continue
+        yield _format_batch(fmt, rows, first).encode()
+        first = False
+    if fmt == 'json':
+        yield b"]}"
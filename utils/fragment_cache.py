@@ -0,0 +1,64 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+# Maximale Anzahl zwischengespeicherter HTML-Fragmente (LRU)
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "256"))
+
+
+class FragmentCache:
+    """LRU-Cache für gerenderte HTML-Fragmente, die nur zu einer bestimmten Datenversion gültig sind"""
+
+    def __init__(self, max_entries: int = FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: str) -> Optional[bytes]:
+        """Gibt das Fragment zurück, wenn es zur angegebenen Version gerendert wurde"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, version: str, body: bytes):
+        """Speichert ein Fragment und verdrängt bei Bedarf den am längsten ungenutzten Eintrag"""
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """Verwirft alle Einträge oder nur die, deren Schlüssel predicate erfüllt"""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if predicate(key)]:
+                    del self._entries[key]
+
+
+def make_etag(key: Hashable, version: str) -> str:
+    """Erzeugt einen starken ETag aus Cache-Schlüssel und Datenversion"""
+    digest = hashlib.sha256(repr((key, version)).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Prüft, ob der If-None-Match-Header den ETag enthält"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # If-None-Match verwendet den schwachen Vergleich (RFC 9110, 13.1.2)
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+# Gemeinsamer Cache für die Kalender-Endpunkte
+calendar_fragments = FragmentCache()
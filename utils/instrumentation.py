@@ -0,0 +1,411 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+# Anteil der Requests, die als strukturierter Logeintrag ausgegeben werden (0.0 - 1.0)
+SAMPLE_RATE = float(os.environ.get("INSTRUMENTATION_SAMPLE_RATE", "0.01"))
+# Langsamere Requests (ms) und Serverfehler werden unabhängig vom Sampling geloggt
+SLOW_REQUEST_MS = float(os.environ.get("INSTRUMENTATION_SLOW_MS", "500"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+# Umgebung der Anwendung: production, dev oder test
+APP_ENV = os.environ.get("APP_ENV", "production")
+# Server-Timing-Header mit Anzahl und Dauer der SQL-Anweisungen (Standard: in dev und test aktiv)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1" if APP_ENV in ("dev", "test") else "0") == "1"
+# Verhalten bei überschrittenem Abfragebudget einer Route: off, warn oder raise (Standard: raise in test)
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", {"test": "raise", "dev": "warn"}.get(APP_ENV, "off"))
+# Ab so vielen Ausführungen derselben SQL-Anweisung in einem Request wird ein N+1-Muster gemeldet
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", "5"))
+
+LOGGER_NAME = "availability"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatiert Logeinträge als eine JSON-Zeile; Felder aus extra={'fields': {...}} werden übernommen"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    """
+    Richtet das strukturierte Logging einmalig ein.
+
+    Logeinträge werden im Request nur in eine Queue gestellt und von einem Hintergrund-Thread
+    nach stderr geschrieben, damit die Ausgabe die Antwortzeit nicht beeinflusst.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger(LOGGER_NAME)
+        root.setLevel(level)
+        root.propagate = False
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Gibt einen Logger unterhalb von 'availability' zurück, z.B. get_logger('db_helpers')"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+logger = get_logger("instrumentation")
+
+
+class RequestStats:
+    """Messwerte eines Requests; wird über Kontextvariablen auch in die Datenbank-Threads mitgenommen"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.helpers: List[Tuple[str, float, int]] = []
+        # Ausführungen pro SQL-Text, um wiederholte Einzelabfragen (N+1) zu erkennen
+        self.statements: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_query(self, duration: float, sql: str = ''):
+        with self._lock:
+            self.queries += 1
+            self.db_time += duration
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """Gibt die SELECT-Anweisungen zurück, die mindestens threshold-mal ausgeführt wurden (häufigste zuerst)"""
+        # INSERT/UPDATE wiederholen sich beim Flush einer db_session zwangsläufig und sind kein N+1-Muster
+        with self._lock:
+            repeated = [(sql, n) for sql, n in self.statements.items()
+                        if n >= threshold and sql.lstrip().upper().startswith('SELECT')]
+        return sorted(repeated, key=lambda item: -item[1])
+
+    def add_helper(self, name: str, duration: float, queries: int):
+        with self._lock:
+            self.helpers.append((name, duration, queries))
+
+
+class _HelperStats:
+    __slots__ = ('queries',)
+
+    def __init__(self):
+        self.queries = 0
+
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None)
+_current_helper: contextvars.ContextVar[Optional[_HelperStats]] = contextvars.ContextVar(
+    "current_helper", default=None)
+
+
+def current_request() -> Optional[RequestStats]:
+    """Gibt die Messwerte des laufenden Requests zurück (None außerhalb eines Requests)"""
+    return _current_request.get()
+
+
+class Metrics:
+    """Prozessweite Summen pro Endpunkt und Hilfsfunktion für den /metrics-Endpunkt"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._statuses: Dict[Tuple[str, str, int], int] = {}
+        self._helpers: Dict[str, Dict[str, float]] = {}
+
+    def observe_request(self, route: str, method: str, status: int, duration: float, queries: int, db_time: float):
+        with self._lock:
+            entry = self._requests.setdefault((route, method), {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                                                'queries': 0, 'db_time': 0.0})
+            entry['count'] += 1
+            entry['sum'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['queries'] += queries
+            entry['db_time'] += db_time
+            key = (route, method, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def observe_helper(self, name: str, duration: float, queries: int):
+        with self._lock:
+            entry = self._helpers.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0, 'queries': 0})
+            entry['count'] += 1
+            entry['sum'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['queries'] += queries
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Gibt eine Kopie aller Summen zurück"""
+        with self._lock:
+            return {
+                'requests': {key: dict(value) for key, value in self._requests.items()},
+                'statuses': dict(self._statuses),
+                'helpers': {key: dict(value) for key, value in self._helpers.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._statuses.clear()
+            self._helpers.clear()
+
+
+metrics = Metrics()
+
+
+def _label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(pool_stats: Iterable[Dict[str, Any]] = ()) -> str:
+    """Gibt die Metriken im Textformat von Prometheus aus, optional mit den Kennzahlen der DB-Pools"""
+    snapshot = metrics.snapshot()
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples: Iterable[Tuple[str, float]]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value:g}")
+
+    requests = sorted(snapshot['requests'].items())
+    request_labels = [(f'route="{_label(route)}",method="{method}"', entry) for (route, method), entry in requests]
+    metric("app_requests_total", "counter", "Anzahl der Requests pro Route und Status",
+           [(f'route="{_label(route)}",method="{method}",status="{status}"', count)
+            for (route, method, status), count in sorted(snapshot['statuses'].items())])
+    metric("app_request_duration_seconds_sum", "counter", "Summe der Antwortzeiten",
+           [(labels, entry['sum']) for labels, entry in request_labels])
+    metric("app_request_duration_seconds_max", "gauge", "Längste Antwortzeit seit dem Start",
+           [(labels, entry['max']) for labels, entry in request_labels])
+    metric("app_request_db_queries_total", "counter", "SQL-Anweisungen der Requests",
+           [(labels, entry['queries']) for labels, entry in request_labels])
+    metric("app_request_db_seconds_total", "counter", "Zeit in SQL-Anweisungen der Requests",
+           [(labels, entry['db_time']) for labels, entry in request_labels])
+
+    helpers = sorted(snapshot['helpers'].items())
+    helper_labels = [(f'helper="{_label(name)}"', entry) for name, entry in helpers]
+    metric("app_helper_calls_total", "counter", "Aufrufe der Datenbank-Hilfsfunktionen",
+           [(labels, entry['count']) for labels, entry in helper_labels])
+    metric("app_helper_duration_seconds_sum", "counter", "Summe der Laufzeiten der Hilfsfunktionen",
+           [(labels, entry['sum']) for labels, entry in helper_labels])
+    metric("app_helper_duration_seconds_max", "gauge", "Längste Laufzeit einer Hilfsfunktion",
+           [(labels, entry['max']) for labels, entry in helper_labels])
+    metric("app_helper_db_queries_total", "counter", "SQL-Anweisungen der Hilfsfunktionen",
+           [(labels, entry['queries']) for labels, entry in helper_labels])
+
+    pool_stats = list(pool_stats)
+    for key, kind, help_text in (('active', 'gauge', 'Laufende Datenbankaufträge'),
+                                 ('queued', 'gauge', 'Wartende Datenbankaufträge'),
+                                 ('completed', 'counter', 'Abgeschlossene Datenbankaufträge')):
+        metric(f"app_db_pool_{key}", kind, help_text,
+               [(f'pool="{_label(stats["name"])}"', stats[key]) for stats in pool_stats])
+    return "\n".join(lines) + "\n"
+
+
+def install_sql_hook(db):
+    """
+    Zählt alle SQL-Anweisungen der Datenbank und ordnet sie dem laufenden Request und der laufenden
+    Hilfsfunktion zu. Mehrfaches Installieren hat keine Wirkung.
+    """
+    if getattr(db, '_instrumentation_installed', False):
+        return
+    original_exec_sql = db._exec_sql
+
+    def instrumented_exec_sql(sql, arguments=None, *args, **kwargs):
+        request = _current_request.get()
+        helper = _current_helper.get()
+        if request is None and helper is None:
+            return original_exec_sql(sql, arguments, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return original_exec_sql(sql, arguments, *args, **kwargs)
+        finally:
+            if request is not None:
+                request.add_query(time.perf_counter() - started, sql)
+            if helper is not None:
+                helper.queries += 1
+
+    db._exec_sql = instrumented_exec_sql
+    db._instrumentation_installed = True
+
+
+def measure_helper(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Führt eine Hilfsfunktion aus und erfasst Laufzeit und Anzahl ihrer SQL-Anweisungen"""
+    helper = _HelperStats()
+    token = _current_helper.set(helper)
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        duration = time.perf_counter() - started
+        _current_helper.reset(token)
+        name = getattr(func, '__name__', repr(func))
+        metrics.observe_helper(name, duration, helper.queries)
+        request = _current_request.get()
+        if request is not None:
+            request.add_helper(name, duration, helper.queries)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Eine Route hat mehr SQL-Anweisungen ausgeführt, als ihr Abfragebudget erlaubt"""
+
+
+def query_budget(max_queries: int):
+    """
+    Legt die maximale Anzahl SQL-Anweisungen pro Request für einen Endpunkt fest.
+
+    Beispiel:
+        @app.get("/api/calendar-data")
+        @query_budget(6)
+        async def get_calendar_data(...): ...
+    """
+    def decorator(endpoint):
+        endpoint.__query_budget__ = max_queries
+        return endpoint
+    return decorator
+
+
+def batched_queries(endpoint):
+    """
+    Kennzeichnet einen Endpunkt, der dieselbe Abfrage absichtlich in Batches wiederholt (z.B. ein
+    gestreamter Export); für ihn entfällt die Warnung vor wiederholten Abfragen (N+1).
+    """
+    endpoint.__batched_queries__ = True
+    return endpoint
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _route_budget(scope) -> Optional[int]:
+    endpoint = getattr(scope.get("route"), "endpoint", None)
+    return getattr(endpoint, "__query_budget__", None)
+
+
+def _route_batched(scope) -> bool:
+    endpoint = getattr(scope.get("route"), "endpoint", None)
+    return getattr(endpoint, "__batched_queries__", False)
+
+
+def server_timing(stats: RequestStats) -> str:
+    """Formatiert die Messwerte eines Requests als Server-Timing-Header"""
+    app_ms = (time.perf_counter() - stats.started) * 1000
+    return (f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+            f'app;dur={app_ms:.2f}')
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI-Middleware, die für jeden HTTP-Request Laufzeit, Status und SQL-Anweisungen erfasst.
+
+    Die Summen landen in metrics; ein Teil der Requests (SAMPLE_RATE) sowie langsame Requests und
+    Serverfehler werden zusätzlich als strukturierter Logeintrag ausgegeben.
+
+    Mit server_timing erhält jede Antwort die Header Server-Timing und X-DB-Queries. Überschreitet
+    eine Route ihr Abfragebudget (query_budget), wird das bei budget_mode 'warn' geloggt und bei
+    'raise' als QueryBudgetExceeded ausgelöst, bevor die Antwort gesendet wird, damit Tests fehlschlagen.
+    Wiederholte SQL-Anweisungen (N+1) werden ab N_PLUS_ONE_THRESHOLD Ausführungen als Warnung geloggt,
+    außer bei Endpunkten mit batched_queries.
+    """
+
+    def __init__(self, app, sample_rate: Optional[float] = None, slow_request_ms: Optional[float] = None,
+                 server_timing: Optional[bool] = None, budget_mode: Optional[str] = None):
+        self.app = app
+        self.sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+        self.slow_request_ms = SLOW_REQUEST_MS if slow_request_ms is None else slow_request_ms
+        self.server_timing = SERVER_TIMING if server_timing is None else server_timing
+        self.budget_mode = QUERY_BUDGET_MODE if budget_mode is None else budget_mode
+        if self.budget_mode not in ("off", "warn", "raise"):
+            raise ValueError(f"Unbekannter QUERY_BUDGET_MODE '{self.budget_mode}', erlaubt: off, warn, raise")
+
+    def _check_budget(self, scope, stats: RequestStats):
+        budget = _route_budget(scope)
+        if budget is None or stats.queries <= budget or self.budget_mode == "off":
+            return
+        route = _route_label(scope)
+        fields = {'route': route, 'method': stats.method, 'db_queries': stats.queries, 'budget': budget,
+                  'repeated': [{'sql': sql, 'count': n} for sql, n in stats.repeated_statements(2)[:3]]}
+        if self.budget_mode == "raise":
+            raise QueryBudgetExceeded(f"{stats.method} {route}: {stats.queries} SQL-Anweisungen, "
+                                      f"Budget {budget}")
+        logger.warning("query budget exceeded", extra={'fields': fields})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope["method"], scope["path"])
+        token = _current_request.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                self._check_budget(scope, stats)
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing(stats))
+                    headers.append("X-DB-Queries", str(stats.queries))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            duration = time.perf_counter() - stats.started
+            stats.route = _route_label(scope)
+            metrics.observe_request(stats.route, stats.method, status, duration, stats.queries, stats.db_time)
+            repeated = [] if _route_batched(scope) else stats.repeated_statements()
+            if repeated and self.budget_mode != "off":
+                logger.warning("repeated queries", extra={'fields': {
+                    'route': stats.route,
+                    'method': stats.method,
+                    'db_queries': stats.queries,
+                    'repeated': [{'sql': sql, 'count': n} for sql, n in repeated[:3]],
+                }})
+            if (status >= 500 or duration * 1000 >= self.slow_request_ms
+                    or (self.sample_rate > 0 and random.random() < self.sample_rate)):
+                logger.info("request", extra={'fields': {
+                    'method': stats.method,
+                    'path': stats.path,
+                    'route': stats.route,
+                    'status': status,
+                    'duration_ms': round(duration * 1000, 2),
+                    'db_queries': stats.queries,
+                    'db_ms': round(stats.db_time * 1000, 2),
+                    'helpers': [{'name': name, 'ms': round(helper_duration * 1000, 2), 'queries': queries}
+                                for name, helper_duration, queries in stats.helpers],
+                }})
@@ -0,0 +1,221 @@
+import argparse
+import os
+import sqlite3
+import sys
+import uuid
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from config import database as database_config
+from config.database import DB_PATH
+
+# Zusammengesetzte Indizes für die häufigsten Abfragen.
+# Die Namen entsprechen denen, die Pony für composite_index() in models/entities.py vergibt.
+COMPOSITE_INDEXES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("idx_availability__employee_plan_period_date_time_of_day_prep_delete", "Availability",
+     ("employee_plan_period", "date", "time_of_day", "prep_delete")),
+    ("idx_employeeplanperiod__person_plan_period_prep_delete", "EmployeePlanPeriod",
+     ("person", "plan_period", "prep_delete")),
+    ("idx_planperiod__start_end_prep_delete", "PlanPeriod",
+     ("start", "end", "prep_delete")),
+]
+
+# Partielle Indizes (von Pony nicht abbildbar): Name, Tabelle, Spalten, Bedingung
+PARTIAL_INDEXES: List[Tuple[str, str, Tuple[str, ...], str]] = [
+    # Deaktivierte Verfügbarkeiten für die Archivierung (utils.compaction) nach Löschzeitpunkt finden
+    ("idx_availability__prep_delete_inactive", "Availability", ("prep_delete",), '"prep_delete" IS NOT NULL'),
+]
+
+
+def create_schema():
+    """Legt fehlende Tabellen der Entities in der Datenbank unter DB_PATH an"""
+    from models.entities import db
+    db.create_tables()
+
+
+def add_composite_indexes(db_path: str = DB_PATH) -> List[str]:
+    """Legt fehlende zusammengesetzte und partielle Indizes in einer bestehenden Datenbank an"""
+    created = []
+    connection = sqlite3.connect(db_path)
+    try:
+        existing = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        indexes = [(name, table, columns, None) for name, table, columns in COMPOSITE_INDEXES] + PARTIAL_INDEXES
+        with connection:
+            for name, table, columns, condition in indexes:
+                if name in existing:
+                    continue
+                column_list = ", ".join(f'"{column}"' for column in columns)
+                where = f" WHERE {condition}" if condition else ""
+                connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list}){where}')
+                created.append(name)
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    return created
+
+
+def _schema_only_connection(db_path: str) -> sqlite3.Connection:
+    """
+    Erstellt eine In-Memory-Datenbank mit dem Schema (ohne Daten und Statistiken) der angegebenen Datenbank.
+
+    Bei kleinen Testdatenbanken bevorzugt SQLite sonst Tabellenscans, weil sie billiger sind als
+    ein Indexzugriff - für die Prüfung zählt aber nur, ob ein passender Index vorhanden ist.
+    """
+    source = sqlite3.connect(db_path)
+    try:
+        schema = [row[0] for row in source.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'index'"
+        )]
+    finally:
+        source.close()
+    connection = sqlite3.connect(":memory:")
+    for statement in schema:
+        connection.execute(statement)
+    return connection
+
+
+def check_query_plans(db_path: str = DB_PATH) -> Dict[str, List[str]]:
+    """
+    Führt alle Hilfsfunktionen mit Datenbankzugriff (utils.db_helpers, Export, Abdeckung, Bitmaps,
+    Sitzungen, Scheduler, Archivierung) mit Beispieldaten aus und prüft per EXPLAIN QUERY PLAN, dass
+    keine ihrer Abfragen eine Tabelle oder einen Index vollständig durchsucht.
+
+    Schreibende Funktionen laufen jeweils in einer Transaktion, die anschließend zurückgerollt wird.
+
+    Returns:
+        Dict[str, List[str]]: Pro Hilfsfunktion die Zeilen des Abfrageplans, die einen
+        vollständigen Tabellenscan anzeigen. Ein leeres Dict bedeutet, dass alle Abfragen
+        einen Index verwenden.
+    """
+    from pony.orm import db_session, flush, rollback
+    from models.entities import db, Availability
+    from models import schemas
+    from utils import db_helpers, export, coverage, bitmaps, sessions, scheduler, compaction
+
+    with db_session:
+        availability = Availability.select(lambda a: a.prep_delete is None).first()
+        if availability is None:
+            raise RuntimeError("Für die Prüfung wird mindestens eine aktive Verfügbarkeit benötigt")
+        epp = availability.employee_plan_period
+        person = epp.person
+        user_id = str(person.id)
+        tod_id = str(availability.time_of_day.id)
+        period_id = str(epp.plan_period.id)
+        date_str = availability.date.strftime("%Y-%m-%d")
+        period_text = f"{epp.plan_period.start.strftime('%d.%m.%y')} - {epp.plan_period.end.strftime('%d.%m.%y')}"
+        team_id = str(epp.plan_period.team.id)
+        dispatcher_id = str(epp.plan_period.team.dispatcher.id)
+        epp_ids = [epp.id]
+        username, password = person.username, person.password
+
+    now = datetime.now()
+    batch = [
+        schemas.AvailabilityBatchOperation(op="set", dates=[availability.date], tod_ids=[uuid.UUID(tod_id)]),
+        schemas.AvailabilityBatchOperation(op="clear_period", period=period_text),
+    ]
+    helpers = [
+        ("get_plan_periods", db_helpers.get_plan_periods, ()),
+        ("get_plan_periods (Team)", db_helpers.get_plan_periods, (None, None, team_id)),
+        ("get_time_of_day", db_helpers.get_time_of_day, (tod_id,)),
+        ("get_time_of_day_options", db_helpers.get_time_of_day_options, (user_id,)),
+        ("get_selected_times", db_helpers.get_selected_times, (user_id,)),
+        ("get_selected_times (Periode)", db_helpers.get_selected_times, (user_id, period_id)),
+        ("get_selected_times (Tag)", db_helpers.get_selected_times, (user_id, None, availability.date, availability.date)),
+        ("get_user_notes", db_helpers.get_user_notes, (user_id,)),
+        ("save_note", db_helpers.save_note, (user_id, period_text, "", team_id)),
+        ("get_availability_user_date", db_helpers.get_availability_user_date, (user_id, date_str)),
+        ("toggle_availability", db_helpers.toggle_availability, (user_id, date_str, tod_id, team_id)),
+        ("toggle_availability_for_day", db_helpers.toggle_availability_for_day, (user_id, date_str, tod_id, team_id)),
+        ("apply_availability_batch", db_helpers.apply_availability_batch, (user_id, batch, team_id)),
+        ("get_calendar_version", db_helpers.get_calendar_version, (user_id, team_id)),
+        ("get_login_user", db_helpers.get_login_user, (username,)),
+        ("update_password_hash", db_helpers.update_password_hash, (user_id, password, password)),
+        ("validate_login", db_helpers.validate_login, (username, password)),
+        ("get_export_members", export.get_export_members, (period_id, dispatcher_id)),
+        ("get_export_batch", export.get_export_batch, (epp_ids,)),
+        ("load_coverage_data", coverage.load_coverage_data, (period_id, dispatcher_id)),
+        ("bitmaps._load_period_bitmaps", bitmaps._load_period_bitmaps, (period_id,)),
+        ("sessions._save_session", sessions._save_session, ("check", {'user': None}, now, True)),
+        ("sessions._load_session", sessions._load_session, ("check",)),
+        ("sessions._touch_session", sessions._touch_session, ("check", now)),
+        ("sessions._delete_session", sessions._delete_session, ("check",)),
+        ("sessions._delete_user_sessions", sessions._delete_user_sessions, (user_id,)),
+        ("sessions.purge_expired_sessions", sessions.purge_expired_sessions, ()),
+        ("scheduler.sync_jobs", scheduler.sync_jobs, ()),
+        ("scheduler.run_job", scheduler.run_job, (scheduler.job_id_for(uuid.UUID(period_id)), now)),
+    ]
+    # Diese Hilfsfunktionen lesen bewusst alle Zeilen (alle Perioden für den teamübergreifenden Index bzw.
+    # den Abgleich aller Jobs); ein Scan ist dort kein Fehler
+    full_reads = {"get_plan_periods", "scheduler.sync_jobs"}
+
+    # SQL-Anweisungen aller Hilfsfunktionen mitschneiden
+    statements: Dict[str, List[Tuple[str, object]]] = {}
+    current = []
+    original_exec_sql = db._exec_sql
+
+    def recording_exec_sql(sql, arguments=None, *args, **kwargs):
+        current.append((sql, arguments))
+        return original_exec_sql(sql, arguments, *args, **kwargs)
+
+    db._exec_sql = recording_exec_sql
+    try:
+        # Jede Funktion in einer eigenen Session, damit ihre Abfragen nicht aus dem Cache einer vorherigen
+        # bedient werden; flush() ordnet die Schreibzugriffe der richtigen Funktion zu
+        for name, func, args in helpers:
+            current = statements.setdefault(name, [])
+            with db_session:
+                func(*args)
+                flush()
+                rollback()
+    finally:
+        db._exec_sql = original_exec_sql
+    # utils.compaction arbeitet mit eigenem SQL auf einer sqlite3-Verbindung
+    statements["compaction (Batch)"] = [(compaction.BATCH_SELECT_SQL, (now.isoformat(sep=" "), 1))]
+
+    violations: Dict[str, List[str]] = {}
+    connection = _schema_only_connection(db_path)
+    try:
+        for name, sql_statements in statements.items():
+            if name in full_reads:
+                continue
+            for sql, arguments in sql_statements:
+                if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                    continue
+                plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}", arguments or ()).fetchall()
+                for row in plan:
+                    detail = row[-1]
+                    # Auch "SCAN ... USING (COVERING) INDEX" liest den ganzen Index; nur SEARCH ist eingeschränkt
+                    if detail.startswith("SCAN"):
+                        violations.setdefault(name, []).append(f"{detail}  <-  {' '.join(sql.split())}")
+    finally:
+        connection.close()
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Datenbank-Migrationen für den Verfügbarkeitskalender")
+    parser.add_argument("--db", default=DB_PATH, help="Pfad zur SQLite-Datenbank")
+    parser.add_argument("--check", action="store_true",
+                        help="Abfragepläne aller Hilfsfunktionen auf Tabellenscans prüfen")
+    args = parser.parse_args(argv)
+
+    # models bindet die Datenbank beim ersten Import an config.database.DB_PATH
+    database_config.DB_PATH = os.path.abspath(args.db)
+    create_schema()
+    created = add_composite_indexes(args.db)
+    print(f"Neue Indizes: {', '.join(created) if created else 'keine'}")
+
+    if args.check:
+        violations = check_query_plans(args.db)
+        if violations:
+            for name, details in violations.items():
+                for detail in details:
+                    print(f"{name}: {detail}")
+            return 1
+        print("Alle Abfragen der Hilfsfunktionen verwenden einen Index.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import hmac
+import os
+from typing import Tuple
+
+# scrypt-Parameter für neue Hashes; ältere Hashes mit anderen Parametern werden beim Login erneuert
+SCRYPT_N = int(os.environ.get("PASSWORD_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("PASSWORD_SCRYPT_P", "1"))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+PREFIX = "scrypt"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # maxmem großzügig wählen, damit höhere Parameter nicht am OpenSSL-Standardlimit (32 MB) scheitern
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+                          maxmem=256 * n * r * (p + 1))
+
+
+def hash_password(password: str) -> str:
+    """Erzeugt einen scrypt-Hash im Format scrypt$n$r$p$salt$hash (Salt und Hash base64-kodiert)"""
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def is_hashed(stored: str) -> bool:
+    """Prüft, ob ein gespeichertes Passwort bereits ein Hash (und kein Klartext aus Altdaten) ist"""
+    return stored.startswith(PREFIX + "$")
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    """
+    Prüft ein Passwort gegen den gespeicherten Wert.
+
+    Gespeicherter Klartext (Altdaten) wird in konstanter Zeit verglichen und gilt als
+    erneuerungsbedürftig, ebenso Hashes mit veralteten scrypt-Parametern.
+
+    Returns:
+        Tuple[bool, bool]: (Passwort korrekt, gespeicherter Wert sollte neu gehasht werden)
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), True
+    try:
+        _, n, r, p, salt, key = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        expected = base64.b64decode(salt), base64.b64decode(key)
+    except ValueError:
+        return False, False
+    key = _scrypt(password, expected[0], n, r, p)
+    ok = hmac.compare_digest(key, expected[1])
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# Hash eines zufälligen Passworts: Bei unbekanntem Benutzernamen wird dagegen geprüft, damit die
+# Antwortzeit nicht verrät, ob der Benutzer existiert
+_dummy_hash = None
+
+
+def dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(_b64encode(os.urandom(SALT_BYTES)))
+    return _dummy_hash
@@ -0,0 +1,141 @@
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from pony.orm import db_session
+
+from models import signals
+from models.entities import PlanPeriod
+from utils.calendar_grid import period_label
+
+
+class PlanPeriodIndex:
+    """
+    Intervall-Index über aktive Planungsperioden.
+
+    Die Perioden liegen nach Startdatum sortiert vor, sodass die Periode zu einem Datum per
+    Binärsuche gefunden wird. Die Suche nach Bezeichnung oder ID erfolgt über Dictionaries.
+    """
+
+    def __init__(self, plan_periods: List[Dict[str, Any]]):
+        self._periods = sorted(plan_periods, key=lambda p: (p['start'], p['end']))
+        self._starts = [p['start'] for p in self._periods]
+        # Größtes Enddatum bis zu jeder Position, damit auch überlappende Perioden gefunden werden
+        self._max_ends = []
+        max_end = None
+        for p in self._periods:
+            max_end = p['end'] if max_end is None or p['end'] > max_end else max_end
+            self._max_ends.append(max_end)
+        self._by_label = {period_label(p['start'], p['end']): p for p in self._periods}
+        self._by_id = {p['id']: p for p in self._periods}
+
+    def __len__(self):
+        return len(self._periods)
+
+    @property
+    def periods(self) -> List[Dict[str, Any]]:
+        return self._periods
+
+    def find_by_date(self, day: date) -> Optional[Dict[str, Any]]:
+        """Gibt die Periode zurück, die day enthält (bei Überlappung die zuletzt beginnende)"""
+        i = bisect_right(self._starts, day) - 1
+        while i >= 0 and self._max_ends[i] >= day:
+            if self._periods[i]['end'] >= day:
+                return self._periods[i]
+            i -= 1
+        return None
+
+    def find_by_label(self, label: str) -> Optional[Dict[str, Any]]:
+        """Gibt die Periode mit der Bezeichnung 'dd.mm.yy - dd.mm.yy' zurück"""
+        return self._by_label.get(label)
+
+    def find_by_id(self, period_id: str) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(period_id)
+
+    def window(self, anchor: date, before: int, ahead: int) -> List[Dict[str, Any]]:
+        """
+        Gibt die aktuelle (bzw. nächste) Periode zu anchor mit before Perioden davor und ahead danach zurück.
+        Liegen alle Perioden vor anchor, endet das Fenster mit der letzten Periode.
+        """
+        # Erste Periode, die nicht vor anchor endet (_max_ends ist aufsteigend sortiert)
+        i = min(bisect_left(self._max_ends, anchor), len(self._periods) - 1)
+        return self._periods[max(0, i - before):i + ahead + 1]
+
+    def periods_after(self, day: date, count: int) -> List[Dict[str, Any]]:
+        """Gibt die ersten count Perioden zurück, die nach day beginnen"""
+        i = bisect_right(self._starts, day)
+        return self._periods[i:i + count]
+
+    def periods_before(self, day: date, count: int) -> List[Dict[str, Any]]:
+        """Gibt die letzten count Perioden zurück, die vor day beginnen"""
+        i = bisect_left(self._starts, day)
+        return self._periods[max(0, i - count):i]
+
+
+# Ein Index pro Team (None = alle Teams) und Generation pro Team für die Invalidierung
+_indexes: Dict[Optional[str], PlanPeriodIndex] = {}
+_generations: Dict[Optional[str], int] = {}
+# Wird bei jeder vollständigen Invalidierung erhöht, auch für Teams ohne eigenen Eintrag
+_epoch = 0
+_lock = threading.Lock()
+
+
+@db_session
+def _load_plan_periods(team_id: Optional[str]) -> List[Dict[str, Any]]:
+    periods = PlanPeriod.select(lambda p: p.prep_delete is None)
+    if team_id:
+        team_uuid = uuid.UUID(team_id)
+        periods = periods.filter(lambda p: p.team.id == team_uuid)
+    return [
+        {
+            'id': str(p.id),
+            'start': p.start,
+            'end': p.end,
+            'deadline': p.deadline,
+            'team_id': str(p.team.id),
+            'message': p.notes or f'Planungsperiode {period_label(p.start, p.end)}'
+        }
+        for p in periods
+    ]
+
+
+def get_period_index(team_id: Optional[str] = None) -> PlanPeriodIndex:
+    """Gibt den (bei Bedarf neu aufgebauten) Index der aktiven Planungsperioden eines Teams zurück"""
+    with _lock:
+        index = _indexes.get(team_id)
+        generation = (_epoch, _generations.get(team_id, 0))
+    if index is not None:
+        return index
+
+    index = PlanPeriodIndex(_load_plan_periods(team_id))
+    with _lock:
+        if (_epoch, _generations.get(team_id, 0)) == generation:
+            _indexes[team_id] = index
+    return index
+
+
+def invalidate(team_id: Optional[str] = None):
+    """
+    Verwirft den Index eines Teams (und den teamübergreifenden) oder, ohne Angabe, alle Indizes;
+    sie werden beim nächsten Zugriff neu aufgebaut
+    """
+    global _epoch
+    with _lock:
+        if team_id is None:
+            _epoch += 1
+            _indexes.clear()
+            return
+        for key in (team_id, None):
+            _generations[key] = _generations.get(key, 0) + 1
+            _indexes.pop(key, None)
+
+
+def _on_plan_period_changed(plan_period, event):
+    # Bei Änderungen kann auch das Team gewechselt haben, dann sind zwei Teams betroffen
+    team_id = None if event == 'update' else str(plan_period.team.id)
+    signals.on_commit(lambda: invalidate(team_id))
+
+
+signals.connect('PlanPeriod', _on_plan_period_changed)
@@ -0,0 +1,172 @@
+import argparse
+import sys
+import uuid
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from pony.orm import db_session, select
+
+from models import signals
+from models.entities import db, Person, PlanPeriod, EmployeePlanPeriod, Team
+
+
+def missing_employee_plan_periods(team_id: str, person_ids: Optional[Iterable[uuid.UUID]] = None,
+                                  plan_period_ids: Optional[Iterable[uuid.UUID]] = None) -> List[Tuple[uuid.UUID, uuid.UUID]]:
+    """
+    Ermittelt die (Person, PlanPeriod)-Paare eines Teams, für die noch kein aktives EmployeePlanPeriod existiert.
+
+    Args:
+        team_id (str): Die UUID des Teams als String
+        person_ids: Optional nur diese Personen des Teams berücksichtigen
+        plan_period_ids: Optional nur diese Planungsperioden des Teams berücksichtigen
+
+    Returns:
+        List[Tuple[uuid.UUID, uuid.UUID]]: Fehlende Paare aus Personen-ID und Perioden-ID
+    """
+    team_uuid = uuid.UUID(team_id)
+    persons = set(select(p.id for p in Person if p.team.id == team_uuid and p.prep_delete is None))
+    periods = set(select(pp.id for pp in PlanPeriod if pp.team.id == team_uuid and pp.prep_delete is None))
+    if person_ids is not None:
+        persons &= set(person_ids)
+    if plan_period_ids is not None:
+        periods &= set(plan_period_ids)
+    if not persons or not periods:
+        return []
+
+    # Vorhandene Paare mit einer Abfrage laden, bei Einschränkung nur die der betroffenen Personen bzw. Perioden
+    existing = select((e.person.id, e.plan_period.id) for e in EmployeePlanPeriod
+                      if e.plan_period.team.id == team_uuid and e.prep_delete is None)
+    if person_ids is not None:
+        person_list = list(persons)
+        existing = existing.filter(lambda person_id, plan_period_id: person_id in person_list)
+    if plan_period_ids is not None:
+        period_list = list(periods)
+        existing = existing.filter(lambda person_id, plan_period_id: plan_period_id in period_list)
+    existing = set(existing)
+
+    return [(person_id, plan_period_id)
+            for person_id in sorted(persons) for plan_period_id in sorted(periods)
+            if (person_id, plan_period_id) not in existing]
+
+
+def _create_employee_plan_periods(pairs: List[Tuple[uuid.UUID, uuid.UUID]]):
+    """Legt EmployeePlanPeriods als Entities an, sodass Collections der laufenden db_session aktuell bleiben"""
+    now = datetime.now()
+    # Personen und Perioden mit je einer Abfrage in den Cache laden statt einzeln per Primärschlüssel
+    person_ids = list({person_id for person_id, _ in pairs})
+    plan_period_ids = list({plan_period_id for _, plan_period_id in pairs})
+    persons = {p.id: p for p in Person.select(lambda p: p.id in person_ids)}
+    plan_periods = {pp.id: pp for pp in PlanPeriod.select(lambda pp: pp.id in plan_period_ids)}
+    for person_id, plan_period_id in pairs:
+        EmployeePlanPeriod(
+            created_at=now,
+            latest_change=now,
+            plan_period=plan_periods[plan_period_id],
+            person=persons[person_id]
+        )
+
+
+def _insert_employee_plan_periods(pairs: List[Tuple[uuid.UUID, uuid.UUID]]):
+    """
+    Fügt EmployeePlanPeriods per executemany in die laufende Transaktion ein (ohne Entity-Objekte).
+    Nur in einer eigenen db_session verwenden, deren Cache die betroffenen Collections nicht enthält.
+    """
+    now = datetime.now().isoformat(' ', timespec='microseconds')
+    cursor = db.get_connection().cursor()
+    cursor.executemany(
+        'INSERT INTO "EmployeePlanPeriod" ("id", "notes", "created_at", "latest_change", "plan_period", "person") '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [(uuid.uuid4().bytes, '', now, now, plan_period_id.bytes, person_id.bytes)
+         for person_id, plan_period_id in pairs]
+    )
+
+
+def _provision_team(team_id: str, person_ids: Optional[Iterable[uuid.UUID]] = None,
+                    plan_period_ids: Optional[Iterable[uuid.UUID]] = None, bulk_sql: bool = False) -> int:
+    pairs = missing_employee_plan_periods(team_id, person_ids, plan_period_ids)
+    if pairs:
+        if bulk_sql:
+            _insert_employee_plan_periods(pairs)
+        else:
+            _create_employee_plan_periods(pairs)
+    return len(pairs)
+
+
+@db_session
+def provision_team(team_id: str, person_ids: Optional[Iterable[uuid.UUID]] = None,
+                   plan_period_ids: Optional[Iterable[uuid.UUID]] = None, bulk_sql: bool = False) -> int:
+    """
+    Legt alle fehlenden EmployeePlanPeriods eines Teams in einer Transaktion an.
+
+    Die Funktion ist idempotent: Es wird nur die Differenz zwischen (Personen x Perioden) des Teams und
+    den vorhandenen EmployeePlanPeriods geschrieben. Mit person_ids bzw. plan_period_ids wird die
+    Differenz auf neue Teammitglieder bzw. neue Perioden beschränkt. Mit bulk_sql werden die Zeilen per
+    executemany eingefügt; das ist nur für Aufrufe in einer eigenen db_session gedacht (Backfill).
+
+    Returns:
+        int: Anzahl der angelegten EmployeePlanPeriods
+    """
+    return _provision_team(team_id, person_ids, plan_period_ids, bulk_sql)
+
+
+@db_session
+def _load_team_ids() -> List[str]:
+    return [str(team_id) for team_id in select(t.id for t in Team if t.prep_delete is None)]
+
+
+def provision_all_teams() -> int:
+    """Legt die fehlenden EmployeePlanPeriods aller Teams an, jedes Team in einer eigenen Transaktion"""
+    created = 0
+    for team_id in _load_team_ids():
+        created += provision_team(team_id, bulk_sql=True)
+    return created
+
+
+# Die Empfänger laufen in den after-Hooks, ggf. während des Commits der umgebenden db_session.
+# Deshalb rufen sie _provision_team ohne eigenen db_session-Dekorator auf; die neuen Entities
+# werden im selben Flush gespeichert.
+def _on_plan_period_changed(plan_period, event):
+    # Neue Periode: EmployeePlanPeriods für alle Mitglieder des Teams anlegen
+    if event == 'insert' and plan_period.prep_delete is None:
+        _provision_team(str(plan_period.team.id), plan_period_ids=[plan_period.id])
+
+
+def _on_person_changed(person, event):
+    # Neues Teammitglied: EmployeePlanPeriods für alle aktiven Perioden des Teams anlegen
+    if event in ('insert', 'team_change') and person.team is not None and person.prep_delete is None:
+        _provision_team(str(person.team.id), person_ids=[person.id])
+
+
+signals.connect('PlanPeriod', _on_plan_period_changed)
+signals.connect('Person', _on_person_changed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Legt fehlende EmployeePlanPeriods für Teams an")
+    parser.add_argument("--team", help="UUID eines Teams (Standard: alle Teams)")
+    parser.add_argument("--dry-run", action="store_true", help="Fehlende Einträge nur zählen")
+    args = parser.parse_args(argv)
+
+    team_ids = [args.team] if args.team else _load_team_ids()
+    total = 0
+    failed = 0
+    for team_id in team_ids:
+        # Jedes Team in einer eigenen Transaktion; ein Fehler bricht nur dieses Team ab
+        try:
+            if args.dry_run:
+                with db_session:
+                    count = len(missing_employee_plan_periods(team_id))
+            else:
+                count = provision_team(team_id, bulk_sql=True)
+        except Exception as e:
+            failed += 1
+            print(f"Team {team_id}: Fehler: {e}")
+            continue
+        total += count
+        print(f"Team {team_id}: {count} EmployeePlanPeriods {'fehlen' if args.dry_run else 'angelegt'}")
+    print(f"Gesamt: {total}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,33 @@
-from pony.orm import db_session, select
-from datetime import datetime
+from pony.orm import db_session
 import uuid
 
-from models.entities import (
-    Person, Team, Project, PlanPeriod, TimeOfDay,
-    Availability, EmployeePlanPeriod
-)
+from models.entities import Person, EmployeePlanPeriod
+from utils.instrumentation import get_logger
+from utils.provisioning import provision_team
+
+logger = get_logger("repair")
 
 @db_session
 def ensure_employee_plan_periods(user_id):
-    """Stellt sicher, dass für den Benutzer Employee Plan Periods existieren"""
+    """Stellt sicher, dass für den Benutzer Employee Plan Periods zu allen Perioden seines Teams existieren"""
     
     try:
         # Benutzer suchen
         user_uuid = uuid.UUID(user_id)
         user = Person.get(id=user_uuid)
         if not user:
-            print(f"Benutzer mit ID {user_id} nicht gefunden!")
+            logger.warning("user not found", extra={'fields': {'user_id': user_id}})
             return False
-            
-        print(f"Benutzer gefunden: id={user.id}, username={user.username}")
-        
-        # Vorhandene EmployeePlanPeriods zählen
-        existing_epps = list(EmployeePlanPeriod.select(lambda epp: epp.person.id == user_uuid and epp.prep_delete is None))
-        print(f"Vorhandene EmployeePlanPeriods: {len(existing_epps)}")
-        
-        if len(existing_epps) > 0:
-            print("Es existieren bereits EmployeePlanPeriods für diesen Benutzer.")
-            return True
-            
-        # Alle Planperioden laden
-        plan_periods = list(PlanPeriod.select(lambda pp: pp.prep_delete is None))
-        print(f"Verfügbare PlanPeriods: {len(plan_periods)}")
-        
-        if len(plan_periods) == 0:
-            print("Keine Planperioden in der Datenbank gefunden!")
+        if user.team is None:
+            logger.warning("user without team", extra={'fields': {'user_id': user_id}})
             return False
-            
-        # Für jede Planperiode ein EmployeePlanPeriod erstellen
-        now = datetime.now()
-        created_count = 0
-        
-        for pp in plan_periods:
-            try:
-                new_epp = EmployeePlanPeriod(
-                    id=uuid.uuid4(),
-                    created_at=now,
-                    latest_change=now,
-                    plan_period=pp,
-                    person=user
-                )
-                print(f"Neue EmployeePlanPeriod erstellt: id={new_epp.id}, plan_period={pp.id}")
-                created_count += 1
-            except Exception as e:
-                print(f"Fehler beim Erstellen einer EmployeePlanPeriod: {str(e)}")
-        
-        print(f"Insgesamt {created_count} neue EmployeePlanPeriods erstellt.")
-        return created_count > 0
-    except Exception as e:
-        print(f"Fehler in ensure_employee_plan_periods: {str(e)}")
+
+        # Fehlende Einträge für alle Perioden des Teams in einem Schritt anlegen
+        created_count = provision_team(str(user.team.id), person_ids=[user_uuid])
+        if created_count:
+            logger.info("employee plan periods created", extra={'fields': {'user_id': user_id,
+                                                                           'created': created_count}})
+        return EmployeePlanPeriod.exists(lambda epp: epp.person.id == user_uuid and epp.prep_delete is None)
+    except Exception:
+        logger.exception("ensure_employee_plan_periods failed", extra={'fields': {'user_id': user_id}})
         return False
-    finally:
-        print("--- END ensure_employee_plan_periods ---\n")
@@ -0,0 +1,431 @@
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import sys
+import uuid
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pony.orm import db_session, flush, select
+
+from models import signals
+from models.entities import db, APSchedulerJob, PlanPeriod, EmployeePlanPeriod, Availability, Person
+from utils.instrumentation import get_logger
+
+# Geplante Jobs im Prozess der Anwendung ausführen; mehrere Worker-Prozesse beanspruchen jeden Lauf
+# atomar (siehe run_job), sodass er nur einmal ausgeführt wird
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") == "1"
+# Erinnerung so viele Tage vor der Deadline, um REMINDER_HOUR Uhr
+REMINDER_DAYS_BEFORE = int(os.environ.get("REMINDER_DAYS_BEFORE", "3"))
+REMINDER_HOUR = int(os.environ.get("REMINDER_HOUR", "9"))
+# Threads, in denen die Jobs laufen (eigener Pool, belegt die Datenbank-Pools der Requests nicht)
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "2"))
+# Abgleich mit der Tabelle, um Perioden aus anderen Prozessen (seed, Admin-Skripte) zu übernehmen
+SCHEDULER_SYNC_MINUTES = float(os.environ.get("SCHEDULER_SYNC_MINUTES", "60"))
+# Ein beanspruchter Lauf gilt so lange als vergeben; scheitert er (oder der Prozess), folgt dann der nächste Versuch
+SCHEDULER_RETRY_MINUTES = float(os.environ.get("SCHEDULER_RETRY_MINUTES", "15"))
+
+# Ein Job pro Planungsperiode (PlanPeriod.apscheduler_job), der nacheinander beide Stufen durchläuft
+REMINDER_JOB = "deadline_reminder"
+CLOSE_JOB = "close_period"
+JOB_NAMES = {
+    REMINDER_JOB: "Deadline-Erinnerung",
+    CLOSE_JOB: "Periodenabschluss",
+}
+
+logger = get_logger("scheduler")
+
+# func_name -> Funktion(plan_period, now), die innerhalb der db_session des Jobs läuft
+_job_functions: Dict[str, Callable[[PlanPeriod, datetime], Dict[str, Any]]] = {}
+
+
+def job_function(name: str):
+    """Registriert eine Funktion, die Jobs mit func_name == name ausführt"""
+    def decorator(func):
+        _job_functions[name] = func
+        return func
+    return decorator
+
+
+def job_id_for(period_id: uuid.UUID) -> str:
+    return f"plan_period:{period_id}"
+
+
+def job_run_time(func_name: str, deadline: date) -> datetime:
+    """Zeitpunkt, zu dem die Stufe func_name für eine Periode mit dieser Deadline fällig ist"""
+    if func_name == REMINDER_JOB:
+        return datetime.combine(deadline - timedelta(days=REMINDER_DAYS_BEFORE), time(REMINDER_HOUR))
+    # Abschluss nach Ablauf des Deadline-Tages
+    return datetime.combine(deadline + timedelta(days=1), time())
+
+
+def _planned_run(job: APSchedulerJob) -> Optional[datetime]:
+    """Geplanter Zeitpunkt der aktuellen Stufe; next_runt_ime liegt während eines Laufs oder nach einem Fehler später"""
+    run_date = json.loads(job.trigger_args or "{}").get('run_date')
+    return datetime.fromisoformat(run_date) if run_date else None
+
+
+def _sql_datetime(value: datetime) -> str:
+    # Format, in dem Pony Datumswerte in SQLite speichert (für Vergleiche in eigenem SQL)
+    return value.isoformat(' ', timespec='microseconds')
+
+
+def _set_stage(job: APSchedulerJob, func_name: str, run_at: datetime):
+    job.func_name = func_name
+    job.name = JOB_NAMES[func_name]
+    job.next_runt_ime = run_at
+    job.trigger_args = json.dumps({'run_date': run_at.isoformat()})
+
+
+def _create_job(period: PlanPeriod, now: datetime) -> APSchedulerJob:
+    """Legt den Job einer Periode an; ist ihre Deadline schon abgelaufen, gilt sie als abgeschlossen"""
+    close_at = job_run_time(CLOSE_JOB, period.deadline)
+    job = APSchedulerJob(
+        job_id=job_id_for(period.id),
+        name=JOB_NAMES[REMINDER_JOB],
+        func_name=REMINDER_JOB,
+        args=json.dumps([str(period.id)]),
+        kwargs="{}",
+        trigger_type="date",
+        trigger_args="{}",
+        active=close_at > now,
+        created_at=now,
+        plan_period=period
+    )
+    if close_at > now:
+        _set_stage(job, REMINDER_JOB, job_run_time(REMINDER_JOB, period.deadline))
+    else:
+        _set_stage(job, CLOSE_JOB, close_at)
+        job.next_runt_ime = None
+    return job
+
+
+def _reschedule(job: APSchedulerJob, period: PlanPeriod, now: datetime) -> Optional[datetime]:
+    """
+    Passt einen Job an den aktuellen Stand seiner Periode an (Deadline verschoben, gelöscht, wiederhergestellt).
+
+    Returns:
+        Optional[datetime]: Der nächste Lauf oder None, wenn der Job nicht (mehr) aktiv ist
+    """
+    if period.prep_delete is not None:
+        if job.active:
+            job.active = False
+        return None
+    if not job.active:
+        # Abgeschlossene Jobs (ohne nächsten Lauf) nur wieder aktivieren, wenn die Deadline verlängert wurde
+        if job.next_runt_ime is None and job_run_time(CLOSE_JOB, period.deadline) <= now:
+            return None
+        job.active = True
+        # Wieder aktivierter Job: mit der Erinnerung beginnen, sofern sie für die neue Deadline noch aussteht
+        stage = REMINDER_JOB if job_run_time(REMINDER_JOB, period.deadline) > now else CLOSE_JOB
+    else:
+        stage = job.func_name
+    run_at = job_run_time(stage, period.deadline)
+    if job.next_runt_ime is None or stage != job.func_name or _planned_run(job) != run_at:
+        _set_stage(job, stage, run_at)
+    return job.next_runt_ime
+
+
+@db_session
+def sync_jobs() -> List[Tuple[str, datetime]]:
+    """
+    Gleicht die Jobs mit allen Planungsperioden ab: legt fehlende an und passt geänderte Deadlines an.
+
+    Mengenbasiert mit zwei Abfragen, unabhängig von der Anzahl der Perioden.
+
+    Returns:
+        List[Tuple[str, datetime]]: job_id und nächster Lauf aller aktiven Jobs
+    """
+    now = datetime.now()
+    jobs = {job.plan_period.id: job for job in APSchedulerJob.select()}
+    scheduled = []
+    for period in PlanPeriod.select():
+        job = jobs.get(period.id)
+        if job is None:
+            if period.prep_delete is not None:
+                continue
+            job = _create_job(period, now)
+            run_at = job.next_runt_ime
+        else:
+            run_at = _reschedule(job, period, now)
+        if run_at is not None:
+            scheduled.append((job.job_id, run_at))
+    return scheduled
+
+
+@db_session
+def claim_job(job_id: str, expected: datetime) -> Tuple[bool, Optional[datetime]]:
+    """
+    Beansprucht den fälligen Lauf eines Jobs, bevor er ausgeführt wird.
+
+    Der Heap des Schedulers ist nur ein Hinweis: Maßgeblich ist die Zeile in der Datenbank. Ist der Job
+    fällig und steht next_runt_ime noch auf expected, wird next_runt_ime per bedingtem UPDATE auf das Ende
+    einer Frist (SCHEDULER_RETRY_MINUTES) gesetzt und festgeschrieben. Nur wer dabei genau eine Zeile
+    ändert, führt den Lauf aus; andere Worker-Prozesse sehen danach den neuen Zeitpunkt. Scheitert der
+    Lauf, ist der Job nach Ablauf der Frist erneut fällig, auch nach einem Neustart.
+
+    Returns:
+        Tuple[bool, Optional[datetime]]: Ob der Lauf beansprucht wurde und der nächste Zeitpunkt des Jobs
+        (bei Erfolg das Ende der Frist, sonst der aktuelle Stand oder None für inaktive Jobs)
+    """
+    job = APSchedulerJob.get(job_id=job_id)
+    if job is None or not job.active:
+        return False, None
+    if job.next_runt_ime != expected:
+        return False, job.next_runt_ime
+    now = datetime.now()
+    next_run = _reschedule(job, job.plan_period, now)
+    if next_run != expected or next_run > now:
+        # Periode gelöscht oder Deadline verschoben: der geänderte Stand wird beim Verlassen gespeichert
+        return False, next_run
+
+    # Änderungen von _reschedule vorher schreiben, damit Pony die Zeile beim Commit nicht erneut schreibt
+    flush()
+    lease = now + timedelta(minutes=SCHEDULER_RETRY_MINUTES)
+    job_key, lease_sql, expected_sql = job_id, _sql_datetime(lease), _sql_datetime(expected)
+    updated = db.execute('UPDATE "APSchedulerJob" SET "next_runt_ime" = $lease_sql '
+                         'WHERE "job_id" = $job_key AND "active" AND "next_runt_ime" = $expected_sql').rowcount
+    return updated == 1, lease if updated == 1 else None
+
+
+@db_session
+def execute_job(job_id: str, lease: datetime, planned: datetime) -> Optional[datetime]:
+    """
+    Führt einen mit claim_job beanspruchten Lauf aus und schaltet den Job weiter
+    (Erinnerung -> Abschluss -> inaktiv).
+
+    Returns:
+        Optional[datetime]: Der nächste Lauf des Jobs oder None, wenn er abgeschlossen bzw. inaktiv ist
+    """
+    job = APSchedulerJob.get(job_id=job_id)
+    if job is None or not job.active:
+        return None
+    if job.next_runt_ime != lease:
+        # Inzwischen geändert (z.B. Deadline verschoben): nicht mehr unser Lauf
+        return job.next_runt_ime
+    period = job.plan_period
+    now = datetime.now()
+    func_name = job.func_name
+    result = _job_functions[func_name](period, now)
+    if func_name == REMINDER_JOB:
+        _set_stage(job, CLOSE_JOB, job_run_time(CLOSE_JOB, period.deadline))
+    else:
+        job.active = False
+        job.next_runt_ime = None
+    logger.info("job finished", extra={'fields': {
+        'job_id': job_id, 'func': func_name, 'plan_period': str(period.id),
+        'delay_s': round((now - planned).total_seconds(), 1), **result}})
+    return job.next_runt_ime
+
+
+def run_job(job_id: str, expected: datetime) -> Optional[datetime]:
+    """Beansprucht und führt einen fälligen Lauf aus (claim_job, execute_job); gibt den nächsten Lauf zurück"""
+    claimed, next_run = claim_job(job_id, expected)
+    if not claimed:
+        return next_run
+    return execute_job(job_id, next_run, expected)
+
+
+def _persons_with_availabilities(period: PlanPeriod) -> set:
+    return set(select(a.employee_plan_period.person.id for a in Availability
+                      if a.employee_plan_period.plan_period == period
+                      and a.employee_plan_period.prep_delete is None and a.prep_delete is None))
+
+
+@job_function(REMINDER_JOB)
+def send_deadline_reminder(period: PlanPeriod, now: datetime) -> Dict[str, Any]:
+    """Erinnert die Mitglieder des Teams, die für die Periode noch keine Verfügbarkeit eingetragen haben"""
+    if now.date() > period.deadline:
+        # Nach einem langen Ausfall nachgeholt: Die Erinnerung käme zu spät, der Abschluss folgt direkt
+        return {'skipped': "deadline passed"}
+    members = set(select(p.id for p in Person if p.team == period.team and p.prep_delete is None))
+    recipients = sorted(members - _persons_with_availabilities(period))
+    # Die Anwendung versendet keine E-Mails; die Erinnerung geht als Ereignis an das Logging des Betriebs
+    logger.info("deadline reminder", extra={'fields': {
+        'plan_period': str(period.id), 'team': period.team.name, 'deadline': period.deadline.isoformat(),
+        'recipients': [str(person_id) for person_id in recipients]}})
+    return {'recipients': len(recipients)}
+
+
+@job_function(CLOSE_JOB)
+def close_plan_period(period: PlanPeriod, now: datetime) -> Dict[str, Any]:
+    """Schließt die Eingabe für eine Periode ab und hält fest, wie viele Mitarbeiter eingetragen haben"""
+    members = select(e for e in EmployeePlanPeriod
+                     if e.plan_period == period and e.prep_delete is None and e.person.prep_delete is None).count()
+    availabilities = select(a for a in Availability
+                            if a.employee_plan_period.plan_period == period
+                            and a.employee_plan_period.prep_delete is None and a.prep_delete is None).count()
+    return {
+        'members': members,
+        'members_with_entries': len(_persons_with_availabilities(period)),
+        'availabilities': availabilities,
+    }
+
+
+class JobScheduler:
+    """
+    Führt die Jobs der Planungsperioden im Prozess der Anwendung aus.
+
+    Die nächsten Läufe liegen in einem Min-Heap; der Scheduler schläft bis zum frühesten Eintrag oder bis
+    ein früherer eingetragen wird, statt die Tabelle abzufragen. Geänderte Einträge werden nicht aus dem
+    Heap entfernt, sondern beim Entnehmen verworfen, wenn sie nicht mehr dem aktuellen Stand entsprechen.
+    Beim Start werden alle Jobs abgeglichen; verpasste Läufe sind dann sofort fällig und werden nachgeholt.
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS, sync_minutes: float = SCHEDULER_SYNC_MINUTES,
+                 retry_minutes: float = SCHEDULER_RETRY_MINUTES):
+        self.workers = workers
+        self.sync_interval = timedelta(minutes=sync_minutes)
+        self.retry_interval = timedelta(minutes=retry_minutes)
+        # (Weckzeit, job_id, erwarteter next_runt_ime); bei Wiederholungen liegt die Weckzeit später
+        self._heap: List[Tuple[datetime, str, datetime]] = []
+        self._entries: Dict[str, Tuple[datetime, str, datetime]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def schedule(self, job_id: str, run_at: Optional[datetime], wake_at: Optional[datetime] = None):
+        """Trägt den nächsten Lauf eines Jobs ein (None entfernt ihn); nur im Event-Loop aufrufen"""
+        if run_at is None:
+            self._entries.pop(job_id, None)
+            return
+        entry = (wake_at or run_at, job_id, run_at)
+        if self._entries.get(job_id) == entry:
+            return
+        self._entries[job_id] = entry
+        heapq.heappush(self._heap, entry)
+        if self._wakeup is not None and self._heap[0] is entry:
+            self._wakeup.set()
+
+    def schedule_threadsafe(self, job_id: str, run_at: datetime):
+        """Wie schedule(), aber aus beliebigen Threads (z.B. den Signal-Empfängern in den Datenbank-Threads)"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.schedule, job_id, run_at)
+
+    def _pop_due(self, now: datetime) -> List[Tuple[str, datetime]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[1]) is entry:
+                del self._entries[entry[1]]
+                due.append((entry[1], entry[2]))
+        return due
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def _sync(self, executor):
+        for job_id, run_at in await executor.run(sync_jobs):
+            self.schedule(job_id, run_at)
+
+    async def _run_job(self, executor, job_id: str, run_at: datetime):
+        try:
+            claimed, next_run = await executor.run(claim_job, job_id, run_at)
+        except Exception:
+            logger.exception("job claim failed", extra={'fields': {'job_id': job_id}})
+            # Unverändert in der Datenbank; hier nur verzögern
+            self.schedule(job_id, run_at, datetime.now() + self.retry_interval)
+            return
+        if claimed:
+            lease = next_run
+            try:
+                next_run = await executor.run(execute_job, job_id, lease, run_at)
+            except Exception:
+                logger.exception("job failed", extra={'fields': {'job_id': job_id}})
+                # Nach Ablauf der Frist ist der Job wieder fällig (steht so auch in der Datenbank)
+                next_run = lease
+        self.schedule(job_id, next_run)
+
+    async def run(self):
+        """Läuft bis zum Abbruch des Tasks; die Jobs werden im Pool "scheduler" ausgeführt"""
+        from utils.async_db import get_named_executor
+
+        executor = get_named_executor("scheduler", self.workers)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        next_sync = datetime.min
+        try:
+            while True:
+                now = datetime.now()
+                if now >= next_sync:
+                    try:
+                        await self._sync(executor)
+                        logger.info("jobs synced", extra={'fields': {'scheduled': len(self)}})
+                        next_sync = now + self.sync_interval
+                    except Exception:
+                        # z.B. legt ein anderer Worker-Prozess gleichzeitig dieselben Jobs an: bald erneut versuchen
+                        logger.exception("job sync failed")
+                        next_sync = now + timedelta(minutes=1)
+                    continue
+                due = self._pop_due(now)
+                if due:
+                    await asyncio.gather(*(self._run_job(executor, job_id, run_at) for job_id, run_at in due))
+                    continue
+                wake_at = min(next_sync, self._heap[0][0]) if self._heap else next_sync
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), (wake_at - now).total_seconds())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = None
+            self._wakeup = None
+
+
+scheduler = JobScheduler()
+
+
+# Wie in utils.provisioning laufen die Empfänger im Flush der schreibenden db_session; der Job wird in
+# derselben Transaktion angelegt bzw. angepasst. Der laufende Scheduler erhält den neuen Termin nach dem Commit.
+def _on_plan_period_changed(plan_period, event):
+    if event == 'delete':
+        return
+    job = plan_period.apscheduler_job
+    now = datetime.now()
+    if job is None:
+        if plan_period.prep_delete is not None:
+            return
+        job = _create_job(plan_period, now)
+        run_at = job.next_runt_ime
+    else:
+        run_at = _reschedule(job, plan_period, now)
+    if run_at is not None:
+        job_id = job.job_id
+        signals.on_commit(lambda: scheduler.schedule_threadsafe(job_id, run_at))
+
+
+signals.connect('PlanPeriod', _on_plan_period_changed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Legt die Jobs der Planungsperioden an bzw. gleicht sie ab und führt fällige Jobs aus"
+    )
+    parser.add_argument("--run-due", action="store_true",
+                        help="Fällige Jobs sofort ausführen (z.B. per cron, wenn SCHEDULER_ENABLED=0 ist)")
+    args = parser.parse_args(argv)
+
+    import models  # noqa: F401  (bindet die Datenbank)
+    scheduled = sync_jobs()
+    due = sorted((run_at, job_id) for job_id, run_at in scheduled if run_at <= datetime.now())
+    print(f"Aktive Jobs: {len(scheduled)}, fällig: {len(due)}")
+    if args.run_due:
+        for run_at, job_id in due:
+            # Nach einer verpassten Erinnerung ist der Abschluss ggf. direkt im Anschluss fällig
+            while run_at is not None and run_at <= datetime.now():
+                try:
+                    next_run = run_job(job_id, run_at)
+                except Exception as e:
+                    print(f"{job_id}: {e}")
+                    break
+                if next_run == run_at:
+                    break
+                run_at = next_run
+        print(f"Ausgeführt: {len(due)} Jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
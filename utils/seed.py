@@ -0,0 +1,25 @@
+import argparse
+import os
+import sys
+
+from config import database as database_config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Legt Schema und Demo-Testdaten an, wenn die Datenbank noch keine Benutzer enthält"
+    )
+    parser.add_argument("--db", default=database_config.DB_PATH, help="Pfad zur SQLite-Datenbank")
+    args = parser.parse_args(argv)
+
+    # models bindet die Datenbank beim ersten Import an config.database.DB_PATH
+    database_config.DB_PATH = os.path.abspath(args.db)
+    from utils.migrations import create_schema, add_composite_indexes
+    create_schema()
+    add_composite_indexes(args.db)
+    database_config.create_test_data()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+import argparse
+import copy
+import os
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from pony.orm import db_session, select, delete
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+
+from utils.async_db import run_db
+
+# Sitzungsspeicher: cookie (signiertes Cookie mit allen Daten), memory oder sqlite (nur eine id im Cookie)
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cookie")
+# Gültigkeit einer Sitzung in Sekunden seit der letzten Verwendung (wie SessionMiddleware: 14 Tage)
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(14 * 24 * 60 * 60)))
+# Maximale Anzahl Sitzungen im Speicher (LRU)
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+# Wie lange eine aus SQLite gelesene Sitzung im Speicher gilt; begrenzt, wie lange ein Widerruf aus
+# einem anderen Prozess (z.B. python -m utils.sessions --revoke-user) unbemerkt bleibt
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "30"))
+
+SESSION_COOKIE = "session_id"
+
+
+def _user_id(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    user = (data or {}).get("user") or {}
+    return user.get("id")
+
+
+class MemorySessionStore:
+    """Sitzungen im Speicher des Prozesses (LRU mit gleitender TTL); gehen beim Neustart verloren"""
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE, ttl: int = SESSION_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # id -> (Daten, Ablaufzeitpunkt als time.time())
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def _put(self, session_id: str, data: Dict[str, Any], expires: float):
+        with self._lock:
+            self._entries[session_id] = (data, expires)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _discard(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def _discard_user(self, user_id: str) -> int:
+        with self._lock:
+            session_ids = [sid for sid, (data, _) in self._entries.items() if _user_id(data) == user_id]
+            for session_id in session_ids:
+                del self._entries[session_id]
+            return len(session_ids)
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._get(session_id)
+        if entry is None:
+            return None
+        # Gleitende TTL: jede Verwendung verlängert die Sitzung
+        self._put(session_id, entry[0], time.time() + self.ttl)
+        return entry[0]
+
+    async def save(self, session_id: str, data: Dict[str, Any], new: bool = False):
+        self._put(session_id, data, time.time() + self.ttl)
+
+    async def delete(self, session_id: str):
+        self._discard(session_id)
+
+    async def revoke_user(self, user_id: str) -> int:
+        """Beendet alle Sitzungen eines Benutzers und gibt ihre Anzahl zurück"""
+        return self._discard_user(user_id)
+
+
+@db_session
+def _load_session(session_id: str) -> Optional[Tuple[Dict[str, Any], datetime]]:
+    from models.entities import UserSession
+    session = UserSession.get(id=session_id)
+    if session is None or session.expires_at <= datetime.now():
+        return None
+    return session.data, session.expires_at
+
+
+@db_session
+def _save_session(session_id: str, data: Dict[str, Any], expires_at: datetime, new: bool):
+    from models.entities import UserSession
+    user_id = _user_id(data)
+    # Neue ids sind zufällig und noch nicht gespeichert, dafür ist keine Abfrage nötig
+    session = None if new else UserSession.get(id=session_id)
+    if session is None:
+        UserSession(id=session_id, data=data, user_id=uuid.UUID(user_id) if user_id else None,
+                    created_at=datetime.now(), expires_at=expires_at)
+    else:
+        session.data = data
+        session.user_id = uuid.UUID(user_id) if user_id else None
+        session.expires_at = expires_at
+
+
+@db_session
+def _touch_session(session_id: str, expires_at: datetime):
+    from models.entities import UserSession
+    session = UserSession.get(id=session_id)
+    if session is not None:
+        session.expires_at = expires_at
+
+
+@db_session
+def _delete_session(session_id: str):
+    from models.entities import UserSession
+    delete(s for s in UserSession if s.id == session_id)
+
+
+@db_session
+def _delete_user_sessions(user_id: str) -> int:
+    from models.entities import UserSession
+    user_uuid = uuid.UUID(user_id)
+    count = select(s for s in UserSession if s.user_id == user_uuid).count()
+    delete(s for s in UserSession if s.user_id == user_uuid)
+    return count
+
+
+@db_session
+def purge_expired_sessions() -> int:
+    """Löscht abgelaufene Sitzungen aus der Datenbank und gibt ihre Anzahl zurück"""
+    from models.entities import UserSession
+    now = datetime.now()
+    count = select(s for s in UserSession if s.expires_at <= now).count()
+    delete(s for s in UserSession if s.expires_at <= now)
+    return count
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """
+    Sitzungen in der Tabelle UserSession, die einen Neustart überdauern. Davor liegt ein LRU-Cache,
+    dessen Einträge SESSION_CACHE_TTL Sekunden gelten, sodass die meisten Requests ohne Abfrage auskommen.
+    Die Tabelle legt python -m utils.migrations an.
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE, ttl: int = SESSION_TTL,
+                 cache_ttl: float = SESSION_CACHE_TTL):
+        super().__init__(max_entries, ttl)
+        self.cache_ttl = cache_ttl
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._get(session_id)
+        if entry is not None:
+            return entry[0]
+        loaded = await run_db(_load_session, session_id)
+        if loaded is None:
+            return None
+        data, expires_at = loaded
+        # Ablaufzeit erst verlängern, wenn weniger als die Hälfte der TTL übrig ist (spart Schreibzugriffe)
+        if expires_at - datetime.now() < timedelta(seconds=self.ttl / 2):
+            await run_db(_touch_session, session_id, datetime.now() + timedelta(seconds=self.ttl))
+        self._put(session_id, data, time.time() + self.cache_ttl)
+        return data
+
+    async def save(self, session_id: str, data: Dict[str, Any], new: bool = False):
+        await run_db(_save_session, session_id, data, datetime.now() + timedelta(seconds=self.ttl), new)
+        self._put(session_id, data, time.time() + self.cache_ttl)
+
+    async def delete(self, session_id: str):
+        self._discard(session_id)
+        await run_db(_delete_session, session_id)
+
+    async def revoke_user(self, user_id: str) -> int:
+        self._discard_user(user_id)
+        return await run_db(_delete_user_sessions, user_id)
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> Optional[MemorySessionStore]:
+    """Gibt den Sitzungsspeicher für SESSION_BACKEND zurück (None: signiertes Cookie der SessionMiddleware)"""
+    if backend == "cookie":
+        return None
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unbekanntes SESSION_BACKEND '{backend}', erlaubt: cookie, memory, sqlite")
+
+
+class ServerSessionMiddleware:
+    """
+    Ersatz für SessionMiddleware mit serverseitigem Speicher: request.session funktioniert unverändert,
+    das Cookie enthält aber nur eine zufällige Sitzungs-id.
+
+    Wie bei SessionMiddleware wird das Cookie für jede bestehende Sitzung mit jeder Antwort erneut gesetzt,
+    sodass seine max-age der gleitenden TTL des Speichers folgt; gespeichert wird nur, wenn sich die Sitzung
+    ändert. Wechselt der angemeldete Benutzer (Login), erhält die Sitzung eine neue id; eine geleerte
+    Sitzung (Logout) wird gelöscht.
+    """
+
+    def __init__(self, app, store: MemorySessionStore, cookie_name: str = SESSION_COOKIE,
+                 max_age: int = SESSION_TTL, path: str = "/", same_site: str = "lax", https_only: bool = False):
+        self.app = app
+        self.store = store
+        self.cookie_name = cookie_name
+        self.max_age = max_age
+        self.cookie_flags = f"path={path}; httponly; samesite={same_site}" + ("; secure" if https_only else "")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get(self.cookie_name)
+        initial = await self.store.load(session_id) if session_id else None
+        # Kopie, damit Änderungen im Request den gespeicherten Stand nicht vorab verändern
+        scope["session"] = copy.deepcopy(initial) if initial else {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                cookie = await self._commit(session_id, initial, scope["session"])
+                if cookie is not None:
+                    MutableHeaders(scope=message).append("Set-Cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _commit(self, session_id: Optional[str], initial: Optional[Dict[str, Any]],
+                      session: Dict[str, Any]) -> Optional[str]:
+        """Speichert eine geänderte Sitzung und gibt den zu setzenden Cookie-Header zurück (oder None)"""
+        if session == (initial or {}):
+            if session_id and initial is None:
+                # Unbekannte oder abgelaufene id: Cookie entfernen
+                return f"{self.cookie_name}=null; {self.cookie_flags}; max-age=0"
+            if initial:
+                # Unveränderte Sitzung: nur die Gültigkeit des Cookies verlängern (load hat die TTL verlängert)
+                return f"{self.cookie_name}={session_id}; {self.cookie_flags}; max-age={self.max_age}"
+            return None
+        if not session:
+            if initial is not None:
+                await self.store.delete(session_id)
+            return f"{self.cookie_name}=null; {self.cookie_flags}; max-age=0"
+
+        new = initial is None or _user_id(initial) != _user_id(session)
+        if new:
+            # Neue id bei neuer Sitzung oder Benutzerwechsel (Schutz vor Session Fixation)
+            if initial is not None:
+                await self.store.delete(session_id)
+            session_id = secrets.token_urlsafe(32)
+        await self.store.save(session_id, session, new)
+        return f"{self.cookie_name}={session_id}; {self.cookie_flags}; max-age={self.max_age}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verwaltet serverseitige Sitzungen (SESSION_BACKEND=sqlite)")
+    parser.add_argument("--revoke-user", metavar="USER_ID", help="Alle Sitzungen eines Benutzers beenden")
+    parser.add_argument("--purge-expired", action="store_true", help="Abgelaufene Sitzungen löschen")
+    args = parser.parse_args(argv)
+
+    import models  # noqa: F401  (bindet die Datenbank)
+    if args.revoke_user:
+        print(f"Beendete Sitzungen: {_delete_user_sessions(args.revoke_user)}")
+    if args.purge_expired:
+        print(f"Gelöschte abgelaufene Sitzungen: {purge_expired_sessions()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import threading
+import uuid
+from typing import Dict, Optional
+
+from pony.orm import db_session
+
+from models import schemas, signals
+from models.entities import TimeOfDay
+
+# Prozessinterner Cache: person_id -> {tod_id: TimeOfDaySlim}
+_cache: Dict[str, Dict[str, schemas.TimeOfDaySlim]] = {}
+# Generation pro Person, damit ein Ladevorgang, der eine Invalidierung überholt, nichts Veraltetes speichert
+_generations: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+@db_session
+def _load_time_of_days(person_id: str) -> Dict[str, schemas.TimeOfDaySlim]:
+    """Lädt alle Tageszeiten einer Person (auch gelöschte, da sie noch in Verfügbarkeiten vorkommen können)"""
+    person_uuid = uuid.UUID(person_id)
+    times = TimeOfDay.select(lambda t: t.person.id == person_uuid)
+    return {str(tod.id): schemas.TimeOfDaySlim.model_validate(tod) for tod in times}
+
+
+def get_time_of_days_slim(person_id: str) -> Dict[str, schemas.TimeOfDaySlim]:
+    """Gibt alle Tageszeiten einer Person als schlanke Projektion zurück, bei Bedarf aus dem Cache"""
+    with _lock:
+        cached = _cache.get(person_id)
+        generation = _generations.get(person_id, 0)
+    if cached is not None:
+        return cached
+
+    loaded = _load_time_of_days(person_id)
+    with _lock:
+        if _generations.get(person_id, 0) == generation:
+            _cache[person_id] = loaded
+    return loaded
+
+
+def get_time_of_day_slim(person_id: str, tod_id: str) -> Optional[schemas.TimeOfDaySlim]:
+    """Holt eine einzelne Tageszeit einer Person, ohne ihre Verfügbarkeiten zu laden"""
+    return get_time_of_days_slim(person_id).get(tod_id)
+
+
+def invalidate(person_id: Optional[str] = None):
+    """Verwirft den Cache einer Person oder, ohne Angabe, den gesamten Cache"""
+    with _lock:
+        if person_id is None:
+            for key in list(_generations) + list(_cache):
+                _generations[key] = _generations.get(key, 0) + 1
+            _cache.clear()
+        else:
+            _generations[person_id] = _generations.get(person_id, 0) + 1
+            _cache.pop(person_id, None)
+
+
+def _on_time_of_day_changed(tod, event):
+    person_id = str(tod.person.id)
+    signals.on_commit(lambda: invalidate(person_id))
+
+
+signals.connect('TimeOfDay', _on_time_of_day_changed)